@@ -0,0 +1,359 @@
+import os
+import sys
+import json
+import argparse
+from time import sleep
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from egms_codecs import CODEC_SUFFIXES, OUTPUT_CODEC, strip_codec_suffix, tile_files
+from egms_download import DEFAULT_ID, DOWNLOAD_BASE, l2_tile_key, l3_tile_key, parse_tile_filename
+from egms_cluster import QUEUE_PATH
+import egms_profile
+
+# Configuration
+DEFAULT_YEAR = "2019_2023"
+CONCURRENCY = 4      # Tasks running at once across all jobs of an invocation
+DELAY = 1.0          # seconds each worker waits after a request
+
+def build_parser():
+    """Command line interface: egms <command> [options]"""
+    parser = argparse.ArgumentParser(prog="egms", description="EGMS download and processing tool")
+    parser.add_argument("--jobs", help="JSON Lines file with one job per line (keys match the options below)")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="tasks run in parallel across all jobs")
+    parser.add_argument("--profile", nargs="?", const="trace", metavar="MODES",
+                        help="write stage timings to Point_profiles/ (trace, cprofile, memory or all; "
+                             "default trace). cProfile sees the tasks only with --concurrency 1")
+    parser.add_argument("--queue", metavar="PATH",
+                        help="coordinator: add the download tasks to a shared SQLite work queue instead of "
+                             "running them (see the worker command)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="with --queue, also drain the queue with this many local worker processes")
+    parser.add_argument("--export", metavar="PATH",
+                        help="write the download jobs' tiles as a JSON Lines manifest ('-' for stdout) "
+                             "instead of downloading them")
+    parser.add_argument("--probe", action="store_true",
+                        help="with --export, ask the server for each tile's sizes and CRC and leave out "
+                             "tiles it does not have")
+    subparsers = parser.add_subparsers(dest="command")
+
+    download = subparsers.add_parser("download", help="download L2A/L2B/L3 tiles")
+    download.add_argument("--level", choices=["L2A", "L2B", "L3"], default="L3")
+    download.add_argument("--year", default=DEFAULT_YEAR, help="2018_2022, 2019_2023 or 2020_2024")
+    download.add_argument("--id", default=DEFAULT_ID, help="EGMS download token")
+    download.add_argument("--output", default=DOWNLOAD_BASE)
+    download.add_argument("--delay", type=float, default=DELAY)
+    download.add_argument("--codec", choices=list(CODEC_SUFFIXES), default=OUTPUT_CODEC,
+                          help="store tiles as plain CSV or compressed (read transparently by enrich/convert)")
+    # L3 parameters; a single value or MIN MAX
+    download.add_argument("--east", type=int, nargs="+", default=[32])
+    download.add_argument("--north", type=int, nargs="+", default=[31])
+    download.add_argument("--displacement", nargs="+", choices=["E", "U"], default=["U"])
+    # L2 parameters; a single value or MIN MAX
+    download.add_argument("--orbit", type=int, nargs="+", default=[52])
+    download.add_argument("--burst", type=int, nargs="+", default=[716])
+    download.add_argument("--swath", nargs="+", default=["IW2"])
+    download.add_argument("--polarization", nargs="+", default=["VV"])
+    # Planned downloads instead of ranges
+    download.add_argument("--manifest", help="download the tiles of a manifest file ('-' for stdin) "
+                                             "instead of the ranges above")
+    download.add_argument("--shard", metavar="I/N", help="only the I-th of N disjoint parts of the tiles")
+
+    enrich = subparsers.add_parser("enrich", help="add location names to downloaded CSVs")
+    enrich.add_argument("inputs", nargs="*", help="CSV files (default: every tile in --directory)")
+    enrich.add_argument("--directory", default=DOWNLOAD_BASE)
+    enrich.add_argument("--mode", choices=["csv", "table"], default="csv",
+                        help="csv: tile copy with a location column, table: compact pid -> place side table")
+    enrich.add_argument("--force", action="store_true",
+                        help="enrich files again even if already done (interrupted runs resume either way)")
+
+    convert = subparsers.add_parser("convert", help="derive datasets from downloaded tiles")
+    convert.add_argument("--to", choices=["mosaic", "eu", "stats", "locations", "packed"], default="stats",
+                         help="mosaic: merged CSV, eu: E/U columnar stores, stats: time-series statistics, "
+                              "locations: join place side tables back into tile copies, "
+                              "packed: quantized block-compressed tiles (.egq)")
+    convert.add_argument("--directory", default=DOWNLOAD_BASE)
+    convert.add_argument("--pattern", default="EGMS_L3_*.csv", help="tiles to merge for --to mosaic")
+    convert.add_argument("--output", default=None)
+
+    index = subparsers.add_parser("index", help="write a JSON index of the local tile collection")
+    index.add_argument("--directory", default=DOWNLOAD_BASE)
+    index.add_argument("--output", default=None)
+
+    worker = subparsers.add_parser("worker", help="run tasks from a shared work queue until it is drained")
+    worker.add_argument("queue_path", nargs="?", default=QUEUE_PATH, metavar="QUEUE")
+    worker.add_argument("--name", help="worker name shown in the queue status (default host-pid)")
+    worker.add_argument("--wait", action="store_true", help="keep polling for new tasks once the queue is empty")
+    worker.add_argument("--processes", type=int, default=1, help="worker processes on this node")
+
+    status = subparsers.add_parser("queue", help="show a work queue's progress and workers")
+    status.add_argument("queue_path", nargs="?", default=QUEUE_PATH, metavar="QUEUE")
+    status.add_argument("--retry-failed", action="store_true", help="queue failed tasks again")
+
+    return parser
+
+def value_range(values):
+    """Expand a [value] or [min, max] option into an inclusive range"""
+    return range(values[0], values[-1] + 1)
+
+def download_keys(job):
+    """Tile keys of a download job, in the order of the batch tools' nested loops"""
+    if job.level == "L3":
+        return [l3_tile_key(e, n, d)
+                for e in value_range(job.east)
+                for n in value_range(job.north)
+                for d in job.displacement]
+    return [l2_tile_key(job.level, orbit, burst, swath, polarization)
+            for orbit in value_range(job.orbit)
+            for burst in value_range(job.burst)
+            for swath in job.swath
+            for polarization in job.polarization]
+
+def download_entries(job):
+    """Manifest entries of a download job (its --manifest, or its ranges), deduplicated and sharded"""
+    from egms_manifest import dedupe, manifest_entry, parse_shard, read_manifest, shard
+
+    if job.manifest:
+        entries = read_manifest(job.manifest)
+    else:
+        entries = [manifest_entry(key, job.year, job.id) for key in download_keys(job)]
+    entries = dedupe(entries)
+    if job.shard:
+        entries = shard(entries, *parse_shard(job.shard))
+    return entries
+
+def download_tasks(job):
+    """Expand a download job into one task per tile"""
+    from egms_download import download_tile
+    from egms_manifest import expectations
+
+    def task(entry):
+        path = download_tile(entry["tile_key"], entry["year"], job.id, job.output, codec=job.codec,
+                             url=entry["url"], expect=expectations(entry))
+        sleep(job.delay)
+        return path is not None
+
+    return [(f"download {entry['tile_key']}", lambda entry=entry: task(entry)) for entry in download_entries(job)]
+
+def enrich_tasks(job):
+    """One task per CSV; L2 and L3 files use their respective enrichers"""
+    inputs = job.inputs
+    if not inputs:
+        # Downloaded tiles only (not statistics or other derived CSVs), in any codec
+        inputs = [path for path in tile_files(job.directory)
+                  if parse_tile_filename(strip_codec_suffix(path))[0]]
+
+    def task(path):
+        if "_L3_" in os.path.basename(path):
+            from egms_L3_locations import enrich_csv_with_locations
+        else:
+            from egms_L2_locations import enrich_csv_with_locations
+        # False when the geocoder failed; the next run resumes from the checkpoint
+        return enrich_csv_with_locations(path, job.mode, job.force) is not False
+
+    return [(f"enrich {os.path.basename(path)}", lambda path=path: task(path)) for path in inputs]
+
+def convert_tasks(job):
+    """Conversions operate on a whole directory; stats runs one task per tile"""
+    if job.to == "mosaic":
+        from egms_merge import merge_tiles
+        source = os.path.join(job.directory, job.pattern)
+        return [(f"mosaic {source}", lambda: merge_tiles(source, job.output))]
+
+    if job.to == "eu":
+        from egms_decompose import DECOMPOSED_DIR, decompose_all
+        return [(f"eu {job.directory}", lambda: decompose_all(job.directory, job.output or DECOMPOSED_DIR) > 0)]
+
+    if job.to == "locations":
+        from egms_places import has_place_table, join_locations
+        return [(f"locations {os.path.basename(path)}", lambda path=path: join_locations(path) is not None)
+                for path in tile_files(job.directory) if has_place_table(path)]
+
+    if job.to == "packed":
+        from egms_packed import PACKED_DIR, pack_tile
+        return [(f"packed {os.path.basename(path)}", lambda path=path: pack_tile(path, job.output or PACKED_DIR) is not None)
+                for path in tile_files(job.directory) if parse_tile_filename(strip_codec_suffix(path))[0]]
+
+    from egms_analytics import analyze_tile, find_tiles
+    return [(f"stats {os.path.basename(path)}", lambda path=path: analyze_tile(path) is not None)
+            for path in find_tiles(job.directory)]
+
+def index_tasks(job):
+    """Write {tile_key: {year: {path, bytes}}} for a directory"""
+    from egms_sync import scan_collection
+
+    def task():
+        collection = scan_collection(job.directory)
+        index = {
+            tile_key: {year: {"path": path, "bytes": os.path.getsize(path)} for year, path in releases.items()}
+            for tile_key, releases in collection.items()
+        }
+        output = job.output or os.path.join(job.directory, "index.json")
+        with open(output, "w") as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        print(f"Indexed {len(index)} tile(s) into {output}")
+        return True
+
+    return [(f"index {job.directory}", task)]
+
+TASK_BUILDERS = {
+    "download": download_tasks,
+    "enrich": enrich_tasks,
+    "convert": convert_tasks,
+    "index": index_tasks,
+}
+
+def load_jobs(parser, path):
+    """Read a JSON Lines parameter file into argparse namespaces"""
+    jobs = []
+    with open(path, "r") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            spec = json.loads(line)
+            command = spec.pop("command", None)
+            if command not in TASK_BUILDERS:
+                parser.error(f"{path}:{line_no}: unknown command {command!r}")
+            # Start from the subcommand defaults, then apply the job's own values
+            job = parser.parse_args([command])
+            for key, value in spec.items():
+                key = key.replace("-", "_")
+                if not hasattr(job, key):
+                    parser.error(f"{path}:{line_no}: unknown option {key!r} for {command}")
+                # Scalars are accepted for options that take one or more values
+                if isinstance(getattr(job, key), list) and not isinstance(value, list):
+                    value = [value]
+                setattr(job, key, value)
+            jobs.append(job)
+    return jobs
+
+def report(i, total, name, result):
+    """Print a task outcome; returns 1 if it failed"""
+    try:
+        ok = result()
+    except Exception as e:
+        print(f"Error in {name}: {e}")
+        ok = False
+    print(f"[{i}/{total}] {'✓' if ok else '✗'} {name}")
+    return 0 if ok else 1
+
+def run_tasks(tasks, concurrency):
+    """Run every task on one shared worker pool; returns the number of failures"""
+    if concurrency == 1:
+        # In the calling thread, where a --profile cprofile run can see them
+        return sum(report(i, len(tasks), name, run) for i, (name, run) in enumerate(tasks, 1))
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(run): name for name, run in tasks}
+        for i, future in enumerate(as_completed(futures), 1):
+            failed += report(i, len(tasks), futures[future], future.result)
+    return failed
+
+def run_worker_command(args):
+    """egms worker / egms queue"""
+    from egms_cluster import WorkQueue, print_status, run_local, run_worker
+
+    if not os.path.exists(args.queue_path):
+        print(f"No queue at {args.queue_path}")
+        return 1
+    if args.command == "queue":
+        queue = WorkQueue(args.queue_path)
+        if args.retry_failed:
+            print(f"Queued {queue.retry_failed()} failed task(s) again")
+        print_status(queue)
+        return 0
+
+    print(f"=== EGMS worker on {args.queue_path} ===")
+    if args.processes > 1:
+        return run_local(args.queue_path, args.processes, args.concurrency)
+    done, failed = run_worker(args.queue_path, args.name, args.concurrency, args.wait)
+    print(f"\n=== Summary ===")
+    print(f"Successful: {done}")
+    print(f"Failed: {failed}")
+    return 1 if failed else 0
+
+def coordinate(jobs, args):
+    """Shard the download jobs' tiles into the work queue, optionally draining it locally"""
+    from egms_cluster import WorkQueue, download_payloads, print_status, run_local
+
+    queue = WorkQueue(args.queue)
+    entries = []
+    for job in jobs:
+        if job.command != "download":
+            print(f"Skipping {job.command} job: only downloads are distributed")
+            continue
+        entries.extend(download_payloads(job, download_entries(job)))
+    added = queue.enqueue(entries)
+    print(f"=== EGMS coordinator: {added} new task(s) of {len(entries)} in {args.queue} ===")
+    status = 0
+    if args.workers > 0:
+        status = run_local(args.queue, args.workers, args.concurrency)
+    else:
+        print(f"Start workers on each node with: python egms.py --concurrency N worker {args.queue}")
+    print_status(queue)
+    counts = queue.counts()
+    return 1 if counts["failed"] or status else 0
+
+def export_manifest(jobs, args):
+    """Plan the download jobs into one manifest without downloading anything"""
+    from egms_manifest import dedupe, probed_entries, write_manifest
+
+    entries = []
+    for job in jobs:
+        if job.command != "download":
+            continue
+        planned = download_entries(job)
+        if args.probe:
+            # Tiles of one job share a release; manifests may mix them
+            for year in dict.fromkeys(entry["year"] for entry in planned):
+                entries.extend(probed_entries([e["tile_key"] for e in planned if e["year"] == year], year, job.id))
+        else:
+            entries.extend(planned)
+    count = write_manifest(dedupe(entries), args.export)
+    if args.export != "-":
+        print(f"Wrote {count} tile(s) to {args.export}")
+    return 0
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.profile:
+        try:
+            egms_profile.start(egms_profile.parse_modes(args.profile), run=f"egms_{args.command or 'jobs'}")
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.command in ("worker", "queue"):
+        return run_worker_command(args)
+
+    jobs = []
+    if args.jobs:
+        jobs.extend(load_jobs(parser, args.jobs))
+    if args.command:
+        jobs.append(args)
+    if not jobs:
+        parser.print_help()
+        return 2
+    try:
+        if args.export:
+            return export_manifest(jobs, args)
+        if args.queue:
+            return coordinate(jobs, args)
+
+        tasks = []
+        for job in jobs:
+            tasks.extend(TASK_BUILDERS[job.command](job))
+    except ValueError as e:   # Unreadable manifests and shards
+        parser.error(str(e))
+
+    print(f"=== EGMS: {len(jobs)} job(s), {len(tasks)} task(s), concurrency {args.concurrency} ===")
+    failed = run_tasks(tasks, args.concurrency)
+
+    print(f"\n=== Summary ===")
+    print(f"Successful: {len(tasks) - failed}")
+    print(f"Failed: {failed}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,23 @@
 import os
 import csv
-from tqdm import tqdm
-from geopy.geocoders import Nominatim
-import pyproj
-from time import sleep
+from collections import deque
+from itertools import islice
+
+from egms_codecs import open_tile, strip_codec_suffix
+from egms_places import enrich_place_table
+from egms_geocode import GeocodingError, default_geocoder
+from egms_profile import span, stage, timed_iter
+from egms_checkpoint import Checkpoint, is_enriched
+
+# tqdm and pyproj are imported where they are used, so the script starts
+# (and reports a missing input file) without paying for their import time
 
 # Configuration
 NAMES_DATASETS_DIR = "Point_locations"
+# "csv": copy of the tile with a location column
+# "table": pid -> place_id side table plus a place dictionary, ~1/100 of the size
+#          (egms_places.join_locations builds the full copy on demand)
+OUTPUT_MODE = "csv"
 
 # L2 dataset CSV path - update this to your downloaded L2 file
 INPUT_CSV_PATH = "Point_downloads/EGMS_L2a_052_0716_IW2_VV_2018_2022_1.csv"
@@ -14,6 +25,7 @@ INPUT_CSV_PATH = "Point_downloads/EGMS_L2a_052_0716_IW2_VV_2018_2022_1.csv"
 def init_transformer():
     """Initialize coordinate transformer from ETRS89/LAEA Europe to WGS84"""
     try:
+        import pyproj
         # EPSG:3035 is ETRS89-extended / LAEA Europe (commonly used for EGMS data)
         # EPSG:4326 is WGS84 (standard latitude/longitude)
         return pyproj.Transformer.from_crs("EPSG:3035", "EPSG:4326", always_xy=True)
@@ -41,24 +53,15 @@ def get_location_name(latitude, longitude):
     """Get location name for the given coordinates"""
     if latitude is None or longitude is None:
         return "Unknown location"
-        
-    geolocator = Nominatim(user_agent="egms-l2-cli")
-    try:
-        location = geolocator.reverse((latitude, longitude), exactly_one=True)
-        if location:
-            address = location.raw.get('address', {})
-            city = address.get('city', address.get('town', address.get('village', '')))
-            country = address.get('country', '')
-            if city and country:
-                return f"{city}, {country}"
-            return location.address
-        return "Unknown location"
-    except Exception as e:
-        print(f"Error in geocoding: {e}")
-        return "Geocoding error"
+    # Shared backend (EGMS_GEOCODER): one session, cache or spatial index for the whole run
+    return default_geocoder().reverse(latitude, longitude)
 
-def enrich_csv_with_locations(input_file):
-    """Add location names to each point in the L2 CSV file"""
+def enrich_csv_with_locations(input_file, mode=OUTPUT_MODE, force=False):
+    """Add location names to each point in the L2 CSV file
+    
+    Progress is checkpointed: an interrupted run resumes where it stopped, and files
+    already enriched are skipped unless `force` is set.
+    """
     if not os.path.exists(input_file):
         print(f"File not found: {input_file}")
         return
@@ -66,19 +69,36 @@ def enrich_csv_with_locations(input_file):
     # Create the names datasets directory if it doesn't exist
     os.makedirs(NAMES_DATASETS_DIR, exist_ok=True)
     
-    # Get the base filename without path and extension
-    base_filename = os.path.splitext(os.path.basename(input_file))[0]
+    # Get the base filename without path, extension and compression suffix
+    base_filename = os.path.splitext(strip_codec_suffix(os.path.basename(input_file)))[0]
     output_file = os.path.join(NAMES_DATASETS_DIR, f"{base_filename}_locations.csv")
     
+    from tqdm import tqdm
+    
     # Initialize coordinate transformer
     transformer = init_transformer()
     if transformer is None:
         print("Warning: Using approximate coordinate conversion")
     
     try:
-        with open(input_file, 'r') as infile, open(output_file, 'w', newline='') as outfile:
-            reader = csv.reader(infile)
-            writer = csv.writer(outfile)
+        if mode == "table":
+            # Only pid and coordinates are needed: parse them as typed columns, not row lists
+            table_path = enrich_place_table(input_file, transformer, default_geocoder(), NAMES_DATASETS_DIR, force)
+            if table_path:
+                print(f"L2 location dataset saved as: {table_path}")
+            return
+        
+        if not force and is_enriched(input_file, output_file):
+            print(f"Already enriched: {output_file}")
+            return
+        
+        checkpoint = Checkpoint(input_file, output_file)
+        done = checkpoint.load()
+        if done:
+            print(f"Resuming after {done} rows (checkpoint {checkpoint.path})")
+        
+        with span("enrich", file=base_filename, mode=mode), open_tile(input_file) as infile:
+            reader = timed_iter("parse", csv.reader(infile))
             
             # Read header
             header = next(reader)
@@ -109,30 +129,50 @@ def enrich_csv_with_locations(input_file):
             new_header = header.copy()
             new_header.insert(northing_idx + 1, 'location')
             
-            # Write the new header
-            writer.writerow(new_header)
+            writer = csv.writer(checkpoint.open())
+            if checkpoint.offset == 0:
+                writer.writerow(new_header)
+            
+            # Rows finished by an earlier run are skipped before any projection or lookup
+            deque(islice(reader, done), maxlen=0)
+            
+            def located_rows():
+                for row in reader:
+                    # Convert from easting/northing to lat/lon
+                    with stage("project"):
+                        lat, lon = convert_coordinates(row[easting_idx], row[northing_idx], transformer)
+                    yield row, lat, lon
+            
+            # Lookups are batched or run ahead on the geocoding workers; the backend applies any rate limit
+            # and resolves repeated coordinates once
+            located = timed_iter("geocode", default_geocoder().reverse_stream(located_rows()))
             
             # Process each row
-            for row in tqdm(reader, desc="Processing L2 coordinates"):
-                easting = row[easting_idx]
-                northing = row[northing_idx]
-                
-                # Convert from easting/northing to lat/lon
-                lat, lon = convert_coordinates(easting, northing, transformer)
-                
-                # Get location name using converted coordinates
-                location = get_location_name(lat, lon)
-                sleep(0.5)  # 0.5s delay between requests to avoid overwhelming the service
-                
-                # Copy original row and insert location after northing
-                new_row = row.copy()
-                new_row.insert(northing_idx + 1, location)
-                
-                # Write the updated row
-                writer.writerow(new_row)
+            rows = done
+            try:
+                for row, location in tqdm(located, desc="Processing L2 coordinates", initial=done):
+                    # Copy original row and insert location after northing
+                    new_row = row.copy()
+                    new_row.insert(northing_idx + 1, location)
+                    
+                    # Write the updated row
+                    with stage("write"):
+                        writer.writerow(new_row)
+                    
+                    rows += 1
+                    if checkpoint.due(rows):
+                        checkpoint.save(rows)
+            except BaseException as e:
+                # Geocoder outages and Ctrl-C keep the rows written so far for the next run
+                checkpoint.abandon(rows, error=e)
+                raise
+            checkpoint.finish()
                 
         print(f"L2 location dataset saved as: {output_file}")
     
+    except GeocodingError as e:
+        print(f"{e}; progress is saved, run again to resume")
+        return False
     except Exception as e:
         print(f"Error processing L2 CSV: {e}")
         import traceback
@@ -146,7 +186,7 @@ def find_l2_files():
     
     l2_files = []
     for file in os.listdir(download_dir):
-        if file.endswith(".csv") and ("L2a_" in file or "L2b_" in file):
+        if strip_codec_suffix(file).endswith(".csv") and ("L2a_" in file or "L2b_" in file):
             l2_files.append(os.path.join(download_dir, file))
     
     return l2_files
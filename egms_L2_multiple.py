@@ -1,12 +1,18 @@
-import os
+import sys
 import zipfile
 from io import BytesIO
 import curl_cffi.requests as curl_requests
+from egms_codecs import extract_member, stored_tile
+from egms_locks import tile_lock
+from egms_manifest import manifest_entry, probe_entry, write_manifest
+from egms_profile import span
+from egms_download import l2_tile_key, probe_tiles, summarize_probes
 from time import sleep
 
 # Configuration
 BASE_URL = "https://egms.land.copernicus.eu/insar-api/archive/download/EGMS_{data_type}_{relative_orbit}_{burst_cycle}_{swath}_{polarization}_{year}_1.zip?id={id}"
 DOWNLOAD_BASE = "Point_downloads"
+OUTPUT_CODEC = "csv"  # "csv", "gzip" or "zstd" (compressed tiles are read transparently)
 ID = "7ce01544f73b4a9780b56f9c96fe4de3"
 YEAR = "2018_2022"  # 2018_2022, 2019_2023, 2020_2024
 DATA_TYPE = "L2a"   # L2a or L2b
@@ -19,6 +25,8 @@ BURST_CYCLE_MAX = 717
 SWATHS = ["IW1", "IW2", "IW3"]         # Available swaths
 POLARIZATIONS = ["VV", "VH"]           # Available polarizations
 DELAY = 5  # seconds between requests to avoid overwhelming the server
+PROBE_FIRST = False  # List tiles on the server (archive tails only) and skip the missing ones
+MANIFEST_OUT = None  # Path: write the planned tiles as a manifest (JSON Lines) instead of downloading
 
 def download_tile(data_type, relative_orbit, burst_cycle, swath, polarization):
     """Download a single L2 tile with given parameters"""
@@ -38,24 +46,30 @@ def download_tile(data_type, relative_orbit, burst_cycle, swath, polarization):
     )
     
     try:
-        response = curl_requests.get(url, timeout=600)  # 10 minutes timeout
-        print(f"Response for {filename_prefix}: {response.status_code}")
-        
-        if response.status_code != 200:
-            print(f"Failed to download {filename_prefix}")
-            sleep(10)  # Extra delay after failure
-            return False
-        
-        # Create download directory if it doesn't exist
-        os.makedirs(DOWNLOAD_BASE, exist_ok=True)
-        
-        # Read zip from memory
-        with zipfile.ZipFile(BytesIO(response.content)) as z:
-            for name in z.namelist():
-                if name.endswith(".csv") and filename_prefix in name:
-                    z.extract(name, path=DOWNLOAD_BASE)
-                    print(f"Extracted {name}")
-                    return True
+        # Parallel runs take turns on a tile; whoever comes second finds it stored
+        with tile_lock(DOWNLOAD_BASE, filename_prefix):
+            existing = stored_tile(DOWNLOAD_BASE, filename_prefix)
+            if existing:
+                print(f"Already downloaded: {existing}")
+                return True
+            
+            with span("fetch", tile=filename_prefix):
+                response = curl_requests.get(url, timeout=600)  # 10 minutes timeout
+            print(f"Response for {filename_prefix}: {response.status_code}")
+            
+            if response.status_code != 200:
+                print(f"Failed to download {filename_prefix}")
+                sleep(10)  # Extra delay after failure
+                return False
+            
+            # Read zip from memory
+            with span("unzip", tile=filename_prefix), zipfile.ZipFile(BytesIO(response.content)) as z:
+                for name in z.namelist():
+                    if name.endswith(".csv") and filename_prefix in name:
+                        with span("extract", tile=filename_prefix):
+                            extract_member(z, name, DOWNLOAD_BASE, OUTPUT_CODEC)
+                        print(f"Extracted {name}")
+                        return True
         
         print(f"No matching CSV found in the downloaded zip for {filename_prefix}")
         return False
@@ -85,13 +99,43 @@ if __name__ == "__main__":
     
     successful = 0
     failed = 0
+    skipped = 0
     current_task = 0
+    missing = set()
+    
+    keys = [l2_tile_key(DATA_TYPE, rel_orbit, burst_cycle, swath, polarization)
+            for rel_orbit in range(RELATIVE_ORBIT_MIN, RELATIVE_ORBIT_MAX + 1)
+            for burst_cycle in range(BURST_CYCLE_MIN, BURST_CYCLE_MAX + 1)
+            for swath in SWATHS for polarization in POLARIZATIONS]
+    
+    if PROBE_FIRST:
+        print(f"\nProbing {len(keys)} combinations...")
+        probes = probe_tiles(keys, YEAR, ID)
+        found, archive_bytes, csv_bytes = summarize_probes(probes)
+        print(f"Available: {found}/{len(keys)} files, {archive_bytes / 1024 ** 2:.1f} MB to download, "
+              f"{csv_bytes / 1024 ** 2:.1f} MB extracted")
+        missing = {p["tile_key"] for p in probes if p["exists"] is False}
+    
+    if MANIFEST_OUT:
+        # Plan only; probed tiles carry their expected sizes and CRC, absent ones are left out
+        if PROBE_FIRST:
+            entries = [probe_entry(p, ID) for p in probes if p["exists"] is not False]
+        else:
+            entries = [manifest_entry(key, YEAR, ID) for key in keys]
+        write_manifest(entries, MANIFEST_OUT)
+        print(f"Wrote {len(entries)} tiles to {MANIFEST_OUT}; download them with "
+              f"python egms.py download --manifest {MANIFEST_OUT}")
+        sys.exit(0)
     
     for rel_orbit in range(RELATIVE_ORBIT_MIN, RELATIVE_ORBIT_MAX + 1):
         for burst_cycle in range(BURST_CYCLE_MIN, BURST_CYCLE_MAX + 1):
             for swath in SWATHS:
                 for polarization in POLARIZATIONS:
                     current_task += 1
+                    if l2_tile_key(DATA_TYPE, rel_orbit, burst_cycle, swath, polarization) in missing:
+                        skipped += 1
+                        continue
+                    
                     rel_orbit_str = f"{rel_orbit:03d}"
                     burst_cycle_str = f"{burst_cycle:04d}"
                     
@@ -115,4 +159,6 @@ if __name__ == "__main__":
     print(f"Total combinations attempted: {total_combinations}")
     print(f"Successfully downloaded: {successful}")
     print(f"Failed: {failed}")
+    if PROBE_FIRST:
+        print(f"Skipped (not on server): {skipped}")
     print(f"Success rate: {(successful/total_combinations)*100:.1f}%") 
\ No newline at end of file
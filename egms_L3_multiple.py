@@ -1,18 +1,26 @@
-import os
+import sys
 import zipfile
 from io import BytesIO
 import curl_cffi.requests as curl_requests
+from egms_codecs import extract_member, stored_tile
+from egms_locks import tile_lock
+from egms_manifest import manifest_entry, probe_entry, write_manifest
+from egms_profile import span
+from egms_download import l3_tile_key, probe_tiles, summarize_probes
 from time import sleep
 
 # Configuration
 BASE_URL = "https://egms.land.copernicus.eu/insar-api/archive/download/EGMS_L3_E{e}N{n}_100km_{d}_{year}_1.zip?id={id}"
 DOWNLOAD_BASE = "Point_downloads"
+OUTPUT_CODEC = "csv"  # "csv", "gzip" or "zstd" (compressed tiles are read transparently)
 ID = "7ce01544f73b4a9780b56f9c96fe4de3"
 YEAR = "2018_2022" # 2018_2022, 2019_2023, 2020_2024
 N_MIN = 27; N_MAX = 27
 E_MIN = 33; E_MAX = 34
 DISPLACEMENT_TYPES = ["U"]  # Options: "E" for East-West, "U" for Up-Down
 DELAY = 5  # seconds between requests to avoid overwhelming the server
+PROBE_FIRST = False  # List tiles on the server (archive tails only) and skip the missing ones
+MANIFEST_OUT = None  # Path: write the planned tiles as a manifest (JSON Lines) instead of downloading
 
 def download_tile(e, n, d):
     """Download a single tile with given coordinates and displacement type"""
@@ -21,24 +29,30 @@ def download_tile(e, n, d):
     url = BASE_URL.format(e=e, n=n, d=d, year=YEAR, id=ID)
     
     try:
-        response = curl_requests.get(url, timeout=600)  # 10 minutes timeout
-        print(f"Response for {tile_code} {d}: {response.status_code}")
-        
-        if response.status_code != 200:
-            print(f"Failed to download {tile_code} {d}")
-            sleep(10)
-            return False
-        
-        # Create download directory if it doesn't exist
-        os.makedirs(DOWNLOAD_BASE, exist_ok=True)
-        
-        # Read zip from memory
-        with zipfile.ZipFile(BytesIO(response.content)) as z:
-            for name in z.namelist():
-                if name.endswith(".csv") and filename_prefix in name:
-                    z.extract(name, path=DOWNLOAD_BASE)
-                    print(f"Extracted {name}")
-                    return True
+        # Parallel runs take turns on a tile; whoever comes second finds it stored
+        with tile_lock(DOWNLOAD_BASE, filename_prefix):
+            existing = stored_tile(DOWNLOAD_BASE, filename_prefix)
+            if existing:
+                print(f"Already downloaded: {existing}")
+                return True
+            
+            with span("fetch", tile=filename_prefix):
+                response = curl_requests.get(url, timeout=600)  # 10 minutes timeout
+            print(f"Response for {tile_code} {d}: {response.status_code}")
+            
+            if response.status_code != 200:
+                print(f"Failed to download {tile_code} {d}")
+                sleep(10)
+                return False
+            
+            # Read zip from memory
+            with span("unzip", tile=filename_prefix), zipfile.ZipFile(BytesIO(response.content)) as z:
+                for name in z.namelist():
+                    if name.endswith(".csv") and filename_prefix in name:
+                        with span("extract", tile=filename_prefix):
+                            extract_member(z, name, DOWNLOAD_BASE, OUTPUT_CODEC)
+                        print(f"Extracted {name}")
+                        return True
         
         print(f"No matching CSV found in the downloaded zip for {tile_code} {d}")
         return False
@@ -54,10 +68,38 @@ if __name__ == "__main__":
     total_tiles = (E_MAX - E_MIN + 1) * (N_MAX - N_MIN + 1) * len(DISPLACEMENT_TYPES)
     successful = 0
     failed = 0
+    skipped = 0
+    missing = set()
+    
+    keys = [l3_tile_key(e, n, d) for e in range(E_MIN, E_MAX + 1)
+            for n in range(N_MIN, N_MAX + 1) for d in DISPLACEMENT_TYPES]
+    
+    if PROBE_FIRST:
+        print(f"\nProbing {len(keys)} tiles...")
+        probes = probe_tiles(keys, YEAR, ID)
+        found, archive_bytes, csv_bytes = summarize_probes(probes)
+        print(f"Available: {found}/{len(keys)} tiles, {archive_bytes / 1024 ** 2:.1f} MB to download, "
+              f"{csv_bytes / 1024 ** 2:.1f} MB extracted")
+        missing = {p["tile_key"] for p in probes if p["exists"] is False}
+    
+    if MANIFEST_OUT:
+        # Plan only; probed tiles carry their expected sizes and CRC, absent ones are left out
+        if PROBE_FIRST:
+            entries = [probe_entry(p, ID) for p in probes if p["exists"] is not False]
+        else:
+            entries = [manifest_entry(key, YEAR, ID) for key in keys]
+        write_manifest(entries, MANIFEST_OUT)
+        print(f"Wrote {len(entries)} tiles to {MANIFEST_OUT}; download them with "
+              f"python egms.py download --manifest {MANIFEST_OUT}")
+        sys.exit(0)
     
     for e in range(E_MIN, E_MAX + 1):
         for n in range(N_MIN, N_MAX + 1):
             for d in DISPLACEMENT_TYPES:
+                if l3_tile_key(e, n, d) in missing:
+                    skipped += 1
+                    continue
+                
                 print(f"\nProcessing E{e}N{n} {d}...")
                 
                 success = download_tile(e, n, d)
@@ -77,4 +119,6 @@ if __name__ == "__main__":
     print(f"\n=== Download Summary ===")
     print(f"Total tiles: {total_tiles}")
     print(f"Successfully downloaded: {successful}")
-    print(f"Failed: {failed}") 
\ No newline at end of file
+    print(f"Failed: {failed}")
+    if PROBE_FIRST:
+        print(f"Skipped (not on server): {skipped}") 
\ No newline at end of file
@@ -1,11 +1,13 @@
-import os
 import zipfile
 from io import BytesIO
 import curl_cffi.requests as curl_requests
+from egms_codecs import extract_member, stored_tile
+from egms_locks import tile_lock
 
 # Configuration
 BASE_URL = "https://egms.land.copernicus.eu/insar-api/archive/download/EGMS_L3_E{e}N{n}_100km_{d}_{year}_1.zip?id={id}"
 DOWNLOAD_BASE = "Point_downloads"
+OUTPUT_CODEC = "csv"  # "csv", "gzip" or "zstd" (compressed tiles are read transparently)
 ID = "7ce01544f73b4a9780b56f9c96fe4de3"
 YEAR="2018_2022" # 2018_2022, 2019_2023, 2020_2024
 N_COORD = 27; E_COORD = 40; DISPLACEMENT_TYPE = "U"  # Options: "E" for East-West, "U" for Up-Down
@@ -17,23 +19,27 @@ def download_tile(e, n, d):
     url = BASE_URL.format(e=e, n=n, d=d, year=YEAR, id=ID)
     
     try:
-        response = curl_requests.get(url, timeout=600)  # 10 minutes timeout
-        print(f"Response for {tile_code} {d}: {response.status_code}")
-        
-        if response.status_code != 200:
-            print(f"Failed to download {tile_code} {d}")
-            return False
-        
-        # Create download directory if it doesn't exist
-        os.makedirs(DOWNLOAD_BASE, exist_ok=True)
-        
-        # Read zip from memory
-        with zipfile.ZipFile(BytesIO(response.content)) as z:
-            for name in z.namelist():
-                if name.endswith(".csv") and filename_prefix in name:
-                    z.extract(name, path=DOWNLOAD_BASE)
-                    print(f"Extracted {name}")
-                    return True
+        # Parallel runs take turns on a tile; whoever comes second finds it stored
+        with tile_lock(DOWNLOAD_BASE, filename_prefix):
+            existing = stored_tile(DOWNLOAD_BASE, filename_prefix)
+            if existing:
+                print(f"Already downloaded: {existing}")
+                return True
+            
+            response = curl_requests.get(url, timeout=600)  # 10 minutes timeout
+            print(f"Response for {tile_code} {d}: {response.status_code}")
+            
+            if response.status_code != 200:
+                print(f"Failed to download {tile_code} {d}")
+                return False
+            
+            # Read zip from memory
+            with zipfile.ZipFile(BytesIO(response.content)) as z:
+                for name in z.namelist():
+                    if name.endswith(".csv") and filename_prefix in name:
+                        extract_member(z, name, DOWNLOAD_BASE, OUTPUT_CODEC)
+                        print(f"Extracted {name}")
+                        return True
         
         print(f"No matching CSV found in the downloaded zip for {tile_code} {d}")
         return False
@@ -0,0 +1,138 @@
+import os
+import csv
+from datetime import date
+import numpy as np
+
+from egms_codecs import strip_codec_suffix, tile_files
+from egms_download import parse_tile_filename
+from egms_reader import iter_chunks, read_schema
+
+# Configuration
+DOWNLOAD_BASE = "Point_downloads"
+STATS_DIR = "Point_stats"   # Kept apart from the tiles, so merge/decompose/sync never take them for one
+INPUT_PATTERN = "EGMS_*.csv"
+CHUNK_ROWS = 200000      # Points fitted per batch; bounds memory to CHUNK_ROWS x epochs floats
+ANOMALY_SIGMA = 3.0      # Residuals beyond this many RMSEs are flagged as anomalies
+STATS_SUFFIX = "_stats"
+
+STATS_HEADER = [
+    "pid", "velocity", "acceleration", "seasonal_amplitude", "seasonal_phase",
+    "rmse", "anomaly_count", "anomaly_flag",
+]
+
+def parse_dates(columns):
+    """Convert YYYYMMDD column names into decimal years relative to the first epoch"""
+    days = np.array([date(int(c[:4]), int(c[4:6]), int(c[6:8])).toordinal() for c in columns], dtype=np.float64)
+    return (days - days[0]) / 365.25
+
+def design_matrix(t):
+    """Model: offset + velocity*t + 0.5*acceleration*t^2 + annual sine/cosine"""
+    omega = 2 * np.pi * t
+    return np.column_stack([np.ones_like(t), t, t ** 2, np.sin(omega), np.cos(omega)])
+
+def iter_tile_blocks(path, chunk_rows=CHUNK_ROWS):
+    """Yield (pids, dates, displacement matrix) blocks of a tile CSV"""
+    schema = read_schema(path)
+    dates = schema.date_columns
+    pid = schema.find("pid")
+    offset = 0
+    for chunk in iter_chunks(path, ([pid] if pid else []) + dates, chunk_rows, schema=schema):
+        values = chunk.matrix(dates) if dates else chunk.values
+        pids = chunk[pid] if pid else np.arange(offset, offset + len(chunk)).astype(str)
+        offset += len(chunk)
+        yield pids, dates, values
+
+def fit_block(A, values):
+    """Least-squares fit of all points at once; returns coefficients and residual matrix"""
+    n_points = values.shape[0]
+    coefs = np.full((n_points, A.shape[1]), np.nan)
+    residuals = np.full_like(values, np.nan)
+
+    # Points sharing the same set of valid epochs are solved together with one pseudo-inverse
+    valid = ~np.isnan(values)
+    complete = valid.all(axis=1)
+    groups = [(np.flatnonzero(complete), np.ones(values.shape[1], dtype=bool))]
+    if not complete.all():
+        gappy = np.flatnonzero(~complete)
+        packed = np.packbits(valid[gappy], axis=1)
+        _, first, inverse = np.unique(packed, axis=0, return_index=True, return_inverse=True)
+        inverse = inverse.ravel()
+        # One stable sort splits the gappy points into their patterns, in row order
+        order = np.argsort(inverse, kind="stable")
+        members = np.split(gappy[order], np.cumsum(np.bincount(inverse, minlength=len(first)))[:-1])
+        for rows, row in zip(members, first):
+            groups.append((rows, valid[gappy[row]]))
+
+    for rows, pattern in groups:
+        if len(rows) == 0 or pattern.sum() < A.shape[1]:
+            continue
+        A_p = A[pattern]
+        Y = values[rows][:, pattern]
+        solution = Y @ np.linalg.pinv(A_p).T
+        coefs[rows] = solution
+        fitted = np.full((len(rows), values.shape[1]), np.nan)
+        fitted[:, pattern] = Y - solution @ A_p.T
+        residuals[rows] = fitted
+
+    return coefs, residuals
+
+def compute_statistics(pids, dates, values):
+    """Per-point velocity, acceleration, seasonal amplitude/phase and anomaly flags"""
+    A = design_matrix(parse_dates(dates))
+    coefs, residuals = fit_block(A, values)
+
+    rmse = np.sqrt(np.nanmean(residuals ** 2, axis=1))
+    anomaly_count = np.sum(np.abs(residuals) > ANOMALY_SIGMA * rmse[:, None], axis=1)
+
+    return {
+        "pid": pids,
+        "velocity": coefs[:, 1],                              # mm/year
+        "acceleration": 2 * coefs[:, 2],                      # mm/year^2
+        "seasonal_amplitude": np.hypot(coefs[:, 3], coefs[:, 4]),
+        "seasonal_phase": np.degrees(np.arctan2(coefs[:, 4], coefs[:, 3])),
+        "rmse": rmse,
+        "anomaly_count": anomaly_count,
+        "anomaly_flag": (anomaly_count > 0).astype(np.int8),
+    }
+
+def analyze_tile(input_file, output_file=None):
+    """Compute time-series statistics for a tile and write them to STATS_DIR/<tile>_stats.csv"""
+    if not os.path.exists(input_file):
+        print(f"File not found: {input_file}")
+        return None
+
+    if output_file is None:
+        base, _ = os.path.splitext(strip_codec_suffix(os.path.basename(input_file)))
+        os.makedirs(STATS_DIR, exist_ok=True)
+        output_file = os.path.join(STATS_DIR, f"{base}{STATS_SUFFIX}.csv")
+
+    points = 0
+    with np.errstate(invalid="ignore"):
+        with open(output_file, "w", newline="") as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(STATS_HEADER)
+            for pids, dates, values in iter_tile_blocks(input_file):
+                if not dates:
+                    print(f"No date columns found in {input_file}")
+                    return None
+                stats = compute_statistics(pids, dates, values)
+                columns = [stats["pid"]] + [np.round(stats[name], 4) for name in STATS_HEADER[1:6]]
+                columns += [stats["anomaly_count"], stats["anomaly_flag"]]
+                writer.writerows(zip(*(column.tolist() for column in columns)))
+                points += len(pids)
+
+    print(f"Statistics for {points} points saved as: {output_file}")
+    return output_file
+
+def find_tiles(directory=DOWNLOAD_BASE):
+    """Find downloaded tiles, skipping derived CSVs (such as statistics written by older versions)"""
+    return [path for path in tile_files(directory, INPUT_PATTERN) if parse_tile_filename(strip_codec_suffix(path))[0]]
+
+if __name__ == "__main__":
+    print("=== EGMS Time-Series Analytics ===")
+    tiles = find_tiles()
+    if not tiles:
+        print(f"No tiles found in {DOWNLOAD_BASE}")
+    for tile in tiles:
+        print(f"\nAnalyzing: {os.path.basename(tile)}")
+        analyze_tile(tile)
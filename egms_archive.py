@@ -0,0 +1,96 @@
+import os
+import zlib
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from egms_codecs import BATCH_ZIP_LEVEL
+
+# Configuration
+WORKERS = os.cpu_count() or 1   # Members compressed in parallel
+ZIP64_LIMIT = 0xFFFFFFFF        # Sizes/offsets from here on need ZIP64 records
+
+LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+CENTRAL_HEADER = struct.Struct("<4sHHHHHHIIIHHHHHII")
+END_RECORD = struct.Struct("<4sHHHHIIH")
+ZIP64_END_RECORD = struct.Struct("<4sQHHIIQQQQ")
+ZIP64_LOCATOR = struct.Struct("<4sIQI")
+UTF8_FLAG = 0x800
+ZIP64_MARKER = 0xFFFFFFFF
+
+def field(value):
+    """32-bit header field, or the marker pointing to the ZIP64 value"""
+    return ZIP64_MARKER if value >= ZIP64_LIMIT else value
+
+def compress_member(data, level):
+    """(crc, compressed bytes) of one member; raw deflate as stored inside a ZIP"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return zlib.crc32(data), compressor.compress(data) + compressor.flush()
+
+def dos_timestamp(timestamp=None):
+    """(time, date) fields of a ZIP header"""
+    t = time.localtime(timestamp)
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), \
+           ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+def zip64_extra(*values):
+    """ZIP64 extended information field holding the given 8-byte values"""
+    return struct.pack("<HH", 1, 8 * len(values)) + struct.pack(f"<{len(values)}Q", *values)
+
+def assemble_zip(members):
+    """Build a ZIP from (name, method, crc, size, compressed bytes) members"""
+    mtime, mdate = dos_timestamp()
+    parts, central, offset = [], [], 0
+
+    for name, method, crc, size, payload in members:
+        name = name.encode("utf-8")
+        csize = len(payload)
+        big = size >= ZIP64_LIMIT or csize >= ZIP64_LIMIT
+        version = 45 if big or offset >= ZIP64_LIMIT else 20
+
+        local_extra = zip64_extra(size, csize) if big else b""
+        parts.append(LOCAL_HEADER.pack(
+            b"PK\x03\x04", version, UTF8_FLAG, method, mtime, mdate, crc,
+            ZIP64_MARKER if big else csize, ZIP64_MARKER if big else size, len(name), len(local_extra)))
+        parts += [name, local_extra, payload]
+
+        # The central entry carries ZIP64 values only for the fields that overflow, in this order
+        overflow = [v for v in (size, csize, offset) if v >= ZIP64_LIMIT]
+        extra = zip64_extra(*overflow) if overflow else b""
+        central.append(CENTRAL_HEADER.pack(
+            b"PK\x01\x02", version, version, UTF8_FLAG, method, mtime, mdate, crc,
+            field(csize), field(size), len(name), len(extra), 0, 0, 0, 0o644 << 16, field(offset)))
+        central += [name, extra]
+
+        offset += LOCAL_HEADER.size + len(name) + len(local_extra) + csize
+
+    directory = b"".join(central)
+    count = len(members)
+    parts.append(directory)
+    if count >= 0xFFFF or offset >= ZIP64_LIMIT or len(directory) >= ZIP64_LIMIT:
+        zip64_end = offset + len(directory)
+        parts.append(ZIP64_END_RECORD.pack(b"PK\x06\x06", ZIP64_END_RECORD.size - 12, 45, 45, 0, 0,
+                                           count, count, len(directory), offset))
+        parts.append(ZIP64_LOCATOR.pack(b"PK\x06\x07", 0, zip64_end, 1))
+    parts.append(END_RECORD.pack(b"PK\x05\x06", 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                                 field(len(directory)), field(offset), 0))
+    return b"".join(parts)
+
+def build_batch_zip(files_data, level=BATCH_ZIP_LEVEL, workers=WORKERS):
+    """ZIP of (filename, bytes) pairs, deflating members in parallel; level 0 stores them"""
+    files_data = [(name, data) for name, data in files_data if data is not None]
+
+    if level == 0:
+        members = [(name, 0, zlib.crc32(data), len(data), data) for name, data in files_data]
+        return assemble_zip(members)
+
+    datas = [data for _, data in files_data]
+    if workers > 1 and len(files_data) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(files_data))) as executor:
+            compressed = list(executor.map(compress_member, datas, [level] * len(datas)))
+    else:
+        compressed = [compress_member(data, level) for data in datas]
+
+    members = [(name, 8, crc, len(data), payload)
+               for (name, data), (crc, payload) in zip(files_data, compressed)]
+    return assemble_zip(members)
@@ -0,0 +1,54 @@
+import sys
+import subprocess
+from statistics import median
+from time import perf_counter
+
+# Configuration
+MODULES = [
+    "egms",
+    "egms_download",
+    "egms_L3_locations",
+    "egms_L2_locations",
+    "egms_web",
+]
+RUNS = 5  # Fresh interpreters per module; the median is reported
+
+def time_command(code):
+    """Wall time of a fresh interpreter running `code`"""
+    start = perf_counter()
+    subprocess.run([sys.executable, "-c", code], check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return perf_counter() - start
+
+def bench_import(module, runs=RUNS):
+    """Median import time of a module, excluding bare interpreter start-up"""
+    baseline = median(time_command("pass") for _ in range(runs))
+    try:
+        elapsed = median(time_command(f"import {module}") for _ in range(runs))
+    except subprocess.CalledProcessError:
+        return None
+    return elapsed - baseline
+
+def slowest_imports(module, limit=10):
+    """Top cumulative entries of `python -X importtime` for a module"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True)
+    entries = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            entries.append((int(parts[1]), parts[2].strip()))
+    return sorted(entries, reverse=True)[:limit]
+
+if __name__ == "__main__":
+    print("=== EGMS Startup Benchmark ===")
+    modules = sys.argv[1:] or MODULES
+    for module in modules:
+        elapsed = bench_import(module)
+        if elapsed is None:
+            print(f"{module:<20} import failed (missing dependency?)")
+            continue
+        print(f"{module:<20} {elapsed * 1000:8.1f} ms")
+        for cumulative, name in slowest_imports(module, limit=3):
+            print(f"    {cumulative / 1000:8.1f} ms  {name}")
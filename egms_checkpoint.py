@@ -0,0 +1,114 @@
+import os
+import io
+import json
+import time
+
+# Configuration
+CHECKPOINT_ROWS = 5000       # Save progress at least every this many output rows...
+CHECKPOINT_SECONDS = 60      # ...or this often, whichever comes first
+WRITE_BUFFER = 1024 * 1024
+PARTIAL_SUFFIX = ".partial"
+CHECKPOINT_SUFFIX = ".checkpoint.json"
+
+def is_enriched(input_file, output_file):
+    """True if output_file was completed from the current input_file
+
+    Outputs only get their final name once complete, so an output with no
+    checkpoint beside it that is not older than its input is done.
+    """
+    return (os.path.exists(output_file) and not os.path.exists(output_file + CHECKPOINT_SUFFIX)
+            and os.path.getmtime(output_file) >= os.path.getmtime(input_file))
+
+class Checkpoint:
+    """Progress of one enrichment output, so a crashed or interrupted run resumes where it stopped
+
+    Rows are written to `<output>.partial`. Every CHECKPOINT_ROWS rows or
+    CHECKPOINT_SECONDS seconds the partial file is flushed to disk and
+    `<output>.checkpoint.json` records the rows done, the partial file's length
+    and any `state` the writer needs, such as a place dictionary. A resumed run
+    truncates the partial file to that length and skips the recorded input rows.
+    finish() renames the partial file to the output.
+    """
+
+    def __init__(self, input_file, output_file, every_rows=CHECKPOINT_ROWS, every_seconds=CHECKPOINT_SECONDS):
+        self.output_file = output_file
+        self.partial_path = output_file + PARTIAL_SUFFIX
+        self.path = output_file + CHECKPOINT_SUFFIX
+        self.every_rows = every_rows
+        self.every_seconds = every_seconds
+        stat = os.stat(input_file)
+        # A re-downloaded input invalidates the checkpoint
+        self.source = {"input": os.path.abspath(input_file), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        self.rows = 0
+        self.offset = 0
+        self.state = {}
+        self.handle = None
+        self.saved_rows = 0
+        self.saved_at = time.monotonic()
+
+    def load(self):
+        """Pick up a previous run's progress; returns the number of rows already done"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        if (saved.get("source") != self.source or not os.path.exists(self.partial_path)
+                or os.path.getsize(self.partial_path) < saved.get("offset", 0)):
+            return 0
+        self.rows = self.saved_rows = saved["rows"]
+        self.offset = saved["offset"]
+        self.state = saved.get("state", {})
+        return self.rows
+
+    def open(self):
+        """Text handle on the partial output, positioned after the checkpointed rows"""
+        if self.offset:
+            raw = open(self.partial_path, "r+b", buffering=WRITE_BUFFER)
+            raw.truncate(self.offset)   # Rows written after the last checkpoint are written again
+            raw.seek(self.offset)
+        else:
+            raw = open(self.partial_path, "wb", buffering=WRITE_BUFFER)
+        self.handle = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+        return self.handle
+
+    def due(self, rows):
+        return rows - self.saved_rows >= self.every_rows or time.monotonic() - self.saved_at >= self.every_seconds
+
+    def save(self, rows, state=None):
+        """Flush the partial output to disk and record `rows` as done"""
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+        self.rows = self.saved_rows = rows
+        self.offset = os.fstat(self.handle.fileno()).st_size
+        if state is not None:
+            self.state = state
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"source": self.source, "rows": rows, "offset": self.offset, "state": self.state}, f)
+        os.replace(tmp_path, self.path)
+        self.saved_at = time.monotonic()
+
+    def finish(self):
+        """Close the partial output, give it the output name and drop the checkpoint"""
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+        self.handle.close()
+        os.replace(self.partial_path, self.output_file)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def abandon(self, rows, state=None, error=None):
+        """Stop without finishing, saving progress for the next run
+
+        After a failed write (OSError) the partial file may end mid-row, so
+        only the last checkpoint is kept; geocoder outages and Ctrl-C save
+        every row written so far.
+        """
+        if self.handle is None or self.handle.closed:
+            return
+        try:
+            if not isinstance(error, OSError):
+                self.save(rows, state)
+        finally:
+            self.handle.close()
@@ -0,0 +1,307 @@
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import threading
+import multiprocessing
+from contextlib import contextmanager
+
+# Configuration
+QUEUE_PATH = os.environ.get("EGMS_QUEUE", os.path.join("Point_downloads", "queue.sqlite"))
+LEASE_SECONDS = 120      # A task whose worker stops heartbeating is handed out again after this long
+HEARTBEAT_SECONDS = 30   # Workers extend their leases this often
+POLL_SECONDS = 5         # Idle workers look for new or expired tasks this often
+MAX_ATTEMPTS = 3         # Tries per task (failures and expired leases) before it is marked failed
+BUSY_TIMEOUT = 60        # Seconds a connection waits for another process's write lock
+
+STATES = ("queued", "leased", "done", "failed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    key TEXT UNIQUE NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    result TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, id);
+CREATE TABLE IF NOT EXISTS workers (
+    name TEXT PRIMARY KEY,
+    host TEXT,
+    pid INTEGER,
+    heartbeat REAL,
+    done INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+class Task:
+    """A leased unit of work: the queue row id, its key and the JSON payload to run"""
+
+    def __init__(self, id, key, payload, attempts):
+        self.id = id
+        self.key = key
+        self.payload = json.loads(payload)
+        self.attempts = attempts
+
+class WorkQueue:
+    """Task queue shared by a coordinator and workers through one SQLite file
+
+    Put the file on storage every node mounts. Writers serialise on SQLite's
+    database lock, and the default rollback journal is kept because WAL does
+    not work over network file systems. Workers lease tasks for LEASE_SECONDS
+    and extend the lease while they run. When a worker dies its lease expires
+    and the task goes to another worker, up to MAX_ATTEMPTS tries.
+    """
+
+    def __init__(self, path=QUEUE_PATH, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per operation, so threads and processes never share one
+        db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    @contextmanager
+    def _write(self):
+        """Transaction holding the write lock from the start, so a read-then-update is atomic"""
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    def enqueue(self, tasks):
+        """Add (key, payload dict) pairs; keys already queued are kept as they are. Returns the count added"""
+        now = time.time()
+        with self._write() as db:
+            before = db.total_changes
+            db.executemany("INSERT OR IGNORE INTO tasks (key, payload, updated) VALUES (?, ?, ?)",
+                           [(key, json.dumps(payload, sort_keys=True), now) for key, payload in tasks])
+            return db.total_changes - before
+
+    def lease(self, worker):
+        """Take the oldest queued task, or one whose lease expired; returns a Task or None"""
+        now = time.time()
+        with self._write() as db:
+            db.execute("UPDATE tasks SET state = 'failed', result = 'lease expired ' || attempts || ' time(s)', "
+                       "updated = ? WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                       (now, now, self.max_attempts))
+            row = db.execute("SELECT id, key, payload, attempts FROM tasks WHERE state = 'queued' "
+                             "OR (state = 'leased' AND lease_until < ?) ORDER BY id LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE tasks SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, "
+                       "updated = ? WHERE id = ?", (worker, now + self.lease_seconds, now, row[0]))
+        return Task(row[0], row[1], row[2], row[3] + 1)
+
+    def heartbeat(self, worker, task_ids=()):
+        """Record that a worker is alive and extend the leases it still holds"""
+        now = time.time()
+        with self._write() as db:
+            db.execute("INSERT INTO workers (name, host, pid, heartbeat) VALUES (?, ?, ?, ?) "
+                       "ON CONFLICT(name) DO UPDATE SET heartbeat = excluded.heartbeat",
+                       (worker, socket.gethostname(), os.getpid(), now))
+            db.executemany("UPDATE tasks SET lease_until = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+                           [(now + self.lease_seconds, task_id, worker) for task_id in task_ids])
+
+    def complete(self, task, worker, ok, result=""):
+        """Report a task's outcome; failed tasks are queued again until MAX_ATTEMPTS
+
+        Returns False if the lease had expired and the task went to another worker.
+        """
+        if ok:
+            state = "done"
+        else:
+            state = "queued" if task.attempts < self.max_attempts else "failed"
+        now = time.time()
+        with self._write() as db:
+            updated = db.execute("UPDATE tasks SET state = ?, result = ?, lease_until = NULL, updated = ? "
+                                 "WHERE id = ? AND worker = ? AND state = 'leased'",
+                                 (state, str(result), now, task.id, worker)).rowcount
+            # A discarded result is not counted for the worker
+            if updated == 1:
+                column = "done" if ok else "failed"
+                db.execute(f"UPDATE workers SET {column} = {column} + 1 WHERE name = ?", (worker,))
+        return updated == 1
+
+    def retry_failed(self):
+        """Queue failed tasks again with fresh attempts; returns the count"""
+        with self._write() as db:
+            return db.execute("UPDATE tasks SET state = 'queued', attempts = 0, worker = NULL, updated = ? "
+                              "WHERE state = 'failed'", (time.time(),)).rowcount
+
+    def counts(self):
+        """{state: tasks}, every state present"""
+        with self._connect() as db:
+            rows = dict(db.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+        return {state: rows.get(state, 0) for state in STATES}
+
+    def workers(self):
+        """Worker rows as dicts, most recent heartbeat first"""
+        with self._connect() as db:
+            rows = db.execute("SELECT name, host, pid, heartbeat, done, failed FROM workers "
+                              "ORDER BY heartbeat DESC").fetchall()
+        return [dict(zip(("name", "host", "pid", "heartbeat", "done", "failed"), row)) for row in rows]
+
+    def failures(self, limit=20):
+        """(key, result) of failed tasks"""
+        with self._connect() as db:
+            return db.execute("SELECT key, result FROM tasks WHERE state = 'failed' ORDER BY id LIMIT ?",
+                              (limit,)).fetchall()
+
+def run_download(payload):
+    """Download one tile described by a task payload; returns (ok, result)"""
+    from egms_download import download_tile
+
+    path = download_tile(payload["tile_key"], payload["year"], payload["id"], payload["output"],
+                         codec=payload.get("codec"), url=payload.get("url"), expect=payload.get("expect"))
+    time.sleep(payload.get("delay", 0))
+    return path is not None, path or "download failed"
+
+# Task runners by payload "command"
+RUNNERS = {
+    "download": run_download,
+}
+
+def download_payloads(job, entries):
+    """(key, payload) queue entries for the manifest entries of an egms.py download job"""
+    from egms_manifest import entry_key, expectations
+
+    return [(entry_key(entry), {
+        "command": "download", "tile_key": entry["tile_key"], "year": entry["year"], "id": job.id,
+        "url": entry["url"], "expect": expectations(entry),
+        "output": job.output, "codec": job.codec, "delay": job.delay,
+    }) for entry in entries]
+
+def execute(task):
+    """Run a task's payload; returns (ok, result)"""
+    runner = RUNNERS.get(task.payload.get("command"))
+    if runner is None:
+        return False, f"unknown command {task.payload.get('command')!r}"
+    try:
+        return runner(task.payload)
+    except Exception as e:
+        return False, f"{type(e).__name__}: {e}"
+
+def default_worker_name():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def run_worker(path=QUEUE_PATH, name=None, concurrency=1, wait=False, lease_seconds=LEASE_SECONDS):
+    """Lease and run tasks until the queue is drained (or forever with `wait`); returns (done, failed)"""
+    queue = WorkQueue(path, lease_seconds)
+    name = name or default_worker_name()
+    held = set()
+    held_lock = threading.Lock()
+    stop = threading.Event()
+    totals = {"done": 0, "failed": 0}
+
+    def heartbeat():
+        while not stop.wait(HEARTBEAT_SECONDS):
+            with held_lock:
+                task_ids = list(held)
+            try:
+                queue.heartbeat(name, task_ids)
+            except sqlite3.Error as e:
+                print(f"[{name}] Heartbeat failed: {e}")
+
+    def loop():
+        while not stop.is_set():
+            task = queue.lease(name)
+            if task is None:
+                counts = queue.counts()
+                # Leases held by others may still expire and come back, so drain means none left at all
+                if not wait and counts["queued"] == 0 and counts["leased"] == 0:
+                    return
+                stop.wait(POLL_SECONDS)
+                continue
+            with held_lock:
+                held.add(task.id)
+            print(f"[{name}] {task.key} (attempt {task.attempts})")
+            ok, result = execute(task)
+            with held_lock:
+                held.discard(task.id)
+            if not queue.complete(task, name, ok, result):
+                print(f"[{name}] Lease on {task.key} expired; its result was discarded")
+                continue
+            with held_lock:
+                totals["done" if ok else "failed"] += 1
+            print(f"[{name}] {'✓' if ok else '✗'} {task.key}")
+
+    queue.heartbeat(name)
+    beat = threading.Thread(target=heartbeat, name="egms-heartbeat", daemon=True)
+    beat.start()
+    threads = [threading.Thread(target=loop, name=f"egms-worker-{i}") for i in range(max(1, concurrency))]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        # Running tasks finish; their leases would otherwise expire and be retried elsewhere
+        print(f"[{name}] Stopping after the running tasks...")
+        stop.set()
+        for thread in threads:
+            thread.join()
+    stop.set()
+    return totals["done"], totals["failed"]
+
+def _local_worker(path, name, concurrency):
+    done, failed = run_worker(path, name, concurrency)
+    # The exit code is all the parent sees of this process
+    sys.exit(1 if failed else 0)
+
+def run_local(path=QUEUE_PATH, processes=2, concurrency=1):
+    """Drain the queue with worker processes on this host (one node's share, or a test of the setup)
+
+    Returns an exit code: 0 when every worker ran all its tasks successfully,
+    1 when one had failed tasks or died.
+    """
+    workers = [multiprocessing.Process(target=_local_worker, args=(path, f"{socket.gethostname()}-local{i}", concurrency))
+               for i in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    failed = [worker.name for worker in workers if worker.exitcode != 0]
+    if failed:
+        print(f"{len(failed)} of {processes} local worker(s) had failed tasks or exited abnormally")
+    return 1 if failed else 0
+
+def print_status(queue):
+    counts = queue.counts()
+    print(f"Tasks: {sum(counts.values())} ({', '.join(f'{n} {state}' for state, n in counts.items())})")
+    now = time.time()
+    for worker in queue.workers():
+        age = now - (worker["heartbeat"] or 0)
+        print(f"  {worker['name']:<30} {worker['done']:>6} done {worker['failed']:>4} failed  "
+              f"last seen {age:.0f}s ago{' (stale)' if age > LEASE_SECONDS else ''}")
+    for key, result in queue.failures():
+        print(f"  ✗ {key}: {result}")
+
+if __name__ == "__main__":
+    print("=== EGMS Work Queue ===")
+    path = sys.argv[1] if len(sys.argv) > 1 else QUEUE_PATH
+    if not os.path.exists(path):
+        print(f"No queue at {path}")
+        sys.exit(1)
+    print(f"Queue: {path}")
+    print_status(WorkQueue(path))
@@ -0,0 +1,137 @@
+import io
+import os
+import glob
+import gzip
+import shutil
+from contextlib import nullcontext
+
+# Configuration
+OUTPUT_CODEC = "csv"   # Stored tiles: "csv" (plain), "gzip" or "zstd"
+GZIP_LEVEL = 6         # 1 (fastest) .. 9 (smallest)
+ZSTD_LEVEL = 3         # 1 .. 19; 3 is close to gzip -6 in size at several times the speed
+ZSTD_THREADS = -1      # Compression threads; -1 uses every core
+BATCH_ZIP_LEVEL = 6    # Deflate level of batch archives; 0 stores members without compressing
+COPY_CHUNK = 1024 * 1024
+WRITE_BUFFER = 8 * 1024 * 1024   # Buffered bytes per write to disk while a tile is stored
+PARTIAL_SUFFIX = ".part"        # Tiles being written; renamed into place once complete
+
+CODEC_SUFFIXES = {"csv": "", "gzip": ".gz", "zstd": ".zst"}
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+def _zstandard():
+    """zstandard is optional: only needed to write or read .zst tiles"""
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        raise RuntimeError("zstd tiles need the 'zstandard' package (pip install zstandard)")
+
+def codec_of(path):
+    """Codec of a stored tile, from its suffix or, failing that, its first bytes"""
+    for codec, suffix in CODEC_SUFFIXES.items():
+        if suffix and path.endswith(suffix):
+            return codec
+    with open(path, "rb") as f:
+        magic = f.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return "gzip"
+    if magic == ZSTD_MAGIC:
+        return "zstd"
+    return "csv"
+
+def strip_codec_suffix(name):
+    """Name of a tile without its compression suffix (foo.csv.gz -> foo.csv)"""
+    for suffix in CODEC_SUFFIXES.values():
+        if suffix and name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+def tile_files(directory, pattern="EGMS_*.csv"):
+    """Tiles in a directory matching `pattern`, whatever codec they are stored with"""
+    paths = []
+    for suffix in CODEC_SUFFIXES.values():
+        paths.extend(glob.glob(os.path.join(directory, pattern + suffix)))
+    return sorted(paths)
+
+def open_tile(path, mode="r", newline=""):
+    """Open a stored tile for reading, decompressing transparently ("r" text or "rb")"""
+    codec = codec_of(path)
+    if codec == "gzip":
+        raw = gzip.open(path, "rb")
+    elif codec == "zstd":
+        raw = _zstandard().open(path, "rb")
+    else:
+        raw = open(path, "rb")
+    if "b" in mode:
+        return raw
+    return io.TextIOWrapper(raw, encoding="utf-8", newline=newline)
+
+def _compressor(raw, codec):
+    """Writer compressing with `codec` into an open binary file, which it leaves open"""
+    if codec == "gzip":
+        return gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=GZIP_LEVEL)
+    if codec == "zstd":
+        zstandard = _zstandard()
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=ZSTD_THREADS)
+        return compressor.stream_writer(raw, closefd=False)
+    if codec == "csv":
+        return nullcontext(raw)
+    raise ValueError(f"Unknown output codec {codec!r}; expected one of {', '.join(CODEC_SUFFIXES)}")
+
+def open_output(path, codec=OUTPUT_CODEC):
+    """Binary writer that compresses with `codec`"""
+    if codec == "gzip":
+        return gzip.open(path, "wb", compresslevel=GZIP_LEVEL)
+    if codec == "zstd":
+        zstandard = _zstandard()
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=ZSTD_THREADS)
+        return zstandard.open(path, "wb", cctx=compressor)
+    if codec == "csv":
+        return open(path, "wb")
+    raise ValueError(f"Unknown output codec {codec!r}; expected one of {', '.join(CODEC_SUFFIXES)}")
+
+def partial_path(path):
+    """Hidden temporary name of a tile being written, in the same directory (so renaming is atomic)"""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.{os.getpid()}{PARTIAL_SUFFIX}")
+
+def remove_partials(directory, prefix):
+    """Delete partial files of tiles named `prefix`* left behind by interrupted writes"""
+    for path in glob.glob(os.path.join(glob.escape(directory), f".{glob.escape(prefix)}*{PARTIAL_SUFFIX}")):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def stored_tile(directory, prefix):
+    """Path of the tile `prefix` stored in directory with any codec, or None"""
+    paths = tile_files(directory, glob.escape(prefix) + ".csv")
+    return paths[0] if paths else None
+
+def write_tile(source, output_dir, name, codec=OUTPUT_CODEC):
+    """Copy a binary stream into output_dir/name (+ codec suffix); returns the path
+
+    The tile appears under its name only once complete: it is written to a
+    partial file, flushed to disk and renamed into place, so an interrupted
+    run never leaves a truncated tile that looks finished.
+    """
+    path = os.path.join(output_dir, name + CODEC_SUFFIXES[codec])
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = partial_path(path)
+    try:
+        with open(tmp_path, "wb", buffering=WRITE_BUFFER) as raw:
+            with _compressor(raw, codec) as out:
+                shutil.copyfileobj(source, out, COPY_CHUNK)
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+def extract_member(z, name, output_dir, codec=OUTPUT_CODEC):
+    """Drop-in for ZipFile.extract that stores the member with `codec`"""
+    with z.open(name) as member:
+        return write_tile(member, output_dir, name, codec)
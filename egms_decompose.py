@@ -0,0 +1,196 @@
+import os
+import re
+import csv
+import glob
+import json
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from egms_merge import find_columns, point_key
+
+# Configuration
+DOWNLOAD_BASE = "Point_downloads"
+DECOMPOSED_DIR = "Point_decomposed"
+WORKERS = 4            # Tiles processed in parallel
+CHUNK_ROWS = 50000     # Rows buffered before they are flushed to the memory-mapped columns
+
+# Date columns in EGMS CSVs are named YYYYMMDD
+DATE_COLUMN_RE = re.compile(r"^\d{8}$")
+# L3 E/U pairs only differ by the displacement component in their name
+PAIR_RE = re.compile(r"^(EGMS_L3_E\d+N\d+_100km_)([EU])(_\d{4}_\d{4}_1)\.csv$")
+
+def find_pairs(directory=DOWNLOAD_BASE):
+    """Group L3 CSVs by tile and return those having both an E and a U file"""
+    tiles = {}
+    for path in sorted(glob.glob(os.path.join(directory, "EGMS_L3_*.csv"))):
+        match = PAIR_RE.match(os.path.basename(path))
+        if match:
+            tile_name = f"{match.group(1)}EU{match.group(3)}"
+            tiles.setdefault(tile_name, {})[match.group(2)] = path
+
+    return [(name, files["E"], files["U"]) for name, files in sorted(tiles.items()) if "E" in files and "U" in files]
+
+def parse_line(line):
+    """Parse one raw CSV line into its fields"""
+    return next(csv.reader([line.decode("utf-8")]))
+
+def to_float(value):
+    """Convert a CSV cell to float, mapping empty or invalid cells to NaN"""
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+def index_points(path):
+    """Build the hash side of the join: point key -> byte offset of its row"""
+    offsets = {}
+    with open(path, "rb") as f:
+        header = parse_line(f.readline())
+        pid_idx, easting_idx, northing_idx = find_columns(header)
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                offsets[point_key(parse_line(line), pid_idx, easting_idx, northing_idx)] = offset
+    return header, offsets
+
+def column_index(header, name):
+    """Case-insensitive column lookup returning None when absent"""
+    header_lower = [col.lower() for col in header]
+    return header_lower.index(name) if name in header_lower else None
+
+def decompose_pair(tile_name, e_path, u_path, output_dir=DECOMPOSED_DIR):
+    """Hash-join the E and U files of one tile into a columnar store of .npy arrays"""
+    header_e, e_offsets = index_points(e_path)
+
+    with open(u_path, "rb") as u_file, open(e_path, "rb") as e_file:
+        header_u = parse_line(u_file.readline())
+        pid_idx, easting_idx, northing_idx = find_columns(header_u)
+
+        # Probe side: stream U and remember which rows found a partner in E
+        pairs = array("q")
+        pid_width = 1
+        while True:
+            offset = u_file.tell()
+            line = u_file.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            key = point_key(parse_line(line), pid_idx, easting_idx, northing_idx)
+            e_offset = e_offsets.get(key)
+            if e_offset is not None:
+                pairs.extend((offset, e_offset))
+                pid_width = max(pid_width, len(key))
+        del e_offsets
+
+        count = len(pairs) // 2
+        dates = [col for col in header_u if DATE_COLUMN_RE.match(col) and col in header_e]
+        date_idx_u = [header_u.index(col) for col in dates]
+        date_idx_e = [header_e.index(col) for col in dates]
+        vel_idx_u = column_index(header_u, "mean_velocity")
+        vel_idx_e = column_index(header_e, "mean_velocity")
+        height_idx = column_index(header_u, "height")
+
+        store = os.path.join(output_dir, tile_name)
+        os.makedirs(store, exist_ok=True)
+
+        def column(name, dtype, shape=(count,)):
+            return open_memmap(os.path.join(store, f"{name}.npy"), mode="w+", dtype=dtype, shape=shape)
+
+        out = {
+            "pid": column("pid", f"U{pid_width}"),
+            "easting": column("easting", np.float64),
+            "northing": column("northing", np.float64),
+            "height": column("height", np.float32),
+            "velocity_e": column("velocity_e", np.float32),
+            "velocity_u": column("velocity_u", np.float32),
+            "displacement_e": column("displacement_e", np.float32, (count, len(dates))),
+            "displacement_u": column("displacement_u", np.float32, (count, len(dates))),
+        }
+
+        # Stream the matched rows in U order and flush them chunk by chunk
+        for start in range(0, count, CHUNK_ROWS):
+            stop = min(start + CHUNK_ROWS, count)
+            buffers = {name: [] for name in out}
+            for k in range(start, stop):
+                u_file.seek(pairs[2 * k])
+                row_u = parse_line(u_file.readline())
+                e_file.seek(pairs[2 * k + 1])
+                row_e = parse_line(e_file.readline())
+
+                buffers["pid"].append(point_key(row_u, pid_idx, easting_idx, northing_idx))
+                buffers["easting"].append(to_float(row_u[easting_idx]) if easting_idx is not None else np.nan)
+                buffers["northing"].append(to_float(row_u[northing_idx]) if northing_idx is not None else np.nan)
+                buffers["height"].append(to_float(row_u[height_idx]) if height_idx is not None else np.nan)
+                buffers["velocity_e"].append(to_float(row_e[vel_idx_e]) if vel_idx_e is not None else np.nan)
+                buffers["velocity_u"].append(to_float(row_u[vel_idx_u]) if vel_idx_u is not None else np.nan)
+                buffers["displacement_e"].append([to_float(row_e[i]) for i in date_idx_e])
+                buffers["displacement_u"].append([to_float(row_u[i]) for i in date_idx_u])
+
+            for name, values in buffers.items():
+                out[name][start:stop] = np.asarray(values, dtype=out[name].dtype).reshape(out[name][start:stop].shape)
+
+        # Combined 2D velocity vector: magnitude and angle above the horizontal (degrees)
+        velocity_e = out["velocity_e"]
+        velocity_u = out["velocity_u"]
+        magnitude = column("velocity_magnitude", np.float32)
+        angle = column("velocity_angle", np.float32)
+        for start in range(0, count, CHUNK_ROWS):
+            stop = min(start + CHUNK_ROWS, count)
+            magnitude[start:stop] = np.hypot(velocity_e[start:stop], velocity_u[start:stop])
+            angle[start:stop] = np.degrees(np.arctan2(velocity_u[start:stop], velocity_e[start:stop]))
+
+        for array_ in list(out.values()) + [magnitude, angle]:
+            array_.flush()
+        np.save(os.path.join(store, "dates.npy"), np.array(dates, dtype="U8"))
+
+        metadata = {
+            "tile": tile_name,
+            "source_e": os.path.basename(e_path),
+            "source_u": os.path.basename(u_path),
+            "points": count,
+            "dates": len(dates),
+            "columns": sorted(list(out) + ["velocity_magnitude", "velocity_angle", "dates"]),
+        }
+        with open(os.path.join(store, "metadata.json"), "w") as f:
+            json.dump(metadata, f, indent=2)
+
+    return count
+
+def load_store(store):
+    """Open a decomposed tile as a dict of memory-mapped NumPy arrays"""
+    with open(os.path.join(store, "metadata.json")) as f:
+        metadata = json.load(f)
+    return {name: np.load(os.path.join(store, f"{name}.npy"), mmap_mode="r") for name in metadata["columns"]}
+
+def decompose_all(directory=DOWNLOAD_BASE, output_dir=DECOMPOSED_DIR, workers=WORKERS):
+    """Join every E/U pair found in the download directory, one process per tile"""
+    pairs = find_pairs(directory)
+    if not pairs:
+        print(f"No E/U tile pairs found in {directory}")
+        return 0
+
+    print(f"Found {len(pairs)} E/U tile pair(s)")
+    successful = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(decompose_pair, name, e_path, u_path, output_dir): name for name, e_path, u_path in pairs}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                count = future.result()
+                successful += 1
+                print(f"Joined {name}: {count} points")
+            except Exception as e:
+                print(f"Error joining {name}: {e}")
+
+    return successful
+
+if __name__ == "__main__":
+    print("=== EGMS E/U Decomposition Tool ===")
+    joined = decompose_all()
+    print(f"Columnar stores written to {DECOMPOSED_DIR}: {joined}")
@@ -0,0 +1,383 @@
+import os
+import re
+import zlib
+import struct
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from egms_codecs import OUTPUT_CODEC, extract_member, stored_tile
+from egms_locks import tile_lock
+from egms_profile import span, timed_iter
+from egms_memory import memory_budget
+
+# Configuration
+BASE_URL = "https://egms.land.copernicus.eu/insar-api/archive/download/{prefix}.zip?id={id}"
+# Downloads can go through an egms_proxy.py instead, sharing its scheduler with the web app, e.g.
+# EGMS_ARCHIVE_URL="http://host:8502/insar-api/archive/download/{prefix}.zip?id={id}&priority=batch"
+ARCHIVE_URL = os.environ.get("EGMS_ARCHIVE_URL", BASE_URL)
+DOWNLOAD_BASE = "Point_downloads"
+DEFAULT_ID = "7ce01544f73b4a9780b56f9c96fe4de3"
+TIMEOUT = 600  # 10 minutes timeout
+CHUNK_SIZE = 1024 * 1024  # Streaming window: bytes read from upstream / produced per step
+PROBE_TAIL = 64 * 1024    # Archive tail fetched by probes; holds the central directory of a tile archive
+PROBE_TIMEOUT = 60
+PROBE_WORKERS = 8         # Probes in flight; each costs one or two small requests
+
+# A tile key is the part of the archive name that does not depend on the release,
+# e.g. "L3_E32N31_100km_U" or "L2a_052_0716_IW2_VV"
+TILE_FILENAME_RE = re.compile(r"^EGMS_(.+)_(\d{4}_\d{4})_1\.csv$")
+
+def l3_tile_key(e, n, d):
+    """Tile key of an L3 tile"""
+    return f"L3_E{e}N{n}_100km_{d}"
+
+def l2_tile_key(data_type, relative_orbit, burst_cycle, swath, polarization):
+    """Tile key of an L2a/L2b burst, zero-padding orbit and burst cycle like the batch tools"""
+    data_type = "L2a" if data_type.upper() == "L2A" else "L2b"
+    return f"{data_type}_{int(relative_orbit):03d}_{int(burst_cycle):04d}_{swath}_{polarization}"
+
+def parse_tile_filename(filename):
+    """Split an extracted CSV name into (tile key, year range), or (None, None)"""
+    match = TILE_FILENAME_RE.match(os.path.basename(filename))
+    if not match:
+        return None, None
+    return match.group(1), match.group(2)
+
+def filename_prefix(tile_key, year):
+    """Archive/CSV name prefix of a tile for a given release"""
+    return f"EGMS_{tile_key}_{year}_1"
+
+def archive_url(tile_key, year, id=DEFAULT_ID, template=ARCHIVE_URL):
+    """Download URL of a tile archive"""
+    return template.format(prefix=filename_prefix(tile_key, year), id=id)
+
+def check_expected(prefix, expect, archive_bytes, info):
+    """Differences between a downloaded archive/member and a manifest's expectations, as messages"""
+    actual = {"size": archive_bytes, "csv_size": info.file_size, "crc": f"{info.CRC:08x}"}
+    return [f"{prefix}: {field} {actual[field]} differs from the expected {value}"
+            for field, value in expect.items() if value is not None and actual.get(field) != value]
+
+def download_tile(tile_key, year, id=DEFAULT_ID, output_dir=DOWNLOAD_BASE, timeout=TIMEOUT, codec=None,
+                  overwrite=False, url=None, expect=None):
+    """Download a tile and extract its CSV; returns the extracted path or None
+
+    A tile already stored in output_dir (with any codec) is not downloaded again
+    unless `overwrite` is set. Processes sharing output_dir take a lock per tile,
+    so parallel jobs never fetch the same tile twice. `url` overrides the archive
+    URL, and `expect` ({"size", "csv_size", "crc"} of a manifest) rejects an
+    archive that differs from what was planned.
+    """
+    prefix = filename_prefix(tile_key, year)
+    url = url or archive_url(tile_key, year, id)
+
+    try:
+        with tile_lock(output_dir, prefix) as waited:
+            existing = stored_tile(output_dir, prefix)
+            if existing and (waited or not overwrite):
+                print(f"Already downloaded: {existing}")
+                return existing
+
+            # Deferred so planning/indexing commands do not load the HTTP stack
+            import curl_cffi.requests as curl_requests
+            response = curl_requests.get(url, stream=True, timeout=timeout)
+            print(f"Response for {prefix}: {response.status_code}")
+
+            if response.status_code != 200:
+                response.close()
+                print(f"Failed to download {prefix}")
+                return None
+
+            # The archive stays in memory only if it fits the shared budget; otherwise it is spilled to disk
+            length = response.headers.get("content-length")
+            with memory_budget().spooled(int(length) if length else 0) as archive:
+                with span("fetch", tile=prefix):
+                    try:
+                        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                            archive.write(chunk)
+                    finally:
+                        response.close()
+                archive_bytes = archive.tell()
+
+                # The unzip span's own time is reading the archive; extracting the member is nested in it
+                with span("unzip", tile=prefix), zipfile.ZipFile(archive) as z:
+                    for name in z.namelist():
+                        if name.endswith(".csv") and prefix in name:
+                            mismatches = check_expected(prefix, expect or {}, archive_bytes, z.getinfo(name))
+                            if mismatches:
+                                print("\n".join(mismatches))
+                                return None
+                            with span("extract", tile=prefix, codec=codec or OUTPUT_CODEC):
+                                path = extract_member(z, name, output_dir, codec or OUTPUT_CODEC)
+                            print(f"Extracted {name}")
+                            return path
+
+        print(f"No matching CSV found in the downloaded zip for {prefix}")
+        return None
+
+    except Exception as e:
+        print(f"Error downloading {prefix}: {e}")
+        return None
+
+class TileUnavailable(Exception):
+    """Raised when a tile archive cannot be fetched or holds no matching CSV"""
+
+# ZIP local file header: signature, version, flags, method, time, date, crc, sizes, name/extra lengths
+LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+ZIP64_MARKER = 0xFFFFFFFF
+
+class ChunkReader:
+    """Sequential reader over an iterator of byte chunks, with push-back"""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = bytearray()
+
+    def _fill(self, size):
+        while len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return False
+            self.buffer += chunk
+        return True
+
+    def read_exact(self, size):
+        """Read exactly `size` bytes, or fewer only at end of stream"""
+        self._fill(size)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def read_some(self, limit):
+        """Read between 1 and `limit` bytes; b"" at end of stream"""
+        self._fill(1)
+        data = bytes(self.buffer[:limit])
+        del self.buffer[:limit]
+        return data
+
+    def unread(self, data):
+        self.buffer[:0] = data
+
+    def drain(self):
+        """Consume the rest of the stream (lets a tee'd upstream finish)"""
+        self.buffer.clear()
+        for _ in self.chunks:
+            pass
+
+def _member_data(reader, flags, method, csize, zip64, window):
+    """Yield the decompressed bytes of the member at the reader's position"""
+    if method == 8:
+        decompressor = zlib.decompressobj(-15)
+        while not decompressor.eof:
+            if decompressor.unconsumed_tail:
+                data = decompressor.decompress(decompressor.unconsumed_tail, window)
+            else:
+                raw = reader.read_some(window)
+                if not raw:
+                    raise TileUnavailable("Archive ended inside a compressed member")
+                data = decompressor.decompress(raw, window)
+            if data:
+                yield data
+        reader.unread(decompressor.unused_data)
+    elif method == 0 and not flags & 0x08:
+        remaining = csize
+        while remaining:
+            data = reader.read_some(min(window, remaining))
+            if not data:
+                raise TileUnavailable("Archive ended inside a stored member")
+            remaining -= len(data)
+            yield data
+    else:
+        raise TileUnavailable(f"Unsupported ZIP compression method {method} for streaming")
+
+    if flags & 0x08:
+        # Data descriptor: optional signature, crc, compressed and uncompressed sizes
+        signature = reader.read_exact(4)
+        if signature != b"PK\x07\x08":
+            reader.unread(signature)
+        reader.read_exact(4 + (16 if zip64 else 8))
+
+def stream_csv_member(chunks, prefix, window=CHUNK_SIZE):
+    """Locate the tile CSV in a ZIP arriving as byte chunks; returns (name, data iterator)
+
+    Members are read in archive order from their local headers, so decompressed
+    bytes are available as soon as they arrive and memory stays within `window`.
+    """
+    reader = ChunkReader(chunks)
+    while True:
+        header = reader.read_exact(LOCAL_HEADER.size)
+        if len(header) < LOCAL_HEADER.size or header[:4] != b"PK\x03\x04":
+            # Reached the central directory (or garbage) without a match
+            raise TileUnavailable(f"No matching CSV found in the downloaded zip for {prefix}")
+
+        _, _, flags, method, _, _, crc, csize, usize, name_len, extra_len = LOCAL_HEADER.unpack(header)
+        name = reader.read_exact(name_len).decode("utf-8" if flags & 0x800 else "cp437")
+        extra = reader.read_exact(extra_len)
+        zip64 = csize == ZIP64_MARKER or usize == ZIP64_MARKER or b"\x01\x00" in extra[:2]
+        if csize == ZIP64_MARKER and len(extra) >= 20:
+            usize, csize = struct.unpack("<QQ", extra[4:20])
+
+        data = _member_data(reader, flags, method, csize, zip64, window)
+        if name.endswith(".csv") and prefix in name:
+            return name, _checked(data, reader, crc, flags)
+
+        # Not the tile CSV: decompress it away to reach the next header
+        for _ in data:
+            pass
+
+def _checked(data, reader, crc, flags):
+    """Pass member bytes through, verifying the CRC from the local header when known"""
+    actual = 0
+    for chunk in data:
+        actual = zlib.crc32(chunk, actual)
+        yield chunk
+    if not flags & 0x08 and actual != crc:
+        raise TileUnavailable("CRC mismatch in streamed CSV")
+    reader.drain()
+
+def open_csv_stream(tile_key, year, id=DEFAULT_ID, timeout=TIMEOUT, window=CHUNK_SIZE):
+    """Start a tile download and return (csv name, iterator of decompressed CSV bytes)"""
+    import curl_cffi.requests as curl_requests
+
+    prefix = filename_prefix(tile_key, year)
+    with span("fetch", tile=prefix, phase="connect"):
+        response = curl_requests.get(archive_url(tile_key, year, id), stream=True, timeout=timeout)
+    if response.status_code != 200:
+        response.close()
+        raise TileUnavailable(f"Failed to fetch {prefix} (Status: {response.status_code})")
+
+    def chunks():
+        try:
+            yield from response.iter_content(chunk_size=window)
+        finally:
+            response.close()
+
+    # Download and decompression interleave chunk by chunk; each pull is charged to its stage
+    name, data = stream_csv_member(timed_iter("fetch", chunks()), prefix, window)
+    return name, timed_iter("unzip", data)
+
+def fetch_csv(tile_key, year, id=DEFAULT_ID, timeout=TIMEOUT):
+    """Fetch a tile and return (csv bytes, csv name) in memory; raises TileUnavailable"""
+    # Decompressed while downloading, so the archive itself is never held in memory
+    name, data = open_csv_stream(tile_key, year, id, timeout)
+    return b"".join(data), name
+
+# End of central directory records (classic and ZIP64) and central directory entries
+END_RECORD = struct.Struct("<4sHHHHIIH")
+ZIP64_LOCATOR = struct.Struct("<4sIQI")
+ZIP64_END_RECORD = struct.Struct("<4sQHHIIQQQQ")
+CENTRAL_HEADER = struct.Struct("<4sHHHHHHIIIHHHHHII")
+
+def locate_central_directory(tail, tail_start):
+    """(offset, size, entries) of the central directory from the archive tail, or None"""
+    pos = tail.rfind(b"PK\x05\x06")
+    if pos < 0 or len(tail) - pos < END_RECORD.size:
+        return None
+    _, _, _, _, entries, size, offset, _ = END_RECORD.unpack_from(tail, pos)
+    locator = pos - ZIP64_LOCATOR.size
+    if locator >= 0 and tail[locator:locator + 4] == b"PK\x06\x07":
+        record = ZIP64_LOCATOR.unpack_from(tail, locator)[2] - tail_start
+        if 0 <= record <= len(tail) - ZIP64_END_RECORD.size:
+            fields = ZIP64_END_RECORD.unpack_from(tail, record)
+            entries, size, offset = fields[7], fields[8], fields[9]
+    return offset, size, entries
+
+def parse_central_directory(data, entries):
+    """Member names, sizes and CRCs from raw central directory bytes"""
+    members = []
+    pos = 0
+    for _ in range(entries):
+        if data[pos:pos + 4] != b"PK\x01\x02":
+            break
+        fields = CENTRAL_HEADER.unpack_from(data, pos)
+        flags, crc, csize, usize = fields[3], fields[7], fields[8], fields[9]
+        name_len, extra_len, comment_len = fields[10], fields[11], fields[12]
+        start = pos + CENTRAL_HEADER.size
+        name = data[start:start + name_len].decode("utf-8" if flags & 0x800 else "cp437")
+        extra = data[start + name_len:start + name_len + extra_len]
+        if ZIP64_MARKER in (csize, usize):
+            # ZIP64 extra field holds the overflowing sizes, uncompressed first
+            i = 0
+            while i + 4 <= len(extra):
+                tag, length = struct.unpack_from("<HH", extra, i)
+                if tag == 1:
+                    values = iter(struct.unpack_from(f"<{length // 8}Q", extra, i + 4))
+                    usize = next(values) if usize == ZIP64_MARKER else usize
+                    csize = next(values) if csize == ZIP64_MARKER else csize
+                    break
+                i += 4 + length
+        members.append({"name": name, "compressed_size": csize, "size": usize, "crc": f"{crc:08x}"})
+        pos = start + name_len + extra_len + comment_len
+    return members
+
+def _read_body(response):
+    try:
+        return b"".join(response.iter_content(chunk_size=CHUNK_SIZE))
+    finally:
+        response.close()
+
+def probe_tile(tile_key, year, id=DEFAULT_ID, timeout=PROBE_TIMEOUT):
+    """Check a tile without downloading it
+
+    Fetches only the archive tail with a Range request and lists the members from
+    the central directory. Servers that ignore Range are answered from the response
+    headers (the body is never read), and HEAD is the last resort.
+    Returns {"tile_key", "year", "exists", "archive_bytes", "members", "method"}.
+    """
+    import curl_cffi.requests as curl_requests
+
+    # Always upstream: the proxy answers Range requests by fetching the whole archive
+    url = archive_url(tile_key, year, id, BASE_URL)
+    result = {"tile_key": tile_key, "year": year, "exists": False,
+              "archive_bytes": None, "members": [], "method": "range"}
+    try:
+        response = curl_requests.get(url, headers={"Range": f"bytes=-{PROBE_TAIL}"},
+                                     stream=True, timeout=timeout)
+        if response.status_code == 206:
+            tail = _read_body(response)
+            total = int(response.headers.get("content-range", "").rsplit("/", 1)[-1])
+            tail_start = total - len(tail)
+            located = locate_central_directory(tail, tail_start)
+            if located is None:
+                return result   # Not a ZIP: the server answered with something else
+            offset, size, entries = located
+            if offset >= tail_start:
+                directory = tail[offset - tail_start:offset - tail_start + size]
+            else:
+                # Central directory larger than the tail: fetch exactly that range
+                directory = _read_body(curl_requests.get(
+                    url, headers={"Range": f"bytes={offset}-{offset + size - 1}"}, stream=True, timeout=timeout))
+            result.update(exists=True, archive_bytes=total, members=parse_central_directory(directory, entries))
+            return result
+
+        # Range not honoured: the headers alone tell whether the archive exists
+        response.close()
+        result["method"] = "headers"
+    except Exception as e:
+        print(f"Range probe failed for {filename_prefix(tile_key, year)}: {e}; trying HEAD")
+        result["method"] = "head"
+        response = curl_requests.head(url, timeout=timeout)
+
+    if response.status_code == 200 and "html" not in response.headers.get("content-type", ""):
+        length = response.headers.get("content-length")
+        result.update(exists=True, archive_bytes=int(length) if length else None)
+    return result
+
+def probe_tiles(tile_keys, year, id=DEFAULT_ID, workers=PROBE_WORKERS):
+    """Probe many tiles concurrently; results are in the order of tile_keys"""
+    def probe(tile_key):
+        try:
+            return probe_tile(tile_key, year, id)
+        except Exception as e:
+            print(f"Probe failed for {filename_prefix(tile_key, year)}: {e}")
+            return {"tile_key": tile_key, "year": year, "exists": None,
+                    "archive_bytes": None, "members": [], "method": "error"}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(probe, tile_keys))
+
+def summarize_probes(probes):
+    """(tiles found, archive bytes, uncompressed CSV bytes) over probe results"""
+    found = [p for p in probes if p["exists"]]
+    archive_bytes = sum(p["archive_bytes"] or 0 for p in found)
+    csv_bytes = sum(m["size"] for p in found for m in p["members"] if m["name"].endswith(".csv"))
+    return len(found), archive_bytes, csv_bytes
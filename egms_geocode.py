@@ -0,0 +1,468 @@
+import os
+import json
+import time
+import pickle
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# Configuration
+# Backend used by the location scripts: "nominatim", "gazetteer" or "polygons"
+GEOCODER = os.environ.get("EGMS_GEOCODER", "nominatim")
+
+# The public server allows one request per second from one client; a self-hosted
+# instance (EGMS_NOMINATIM_URL) can take as many as it has workers
+NOMINATIM_URL = os.environ.get("EGMS_NOMINATIM_URL", "https://nominatim.openstreetmap.org")
+RATE_LIMIT = float(os.environ.get("EGMS_NOMINATIM_RATE", "1.0"))       # requests per second; 0 = unlimited
+CONCURRENCY = int(os.environ.get("EGMS_NOMINATIM_CONCURRENCY", "1"))   # requests in flight
+USER_AGENT = "egms-cli"
+TIMEOUT = 30
+COORD_DIGITS = 6      # Coordinates equal to this many decimals (~0.1 m) are looked up once
+LOOKAHEAD = 64        # Requests queued ahead of the consumer per worker
+CACHE_SIZE = 100000   # Distinct coordinates remembered for deduplication
+RETRIES = 4           # Extra attempts after a rate limit (429), server error (5xx) or connection failure
+RETRY_BACKOFF = 2.0   # Seconds before the first retry, doubled for each further one
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# Offline backends
+GAZETTEER_PATH = "Point_geodata/cities500.txt"     # GeoNames dump; admin1CodesASCII.txt / countryInfo.txt beside it add names
+BOUNDARY_FILES = {                                 # GeoJSON per level, WGS84 (e.g. GISCO countries, NUTS 2, LAU)
+    "country": "Point_geodata/countries.geojson",
+    "region": "Point_geodata/regions.geojson",
+    "municipality": "Point_geodata/municipalities.geojson",
+}
+NAME_PROPERTIES = ["name", "NAME", "NAME_ENGL", "NUTS_NAME", "LAU_NAME", "shapeName"]
+BATCH_SIZE = 50000    # Points located per vectorized batch
+RAY_CAST_POINTS = 4096       # Points tested against a polygon at once, in latitude order
+RAY_CAST_CELLS = 2000000     # Point-edge pairs per step; keeps point-in-polygon memory to tens of MB
+GRID_DEGREES = 0.5    # Cell size of the spatial indexes
+INDEX_SUFFIX = ".index.pkl"
+
+Labels = namedtuple("Labels", ["country", "region", "municipality"])
+
+def format_labels(labels):
+    """"Municipality, Region, Country", skipping unknown levels"""
+    if labels is None:
+        return "Unknown location"
+    parts = [labels.municipality, labels.region, labels.country]
+    return ", ".join(part for part in parts if part) or "Unknown location"
+
+class GeocodingBackend:
+    """Turns WGS84 points into hierarchical labels
+
+    Local backends implement locate_many() and get batched streaming for free;
+    remote ones override reverse() and reverse_stream() instead.
+    """
+
+    def locate_many(self, latitudes, longitudes):
+        """Labels (or None) for each point"""
+        raise NotImplementedError
+
+    def reverse(self, latitude, longitude):
+        """Location name of one point"""
+        if latitude is None or longitude is None:
+            return "Unknown location"
+        return format_labels(self.locate_many([latitude], [longitude])[0])
+
+    def reverse_stream(self, items):
+        """Yield (payload, location) for (payload, latitude, longitude) items, in order"""
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= BATCH_SIZE:
+                yield from self._locate_batch(batch)
+                batch = []
+        if batch:
+            yield from self._locate_batch(batch)
+
+    def _locate_batch(self, batch):
+        known = [(payload, lat, lon) for payload, lat, lon in batch if lat is not None and lon is not None]
+        labels = iter(self.locate_many([lat for _, lat, _ in known], [lon for _, _, lon in known]))
+        for payload, lat, lon in batch:
+            yield payload, format_labels(next(labels) if lat is not None and lon is not None else None)
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class GeocodingError(Exception):
+    """Raised when the geocoding service stays unavailable after retries"""
+
+def address_labels(result):
+    """Labels from a Nominatim reverse result"""
+    address = result.get("address", {})
+    municipality = address.get("city", address.get("town", address.get("village", address.get("municipality", ""))))
+    region = address.get("state", address.get("region", address.get("county", "")))
+    return Labels(address.get("country", ""), region, municipality)
+
+class NominatimClient(GeocodingBackend):
+    """Reverse geocoder sharing HTTP sessions, a rate limit and a result cache across calls"""
+
+    def __init__(self, url=NOMINATIM_URL, rate=RATE_LIMIT, concurrency=CONCURRENCY,
+                 user_agent=USER_AGENT, timeout=TIMEOUT):
+        self.url = url.rstrip("/") + "/reverse"
+        self.bucket = TokenBucket(rate, capacity=max(1, concurrency))
+        self.concurrency = max(1, concurrency)
+        self.headers = {"User-Agent": user_agent}
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="egms-geocode")
+        self.local = threading.local()   # One keep-alive session per worker thread
+        self.cache = {}                  # Rounded (lat, lon) -> future of the location
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def _session(self):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            import curl_cffi.requests as curl_requests
+            session = self.local.session = curl_requests.Session()
+        return session
+
+    def _lookup(self, latitude, longitude):
+        """Location name of a point; raises GeocodingError once the service keeps failing
+
+        Errors are raised rather than written as a location, so an enrichment
+        run stops at its last checkpoint and the next run retries those points.
+        """
+        for attempt in range(RETRIES + 1):
+            self.bucket.acquire()
+            with self.lock:
+                self.requests += 1
+            try:
+                response = self._session().get(
+                    self.url, headers=self.headers, timeout=self.timeout,
+                    params={"lat": latitude, "lon": longitude, "format": "jsonv2", "addressdetails": 1},
+                )
+            except Exception as e:
+                error = str(e) or type(e).__name__
+            else:
+                if response.status_code == 200:
+                    result = response.json()
+                    if not result or "error" in result:
+                        return "Unknown location"
+                    return format_labels(address_labels(result))
+                error = f"HTTP {response.status_code}"
+                if response.status_code not in RETRY_STATUS:
+                    raise GeocodingError(f"Geocoding {latitude}, {longitude} failed: {error}")
+            if attempt < RETRIES:
+                delay = RETRY_BACKOFF * 2 ** attempt
+                print(f"Error in geocoding: {error}; retrying in {delay:.0f}s")
+                time.sleep(delay)
+        raise GeocodingError(f"Geocoding {latitude}, {longitude} failed after {RETRIES + 1} attempts: {error}")
+
+    def _forget_failed(self, key, future):
+        # Only successful lookups are remembered; a failed point is requested again next time
+        if future.cancelled() or future.exception() is not None:
+            with self.lock:
+                if self.cache.get(key) is future:
+                    del self.cache[key]
+
+    def submit(self, latitude, longitude):
+        """Future of the location at a point; identical points share one request"""
+        if latitude is None or longitude is None:
+            return None
+        key = (round(latitude, COORD_DIGITS), round(longitude, COORD_DIGITS))
+        with self.lock:
+            future = self.cache.get(key)
+            added = future is None
+            if added:
+                future = self.cache[key] = self.executor.submit(self._lookup, *key)
+                if len(self.cache) > CACHE_SIZE:
+                    del self.cache[next(iter(self.cache))]   # Oldest entry
+        if added:
+            # Outside the lock: the callback runs right away if the lookup already finished
+            future.add_done_callback(lambda done: self._forget_failed(key, done))
+        return future
+
+    def reverse(self, latitude, longitude):
+        future = self.submit(latitude, longitude)
+        return future.result() if future else "Unknown location"
+
+    def reverse_stream(self, items):
+        """Requests run ahead of the consumer on the worker threads, so the rate
+        limit rather than the round trip bounds throughput"""
+        pending = deque()
+        for payload, latitude, longitude in items:
+            pending.append((payload, self.submit(latitude, longitude)))
+            if len(pending) >= LOOKAHEAD * self.concurrency:
+                payload, future = pending.popleft()
+                yield payload, future.result() if future else "Unknown location"
+        while pending:
+            payload, future = pending.popleft()
+            yield payload, future.result() if future else "Unknown location"
+
+def load_cached_index(source, build):
+    """Load the index built from `source`, rebuilding it when the source is newer"""
+    index_path = source + INDEX_SUFFIX
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(source):
+        with open(index_path, "rb") as f:
+            return pickle.load(f)
+    print(f"Building spatial index for {source}...")
+    index = build(source)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, index_path)
+    return index
+
+def grid_cells(latitudes, longitudes):
+    import numpy as np
+    return (np.floor(np.asarray(latitudes) / GRID_DEGREES).astype(np.int64),
+            np.floor(np.asarray(longitudes) / GRID_DEGREES).astype(np.int64))
+
+def group_by_cell(latitudes, longitudes):
+    """Yield (row, col, point indices) for every grid cell holding points"""
+    import numpy as np
+    rows, cols = grid_cells(latitudes, longitudes)
+    order = np.lexsort((cols, rows))
+    boundaries = np.nonzero(np.diff(rows[order]) | np.diff(cols[order]))[0] + 1
+    for members in np.split(order, boundaries):
+        if len(members):
+            yield int(rows[members[0]]), int(cols[members[0]]), members
+
+def read_name_table(path, key_col, name_col):
+    """{code: name} from a GeoNames side file, or {} when it is absent"""
+    if not os.path.exists(path):
+        return {}
+    names = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) > max(key_col, name_col):
+                names[fields[key_col]] = fields[name_col]
+    return names
+
+def build_gazetteer_index(path):
+    """Places of a GeoNames dump bucketed into grid cells"""
+    import numpy as np
+
+    directory = os.path.dirname(path)
+    countries = read_name_table(os.path.join(directory, "countryInfo.txt"), 0, 4)
+    regions = read_name_table(os.path.join(directory, "admin1CodesASCII.txt"), 0, 1)
+
+    labels, latitudes, longitudes = [], [], []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            # geonameid, name, asciiname, alternatenames, latitude, longitude, class, code, country, cc2, admin1, ...
+            if len(fields) < 11 or fields[6] != "P":
+                continue
+            country = fields[8]
+            labels.append(Labels(countries.get(country, country),
+                                 regions.get(f"{country}.{fields[10]}", fields[10]), fields[1]))
+            latitudes.append(float(fields[4]))
+            longitudes.append(float(fields[5]))
+
+    latitudes = np.array(latitudes)
+    longitudes = np.array(longitudes)
+    rows, cols = grid_cells(latitudes, longitudes)
+    cells = {}
+    for i, cell in enumerate(zip(rows.tolist(), cols.tolist())):
+        cells.setdefault(cell, []).append(i)
+    cells = {cell: np.array(ids) for cell, ids in cells.items()}
+    return {"labels": labels, "latitudes": latitudes, "longitudes": longitudes, "cells": cells}
+
+class GazetteerBackend(GeocodingBackend):
+    """Nearest populated place from an offline GeoNames gazetteer"""
+
+    MAX_RING = 4   # Cells searched around a point before giving up (about 2 degrees)
+
+    def __init__(self, path=GAZETTEER_PATH):
+        index = load_cached_index(path, build_gazetteer_index)
+        self.labels = index["labels"]
+        self.latitudes = index["latitudes"]
+        self.longitudes = index["longitudes"]
+        self.cells = index["cells"]
+
+    def candidates(self, row, col, ring):
+        import numpy as np
+        ids = [self.cells[(r, c)] for r in range(row - ring, row + ring + 1)
+               for c in range(col - ring, col + ring + 1) if (r, c) in self.cells]
+        return np.concatenate(ids) if ids else None
+
+    def locate_many(self, latitudes, longitudes):
+        import numpy as np
+
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        result = [None] * len(latitudes)
+
+        # Points sharing a cell share one candidate set and one distance matrix
+        for row, col, members in group_by_cell(latitudes, longitudes):
+            for ring in range(1, self.MAX_RING + 1):
+                ids = self.candidates(row, col, ring)
+                if ids is not None:
+                    break
+            if ids is None:
+                continue
+            scale = np.cos(np.radians(latitudes[members]))[:, None]
+            d_lat = latitudes[members][:, None] - self.latitudes[ids][None, :]
+            d_lon = (longitudes[members][:, None] - self.longitudes[ids][None, :]) * scale
+            nearest = ids[np.argmin(d_lat ** 2 + d_lon ** 2, axis=1)]
+            for i, place in zip(members.tolist(), nearest.tolist()):
+                result[i] = self.labels[place]
+        return result
+
+def feature_name(properties):
+    for key in NAME_PROPERTIES:
+        if properties.get(key):
+            return properties[key]
+    return ""
+
+def build_polygon_index(path):
+    """Polygons of a GeoJSON layer with their bounding boxes, bucketed into grid cells"""
+    import numpy as np
+
+    with open(path, "r", encoding="utf-8") as f:
+        features = json.load(f)["features"]
+
+    names, polygons, cells = [], [], {}
+    for feature in features:
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") == "Polygon":
+            parts = [geometry["coordinates"]]
+        elif geometry.get("type") == "MultiPolygon":
+            parts = geometry["coordinates"]
+        else:
+            continue
+        name = feature_name(feature.get("properties") or {})
+        for part in parts:
+            # Rings as arrays of lon/lat vertices; holes are handled by the even-odd rule
+            rings = [np.asarray(ring, dtype=np.float64)[:, :2] for ring in part if len(ring) >= 3]
+            if not rings:
+                continue
+            outer = rings[0]
+            bbox = (outer[:, 1].min(), outer[:, 0].min(), outer[:, 1].max(), outer[:, 0].max())
+            polygon_id = len(polygons)
+            names.append(name)
+            polygons.append((rings, bbox))
+            row0, col0 = grid_cells(bbox[0], bbox[1])
+            row1, col1 = grid_cells(bbox[2], bbox[3])
+            for r in range(int(row0), int(row1) + 1):
+                for c in range(int(col0), int(col1) + 1):
+                    cells.setdefault((r, c), []).append(polygon_id)
+    return {"names": names, "polygons": polygons, "cells": cells}
+
+def points_in_rings(rings, longitudes, latitudes):
+    """Even-odd ray casting of many points against the rings of one polygon
+
+    Points are taken in latitude order, RAY_CAST_POINTS at a time, and only
+    tested against the edges spanning their latitude band, in groups small
+    enough that no step holds more than RAY_CAST_CELLS point-edge pairs.
+    """
+    import numpy as np
+
+    inside = np.zeros(len(longitudes), dtype=bool)
+    if not len(longitudes):
+        return inside
+    # The parity over the edges of all rings is that of each ring combined, holes included
+    x1 = np.concatenate([ring[:, 0] for ring in rings])
+    y1 = np.concatenate([ring[:, 1] for ring in rings])
+    x2 = np.concatenate([np.roll(ring[:, 0], -1) for ring in rings])
+    y2 = np.concatenate([np.roll(ring[:, 1], -1) for ring in rings])
+    low, high = np.minimum(y1, y2), np.maximum(y1, y2)
+
+    order = np.argsort(latitudes, kind="stable")
+    for start in range(0, len(order), RAY_CAST_POINTS):
+        points = order[start:start + RAY_CAST_POINTS]
+        x = longitudes[points][:, None]
+        y = latitudes[points][:, None]
+        # A horizontal ray at latitude y only crosses edges with low <= y < high
+        band = np.nonzero((low <= y[-1, 0]) & (high > y[0, 0]))[0]
+        crossings = np.zeros(len(points), dtype=np.int64)
+        step = max(1, RAY_CAST_CELLS // len(points))
+        for first in range(0, len(band), step):
+            edges = band[first:first + step]
+            ex1, ey1, ex2, ey2 = (a[edges][None, :] for a in (x1, y1, x2, y2))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                crosses = ((ey1 > y) != (ey2 > y)) & (x < (ex2 - ex1) * (y - ey1) / (ey2 - ey1) + ex1)
+            crossings += np.count_nonzero(crosses, axis=1)
+        inside[points] = crossings % 2 == 1
+    return inside
+
+class PolygonLayer:
+    """One administrative level: which named polygon contains each point"""
+
+    def __init__(self, path):
+        index = load_cached_index(path, build_polygon_index)
+        self.names = index["names"]
+        self.polygons = index["polygons"]
+        self.cells = index["cells"]
+
+    def locate(self, latitudes, longitudes):
+        import numpy as np
+
+        result = [""] * len(latitudes)
+        for row, col, members in group_by_cell(latitudes, longitudes):
+            for polygon_id in self.cells.get((row, col), []):
+                rings, (lat0, lon0, lat1, lon1) = self.polygons[polygon_id]
+                lat, lon = latitudes[members], longitudes[members]
+                candidates = (lat >= lat0) & (lat <= lat1) & (lon >= lon0) & (lon <= lon1)
+                if not candidates.any():
+                    continue
+                hit = np.zeros(len(members), dtype=bool)
+                hit[candidates] = points_in_rings(rings, lon[candidates], lat[candidates])
+                for i in members[hit].tolist():
+                    result[i] = self.names[polygon_id]
+                members = members[~hit]   # Each point belongs to one polygon per level
+                if not len(members):
+                    break
+        return result
+
+class PolygonBackend(GeocodingBackend):
+    """Point-in-polygon lookup against local administrative boundary files"""
+
+    def __init__(self, boundary_files=BOUNDARY_FILES):
+        self.layers = {level: PolygonLayer(path) for level, path in boundary_files.items()
+                       if path and os.path.exists(path)}
+        if not self.layers:
+            raise FileNotFoundError(f"No boundary files found: {', '.join(boundary_files.values())}")
+
+    def locate_many(self, latitudes, longitudes):
+        import numpy as np
+
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        empty = [""] * len(latitudes)
+        levels = {level: layer.locate(latitudes, longitudes) for level, layer in self.layers.items()}
+        return [Labels(*values) if any(values) else None
+                for values in zip(*(levels.get(level, empty) for level in Labels._fields))]
+
+BACKENDS = {
+    "nominatim": NominatimClient,
+    "gazetteer": GazetteerBackend,
+    "polygons": PolygonBackend,
+}
+
+_default_geocoder = None
+_default_geocoder_lock = threading.Lock()
+
+def default_geocoder():
+    """Process-wide GEOCODER backend, shared so sessions, caches and indexes load once"""
+    global _default_geocoder
+    with _default_geocoder_lock:
+        if _default_geocoder is None:
+            _default_geocoder = BACKENDS[GEOCODER]()
+        return _default_geocoder
@@ -1,11 +1,14 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, scrolledtext
+from tkinter import ttk, messagebox, scrolledtext, filedialog
 import zipfile
-import os
 from io import BytesIO
 from time import sleep
 import threading
 from curl_cffi import requests as curl_requests
+from egms_codecs import CODEC_SUFFIXES, OUTPUT_CODEC, extract_member, stored_tile
+from egms_locks import tile_lock
+from egms_download import l2_tile_key, l3_tile_key
+from egms_manifest import manifest_entry, write_manifest
 
 # Configuration
 BASE_URL_L3 = "https://egms.land.copernicus.eu/insar-api/archive/download/EGMS_{data_type}_E{e}N{n}_100km_{d}_{year}_1.zip?id={id}"
@@ -40,6 +43,7 @@ class EGMSApp:
         # Common Parameters
         self.year_var = tk.StringVar(value=DEFAULT_YEAR)
         self.token_var = tk.StringVar(value=DEFAULT_ID)
+        self.codec_var = tk.StringVar(value=OUTPUT_CODEC)
         
         # Batch Parameters for L3
         self.min_north_var = tk.IntVar(value=25)
@@ -120,19 +124,31 @@ class EGMSApp:
         button_frame.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=(0, 10))
         button_frame.columnconfigure(0, weight=1)
         
-        self.download_button = ttk.Button(button_frame, text="Download", 
+        # Output format of extracted tiles
+        codec_frame = ttk.Frame(button_frame)
+        codec_frame.grid(row=0, column=0, pady=5)
+        ttk.Label(codec_frame, text="Save as:").grid(row=0, column=0, padx=5)
+        ttk.Combobox(codec_frame, textvariable=self.codec_var,
+                     values=list(CODEC_SUFFIXES), width=8, state="readonly").grid(row=0, column=1, padx=5)
+        
+        action_frame = ttk.Frame(button_frame)
+        action_frame.grid(row=1, column=0, pady=5)
+        self.download_button = ttk.Button(action_frame, text="Download", 
                                          command=self.start_download, state=tk.NORMAL)
-        self.download_button.grid(row=0, column=0, pady=5)
+        self.download_button.grid(row=0, column=0, padx=5)
+        # Plans the same tiles into a manifest for egms.py download --manifest
+        ttk.Button(action_frame, text="Export Manifest...",
+                   command=self.export_manifest).grid(row=0, column=1, padx=5)
         
         # Progress bar
         self.progress_var = tk.DoubleVar()
         self.progress_bar = ttk.Progressbar(button_frame, variable=self.progress_var, 
                                            maximum=100, length=300)
-        self.progress_bar.grid(row=1, column=0, pady=5, sticky=(tk.W, tk.E))
+        self.progress_bar.grid(row=2, column=0, pady=5, sticky=(tk.W, tk.E))
         
         # Progress label
         self.progress_label = ttk.Label(button_frame, text="Ready")
-        self.progress_label.grid(row=2, column=0, pady=5)
+        self.progress_label.grid(row=3, column=0, pady=5)
         
         # Right panel - Information and Status
         right_frame = ttk.Frame(content_frame)
@@ -361,23 +377,27 @@ The data is organized in tiles with different coordinate systems based on proces
             )
         
         try:
-            response = curl_requests.get(url, timeout=300)
-            self.log_status(f"Response for {filename_prefix}: {response.status_code}")
-            
-            if response.status_code != 200:
-                self.log_status(f"Failed to download {filename_prefix}")
-                return False
-            
-            # Create download directory if it doesn't exist
-            os.makedirs(DOWNLOAD_BASE, exist_ok=True)
-            
-            # Read zip from memory
-            with zipfile.ZipFile(BytesIO(response.content)) as z:
-                for name in z.namelist():
-                    if name.endswith(".csv") and filename_prefix in name:
-                        z.extract(name, path=DOWNLOAD_BASE)
-                        self.log_status(f"Extracted {name}")
-                        return True
+            # Parallel runs take turns on a tile; whoever comes second finds it stored
+            with tile_lock(DOWNLOAD_BASE, filename_prefix, log=self.log_status):
+                existing = stored_tile(DOWNLOAD_BASE, filename_prefix)
+                if existing:
+                    self.log_status(f"Already downloaded: {existing}")
+                    return True
+                
+                response = curl_requests.get(url, timeout=300)
+                self.log_status(f"Response for {filename_prefix}: {response.status_code}")
+                
+                if response.status_code != 200:
+                    self.log_status(f"Failed to download {filename_prefix}")
+                    return False
+                
+                # Read zip from memory
+                with zipfile.ZipFile(BytesIO(response.content)) as z:
+                    for name in z.namelist():
+                        if name.endswith(".csv") and filename_prefix in name:
+                            extract_member(z, name, DOWNLOAD_BASE, self.codec_var.get())
+                            self.log_status(f"Extracted {name}")
+                            return True
             
             self.log_status(f"No matching CSV found in the downloaded zip for {filename_prefix}")
             return False
@@ -386,6 +406,46 @@ The data is organized in tiles with different coordinate systems based on proces
             self.log_status(f"Error downloading {filename_prefix}: {e}")
             return False
     
+    def planned_tile_keys(self):
+        """Tile keys the Download button would fetch with the current parameters, in the same order"""
+        level = self.level_var.get()
+        both = ["E", "U"]
+        if self.download_type_var.get() == "Single File":
+            if level == "L3":
+                displacement = self.displacement_var.get()
+                return [l3_tile_key(self.east_var.get(), self.north_var.get(), d)
+                        for d in (both if displacement == "Both" else [displacement])]
+            return [l2_tile_key(level, self.relative_orbit_var.get(), self.burst_cycle_var.get(),
+                                self.swath_var.get(), self.polarization_var.get())]
+        if level == "L3":
+            displacement = self.displacement_var.get()
+            return [l3_tile_key(e, n, d)
+                    for e in range(self.min_east_var.get(), self.max_east_var.get() + 1)
+                    for n in range(self.min_north_var.get(), self.max_north_var.get() + 1)
+                    for d in (both if displacement == "Both" else [displacement])]
+        # Batch L2 downloads use these fixed combinations (see download_batch_l2)
+        return [l2_tile_key(level, orbit, burst, swath, "VV")
+                for orbit in range(self.min_rel_orbit_var.get(), self.max_rel_orbit_var.get() + 1)
+                for burst in range(self.min_burst_cycle_var.get(), self.max_burst_cycle_var.get() + 1)
+                for swath in ["IW1", "IW2", "IW3"]]
+    
+    def export_manifest(self):
+        """Save the planned tiles as a JSON Lines manifest"""
+        try:
+            year, token = self.year_var.get(), self.token_var.get()
+            entries = [manifest_entry(key, year, token) for key in self.planned_tile_keys()]
+        except (ValueError, tk.TclError) as e:
+            messagebox.showerror("Export Manifest", f"Check the parameters: {e}")
+            return
+        path = filedialog.asksaveasfilename(
+            title="Export Manifest", defaultextension=".jsonl",
+            initialfile=f"EGMS_manifest_{year}_{len(entries)}_tiles.jsonl",
+            filetypes=[("JSON Lines", "*.jsonl"), ("All files", "*.*")])
+        if not path:
+            return
+        write_manifest(entries, path)
+        self.log_status(f"Exported {len(entries)} tile(s) to {path}")
+    
     def start_download(self):
         """Start the download process in a separate thread"""
         self.download_button.config(state=tk.DISABLED)
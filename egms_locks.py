@@ -0,0 +1,93 @@
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:   # Windows
+    fcntl = None
+    import msvcrt
+
+from egms_codecs import remove_partials
+
+# Configuration
+LOCK_DIR = ".locks"     # Subdirectory of the output directory holding one lock file per tile
+LOCK_POLL = 1.0         # Seconds between attempts while another process holds a lock
+LOCK_TIMEOUT = 3600     # Seconds to wait for another process's download before giving up
+
+class LockTimeout(Exception):
+    """Raised when another process held a lock for longer than the timeout"""
+
+class FileLock:
+    """Exclusive lock on a file, shared by all processes of this host
+
+    The operating system drops the lock when its holder exits, so a run that
+    crashes never leaves a tile locked. Lock files are kept for reuse.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.handle = None
+
+    def try_acquire(self):
+        handle = open(self.path, "a+b")
+        try:
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            handle.close()
+            return False
+        self.handle = handle
+        return True
+
+    def acquire(self, timeout=LOCK_TIMEOUT, poll=LOCK_POLL, on_wait=None):
+        """Block until locked; returns True if another process held the lock first"""
+        if self.try_acquire():
+            return False
+        if on_wait is not None:
+            on_wait()
+        deadline = time.monotonic() + timeout
+        while not self.try_acquire():
+            if time.monotonic() >= deadline:
+                raise LockTimeout(f"{self.path} still locked by another process after {timeout}s")
+            time.sleep(poll)
+        return True
+
+    def release(self):
+        if self.handle is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.handle.fileno(), fcntl.LOCK_UN)
+            else:
+                self.handle.seek(0)
+                msvcrt.locking(self.handle.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self.handle.close()
+            self.handle = None
+
+@contextmanager
+def tile_lock(output_dir, prefix, timeout=LOCK_TIMEOUT, log=print):
+    """Hold the lock of one tile of output_dir while it is fetched and extracted
+
+    Yields True if another process held it first (and may have stored the tile
+    meanwhile). Partial files of the tile left by crashed runs are removed once
+    the lock is held; raises LockTimeout.
+    """
+    directory = os.path.join(output_dir, LOCK_DIR)
+    os.makedirs(directory, exist_ok=True)
+    lock = FileLock(os.path.join(directory, f"{prefix}.lock"))
+    waited = lock.acquire(timeout, on_wait=lambda: log(f"Waiting for another process fetching {prefix}..."))
+    try:
+        remove_partials(output_dir, prefix)
+        yield waited
+    finally:
+        lock.release()
+
+if __name__ == "__main__":
+    print("=== EGMS Tile Locks ===")
+    print(f"Lock files: <output dir>/{LOCK_DIR}/<tile>.lock ({'flock' if fcntl else 'msvcrt'})")
+    print(f"Waiting for other processes up to {LOCK_TIMEOUT}s, polling every {LOCK_POLL}s")
@@ -0,0 +1,150 @@
+import re
+import sys
+import json
+import zlib
+
+from egms_download import DEFAULT_ID, archive_url, filename_prefix, probe_tiles
+
+# Configuration
+MANIFEST_VERSION = 1
+# Optional per-tile expectations, as reported by probes (see egms_download.probe_tile)
+EXPECTED_FIELDS = ("size", "csv_size", "crc")
+
+ARCHIVE_NAME_RE = re.compile(r"EGMS_(.+)_(\d{4}_\d{4})_1\.zip")
+
+class ManifestError(ValueError):
+    """Raised for a manifest line that cannot be read"""
+
+def manifest_entry(tile_key, year, id=DEFAULT_ID, url=None, **expected):
+    """One tile of a manifest: key, release, archive URL and any expected size/csv_size/crc"""
+    entry = {"tile_key": tile_key, "year": year, "url": url or archive_url(tile_key, year, id)}
+    entry.update({field: expected[field] for field in EXPECTED_FIELDS if expected.get(field) is not None})
+    return entry
+
+def entry_key(entry):
+    """Archive name prefix of an entry; two entries with the same key download the same file"""
+    return filename_prefix(entry["tile_key"], entry["year"])
+
+def parse_entry(record):
+    """Validate a manifest record, filling tile_key and year from the URL when only it is given"""
+    if isinstance(record, str):
+        record = {"url": record}
+    if not isinstance(record, dict):
+        raise ManifestError(f"expected an object or URL string, got {type(record).__name__}")
+    entry = dict(record)
+    if not entry.get("tile_key") or not entry.get("year"):
+        match = ARCHIVE_NAME_RE.search(entry.get("url", ""))
+        if not match:
+            raise ManifestError("needs tile_key and year, or a URL naming an EGMS archive")
+        entry.setdefault("tile_key", match.group(1))
+        entry.setdefault("year", match.group(2))
+    if not entry.get("url"):
+        entry["url"] = archive_url(entry["tile_key"], entry["year"], entry.get("id", DEFAULT_ID))
+    if entry.get("crc") is not None:
+        entry["crc"] = f"{int(str(entry['crc']), 16):08x}"
+    return entry
+
+def read_manifest(path):
+    """Entries of a JSON Lines manifest ('-' reads stdin); blank lines and # comments are skipped
+
+    A line is an entry object or a bare URL (as a JSON string or plain text).
+    """
+    entries = []
+    handle = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        for line_no, line in enumerate(handle, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                record = json.loads(line) if line[0] in "{\"" else line
+                entries.append(parse_entry(record))
+            except (json.JSONDecodeError, ManifestError) as e:
+                raise ManifestError(f"{path}:{line_no}: {e}")
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+    return entries
+
+def format_manifest(entries):
+    """JSON Lines text of a manifest, one entry per line"""
+    header = json.dumps({"manifest": MANIFEST_VERSION, "tiles": len(entries)})
+    return "".join(f"{line}\n" for line in [f"# {header}"] + [json.dumps(entry) for entry in entries])
+
+def write_manifest(entries, path):
+    """Write a manifest file ('-' writes stdout); returns the number of entries"""
+    text = format_manifest(entries)
+    if path == "-":
+        sys.stdout.write(text)
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+    return len(entries)
+
+def dedupe(entries):
+    """Entries with repeated keys dropped, keeping the first; expectations of later copies fill gaps"""
+    unique = {}
+    for entry in entries:
+        key = entry_key(entry)
+        if key in unique:
+            for field in EXPECTED_FIELDS:
+                if unique[key].get(field) is None and entry.get(field) is not None:
+                    unique[key][field] = entry[field]
+        else:
+            unique[key] = dict(entry)
+    return list(unique.values())
+
+def shard(entries, index, count):
+    """Entries of shard `index` of `count`, chosen by a hash of the key
+
+    Membership depends on the key alone, so every node computes the same split
+    whatever the order of the manifest.
+    """
+    if not 0 <= index < count:
+        raise ValueError(f"shard {index} is outside 0..{count - 1}")
+    return [entry for entry in entries if zlib.crc32(entry_key(entry).encode("utf-8")) % count == index]
+
+def parse_shard(value):
+    """(index, count) from "I/N" with I counted from 1, as typed on the command line"""
+    match = re.fullmatch(r"(\d+)/(\d+)", value.strip())
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise ValueError(f"expected a shard as I/N with 1 <= I <= N, got {value!r}")
+    return int(match.group(1)) - 1, int(match.group(2))
+
+def probe_entry(probe, id=DEFAULT_ID):
+    """Manifest entry with the archive size, CSV size and CRC of a probe result; None for an absent tile"""
+    if probe["exists"] is False:
+        return None
+    prefix = filename_prefix(probe["tile_key"], probe["year"])
+    member = next((m for m in probe["members"] if m["name"].endswith(".csv") and prefix in m["name"]), {})
+    return manifest_entry(probe["tile_key"], probe["year"], id, size=probe["archive_bytes"],
+                          csv_size=member.get("size"), crc=member.get("crc"))
+
+def probed_entries(tile_keys, year, id=DEFAULT_ID):
+    """Entries of the tiles the server has, with their sizes and CRC"""
+    entries = (probe_entry(probe, id) for probe in probe_tiles(tile_keys, year, id))
+    return [entry for entry in entries if entry is not None]
+
+def expectations(entry):
+    """The expected fields of an entry, for download_tile(expect=...)"""
+    return {field: entry[field] for field in EXPECTED_FIELDS if entry.get(field) is not None}
+
+if __name__ == "__main__":
+    print("=== EGMS Manifest ===")
+    if len(sys.argv) < 2:
+        print("Usage: python egms_manifest.py MANIFEST [I/N]")
+        sys.exit(2)
+    try:
+        entries = read_manifest(sys.argv[1])
+    except (OSError, ManifestError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    unique = dedupe(entries)
+    print(f"{len(entries)} entries, {len(unique)} distinct tiles")
+    if len(sys.argv) > 2:
+        index, count = parse_shard(sys.argv[2])
+        unique = shard(unique, index, count)
+        print(f"Shard {sys.argv[2]}: {len(unique)} tiles")
+    known = sum(entry.get("size") or 0 for entry in unique)
+    if known:
+        print(f"Expected download: {known / 1024 ** 2:.1f} MB")
@@ -0,0 +1,256 @@
+import os
+import time
+import weakref
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from egms_metrics import REGISTRY
+
+# Configuration
+MEMORY_BUDGET = os.environ.get("EGMS_MEMORY_BUDGET", "1G")   # Payload bytes held in memory at once (K/M/G suffixes)
+ADMISSION_TIMEOUT = 120     # Seconds a request waits for memory before giving up
+IDLE_BUFFER_SECONDS = 300   # Held buffers untouched this long are evicted when memory is needed
+SPILL_DIR = os.environ.get("EGMS_SPILL_DIR") or None   # Payloads that do not fit go here; None = system temp
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when a payload cannot be admitted into memory in time"""
+
+def parse_size(value):
+    """Bytes from a count or a size such as 512M, 2G or 1.5GB"""
+    text = str(value).strip().upper().rstrip("B")
+    unit = text[-1] if text and text[-1] in SIZE_UNITS else ""
+    return int(float(text[:-1] if unit else text) * SIZE_UNITS[unit])
+
+def format_size(nbytes):
+    return f"{nbytes / 1024 ** 2:.1f} MB"
+
+class Reservation:
+    """Memory reserved by one payload; grows as it is read, released when done or collected"""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self._size = [0]   # Shared with the finalizer, which must not reference self
+        weakref.finalize(self, budget._release_cell, self._size)
+
+    @property
+    def size(self):
+        return self._size[0]
+
+    def grow(self, nbytes, timeout=ADMISSION_TIMEOUT):
+        """Wait until `nbytes` more fit the budget; raises MemoryBudgetExceeded
+
+        Fails at once when this reservation alone would outgrow the budget,
+        rather than waiting for memory only it is holding.
+        """
+        if self._size[0] + nbytes > self.budget.limit:
+            raise MemoryBudgetExceeded(f"{format_size(self._size[0] + nbytes)} exceeds the whole memory budget "
+                                       f"of {format_size(self.budget.limit)}")
+        self.budget._acquire(nbytes, timeout)
+        self._size[0] += nbytes
+
+    def try_grow(self, nbytes):
+        """Reserve `nbytes` more only if they fit right now"""
+        if not self.budget._try_acquire(nbytes):
+            return False
+        self._size[0] += nbytes
+        return True
+
+    def shrink_to(self, nbytes):
+        """Give back everything beyond `nbytes` (e.g. once a compressed result replaces its inputs)"""
+        if nbytes < self._size[0]:
+            self.budget._release(self._size[0] - nbytes)
+            self._size[0] = nbytes
+
+    def release(self):
+        self.budget._release_cell(self._size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class MemoryBudget:
+    """Admission control for payloads held in memory by concurrent downloads
+
+    Callers reserve a payload's estimated size before reading it into memory.
+    When it does not fit, registered evictors (idle session buffers) are asked
+    to free space first, then the caller waits for other payloads to finish,
+    up to a timeout. Evictors only count memory actually given back, so a
+    caller may still wait after eviction. Callers that can work from disk use
+    spooled() instead of waiting.
+    """
+
+    def __init__(self, limit=MEMORY_BUDGET):
+        self.limit = parse_size(limit)
+        self.used = 0
+        self.condition = threading.Condition()
+        self.evictors = []
+
+    def add_evictor(self, evict):
+        """evict(nbytes) frees up to about nbytes of reservations and returns the bytes freed"""
+        self.evictors.append(evict)
+
+    def reservation(self):
+        return Reservation(self)
+
+    def _try_acquire(self, nbytes):
+        with self.condition:
+            if self.used + nbytes > self.limit:
+                return False
+            self.used += nbytes
+            return True
+
+    def _acquire(self, nbytes, timeout):
+        if nbytes > self.limit:
+            raise MemoryBudgetExceeded(f"{format_size(nbytes)} exceeds the whole memory budget of {format_size(self.limit)}")
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.condition:
+                shortfall = self.used + nbytes - self.limit
+                if shortfall <= 0:
+                    self.used += nbytes
+                    return
+            # Evictors release reservations themselves, so they run without the lock
+            if sum(evict(shortfall) for evict in self.evictors) > 0:
+                continue
+            with self.condition:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise MemoryBudgetExceeded(f"{format_size(nbytes)} did not fit in {format_size(self.limit)} "
+                                               f"({format_size(self.used)} in use) within {timeout}s")
+                if self.used + nbytes > self.limit:
+                    # Woken by releases; the periodic wake-up lets buffers that became idle be evicted
+                    self.condition.wait(min(remaining, 5.0))
+
+    def _release(self, nbytes):
+        with self.condition:
+            self.used -= nbytes
+            self.condition.notify_all()
+
+    def _release_cell(self, cell):
+        nbytes, cell[0] = cell[0], 0
+        if nbytes:
+            self._release(nbytes)
+
+    @contextmanager
+    def spooled(self, estimate):
+        """Temporary file kept in memory when `estimate` bytes fit the budget now, on disk otherwise"""
+        reservation = self.reservation()
+        in_memory = bool(estimate) and reservation.try_grow(estimate)
+        # A spooled file rolls over to disk once it outgrows max_size (0 would mean never)
+        f = tempfile.SpooledTemporaryFile(max_size=estimate if in_memory else 1, dir=SPILL_DIR)
+        if not in_memory:
+            SPILLS.inc()
+            f.rollover()
+        try:
+            yield f
+        finally:
+            f.close()
+            reservation.release()
+
+class HeldBuffer:
+    """A payload kept for a client, such as a prepared browser download
+
+    Eviction is advisory: the client stops offering the payload, but a download
+    button already rendered still references the bytes. The reservation is
+    therefore kept until the client calls release(), once it no longer shows it.
+    """
+
+    def __init__(self, data, filename, reservation):
+        self.data = data
+        self.filename = filename
+        self.reservation = reservation
+        self.size = len(data)
+        self.last_used = time.monotonic()
+        reservation.shrink_to(self.size)
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    @property
+    def evicted(self):
+        return self.data is None
+
+    def evict(self):
+        """Stop offering the payload; its memory stays reserved until release()"""
+        self.data = None
+
+    def release(self):
+        """Give back the payload's memory once the client no longer references it"""
+        self.data = None
+        self.reservation.release()
+
+class BufferPool:
+    """Held buffers of all clients; idle ones are evicted when the budget needs room
+
+    Evicted buffers free their memory when their client releases them (or is
+    collected), so eviction reports no bytes freed straight away.
+    """
+
+    def __init__(self, budget, idle_seconds=IDLE_BUFFER_SECONDS):
+        self.budget = budget
+        self.idle_seconds = idle_seconds
+        self.buffers = weakref.WeakSet()   # A buffer leaves when its client (session) is collected
+        self.lock = threading.Lock()
+        budget.add_evictor(self.evict_idle)
+
+    def hold(self, data, filename, reservation=None):
+        """Wrap data whose memory is accounted by `reservation` (reserved now if not given)"""
+        if reservation is None:
+            reservation = self.budget.reservation()
+            reservation.grow(len(data))
+        buffer = HeldBuffer(data, filename, reservation)
+        with self.lock:
+            self.buffers.add(buffer)
+        return buffer
+
+    def held(self):
+        with self.lock:
+            return [buffer for buffer in self.buffers if not buffer.evicted]
+
+    def evict_idle(self, nbytes):
+        """Evict least recently used buffers idle for idle_seconds, covering nbytes; returns bytes freed now (0)"""
+        now = time.monotonic()
+        idle = sorted((b for b in self.held() if now - b.last_used >= self.idle_seconds), key=lambda b: b.last_used)
+        evicted = 0
+        for buffer in idle:
+            if evicted >= nbytes:
+                break
+            evicted += buffer.size
+            buffer.evict()
+            EVICTIONS.inc()
+        return 0
+
+_shared = {}
+_shared_guard = threading.Lock()
+
+def memory_budget():
+    """The budget shared by every download path of this process"""
+    with _shared_guard:
+        if "budget" not in _shared:
+            _shared["budget"] = MemoryBudget()
+        return _shared["budget"]
+
+def buffer_pool():
+    """Held client buffers, evictable under the shared budget"""
+    budget = memory_budget()
+    with _shared_guard:
+        if "pool" not in _shared:
+            _shared["pool"] = BufferPool(budget)
+        return _shared["pool"]
+
+SPILLS = REGISTRY.counter("egms_memory_spills_total", "Payloads written to disk because they did not fit the budget")
+EVICTIONS = REGISTRY.counter("egms_memory_evictions_total", "Idle held buffers evicted to admit new payloads")
+REGISTRY.gauge("egms_memory_budget_bytes", "Memory budget for payloads", callback=lambda: memory_budget().limit)
+REGISTRY.gauge("egms_memory_reserved_bytes", "Payload memory currently reserved", callback=lambda: memory_budget().used)
+
+if __name__ == "__main__":
+    print("=== EGMS Memory Budget ===")
+    budget = memory_budget()
+    print(f"Budget: {format_size(budget.limit)} (EGMS_MEMORY_BUDGET={MEMORY_BUDGET})")
+    print(f"Spill directory: {SPILL_DIR or tempfile.gettempdir()}")
+    print(f"Idle buffers evicted after: {IDLE_BUFFER_SECONDS}s")
@@ -0,0 +1,193 @@
+import os
+import re
+import csv
+import glob
+import zlib
+import shutil
+import zipfile
+import tempfile
+from io import TextIOWrapper
+
+from egms_codecs import open_tile, strip_codec_suffix
+from egms_download import parse_tile_filename
+
+# Configuration
+DOWNLOAD_BASE = "Point_downloads"
+MERGED_DIR = "Point_merged"
+INPUT_PATTERN = "EGMS_L3_*.csv"         # Glob inside DOWNLOAD_BASE, or a batch ZIP path
+OUTPUT_NAME = "EGMS_L3_mosaic.csv"
+PARTITIONS = 64                         # More partitions = less memory per merge step
+
+# Columns describing the point itself; shared between E and U files of the same tile
+POINT_COLUMNS = ["pid", "easting", "northing", "latitude", "longitude", "height", "height_wgs84"]
+
+# L3 filenames carry the displacement component, e.g. EGMS_L3_E32N31_100km_U_2019_2023_1.csv
+DISPLACEMENT_RE = re.compile(r"_100km_([EU])_")
+
+def displacement_of(filename):
+    """Return the displacement component ("E"/"U") encoded in an L3 filename, or "" """
+    match = DISPLACEMENT_RE.search(os.path.basename(filename))
+    return match.group(1) if match else ""
+
+def point_key(row, pid_idx, easting_idx, northing_idx):
+    """Build the identity of a point: its pid, or its rounded coordinates when pid is missing"""
+    if pid_idx is not None and row[pid_idx]:
+        return row[pid_idx]
+    try:
+        # Tiles overlap on their borders with identical coordinates up to print precision
+        return f"{float(row[easting_idx]):.1f},{float(row[northing_idx]):.1f}"
+    except (TypeError, ValueError, IndexError):
+        return ",".join(row)
+
+def find_columns(header):
+    """Locate the pid/easting/northing columns (case-insensitive)"""
+    header_lower = [col.lower() for col in header]
+
+    def index_of(name):
+        return header_lower.index(name) if name in header_lower else None
+
+    return index_of("pid"), index_of("easting"), index_of("northing")
+
+def iter_sources(source):
+    """Yield (name, opener) pairs for CSVs in a directory glob or inside a batch ZIP"""
+    if source.endswith(".zip"):
+        with zipfile.ZipFile(source) as z:
+            for name in sorted(z.namelist()):
+                if name.endswith(".csv"):
+                    yield name, (lambda name=name: TextIOWrapper(z.open(name), newline=""))
+    else:
+        for path in sorted(glob.glob(source)):
+            if not parse_tile_filename(strip_codec_suffix(path))[0]:
+                continue   # Derived CSVs (statistics, locations) matching the pattern are not tiles
+            yield path, (lambda path=path: open_tile(path))
+
+def build_output_header(sources):
+    """Read only the headers of all tiles and derive the merged column layout"""
+    point_cols = []
+    value_cols = []
+    for name, opener in sources:
+        prefix = displacement_of(name)
+        with opener() as f:
+            header = next(csv.reader(f), None)
+        if not header:
+            continue
+        for col in header:
+            if col.lower() in POINT_COLUMNS:
+                if col.lower() not in point_cols:
+                    point_cols.append(col.lower())
+            else:
+                # E and U measurements live side by side after the join
+                out_col = f"{col}_{prefix.lower()}" if prefix else col
+                if out_col not in value_cols:
+                    value_cols.append(out_col)
+
+    point_cols.sort(key=POINT_COLUMNS.index)
+    return point_cols + value_cols
+
+def partition_rows(sources, output_header, partition_dir, partitions):
+    """Stream every tile once and hash-partition its rows by point identity"""
+    out_index = {col: i for i, col in enumerate(output_header)}
+    writers = []
+    handles = []
+    for p in range(partitions):
+        handle = open(os.path.join(partition_dir, f"part_{p:04d}.csv"), "w", newline="")
+        handles.append(handle)
+        writers.append(csv.writer(handle))
+
+    rows_read = 0
+    try:
+        for name, opener in sources:
+            prefix = displacement_of(name)
+            with opener() as f:
+                reader = csv.reader(f)
+                header = next(reader, None)
+                if not header:
+                    continue
+                pid_idx, easting_idx, northing_idx = find_columns(header)
+
+                # Map each input column onto its slot in the merged layout
+                mapping = []
+                for i, col in enumerate(header):
+                    if col.lower() in POINT_COLUMNS:
+                        mapping.append((i, out_index[col.lower()]))
+                    else:
+                        out_col = f"{col}_{prefix.lower()}" if prefix else col
+                        mapping.append((i, out_index[out_col]))
+
+                for row in reader:
+                    key = point_key(row, pid_idx, easting_idx, northing_idx)
+                    sparse = [key]
+                    for i, j in mapping:
+                        if i < len(row) and row[i] != "":
+                            sparse.extend((j, row[i]))
+                    p = zlib.crc32(key.encode("utf-8")) % partitions
+                    writers[p].writerow(sparse)
+                    rows_read += 1
+
+            print(f"Partitioned {os.path.basename(name)}")
+    finally:
+        for handle in handles:
+            handle.close()
+
+    return rows_read
+
+def merge_partition(path, width):
+    """Deduplicate one partition in memory, joining E/U halves of each point"""
+    merged = {}
+    with open(path, "r", newline="") as f:
+        for sparse in csv.reader(f):
+            key = sparse[0]
+            row = merged.get(key)
+            if row is None:
+                row = merged[key] = [""] * width
+            # First non-empty value wins, so border duplicates collapse into one point
+            for k in range(1, len(sparse) - 1, 2):
+                j = int(sparse[k])
+                if row[j] == "":
+                    row[j] = sparse[k + 1]
+    return merged.values()
+
+def merge_tiles(source=os.path.join(DOWNLOAD_BASE, INPUT_PATTERN), output_file=None, partitions=PARTITIONS):
+    """Merge all tiles of a batch into one deduplicated dataset with bounded memory"""
+    if output_file is None:
+        output_file = os.path.join(MERGED_DIR, OUTPUT_NAME)
+
+    if next(iter_sources(source), None) is None:
+        print(f"No tiles found for {source}")
+        return False
+
+    output_dir = os.path.dirname(output_file)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    partition_dir = tempfile.mkdtemp(prefix="egms_merge_", dir=output_dir or None)
+    try:
+        # Two passes over the sources: headers first, then the rows themselves
+        output_header = build_output_header(iter_sources(source))
+        rows_read = partition_rows(iter_sources(source), output_header, partition_dir, partitions)
+
+        points = 0
+        with open(output_file, "w", newline="") as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(output_header)
+            for p in range(partitions):
+                rows = merge_partition(os.path.join(partition_dir, f"part_{p:04d}.csv"), len(output_header))
+                writer.writerows(rows)
+                points += len(rows)
+
+        print(f"Merged {rows_read} rows into {points} points")
+        print(f"Mosaic saved as: {output_file}")
+        return True
+
+    except Exception as e:
+        print(f"Error merging tiles: {e}")
+        return False
+
+    finally:
+        shutil.rmtree(partition_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    print("=== EGMS Tile Mosaic Tool ===")
+    source = os.path.join(DOWNLOAD_BASE, INPUT_PATTERN)
+    print(f"Merging tiles matching {source}...")
+    merge_tiles(source)
@@ -0,0 +1,352 @@
+import os
+import sys
+import json
+import zlib
+import struct
+import numpy as np
+
+from egms_codecs import _zstandard, partial_path, strip_codec_suffix, tile_files, WRITE_BUFFER
+from egms_reader import iter_chunks, read_schema
+
+# Configuration
+DOWNLOAD_BASE = "Point_downloads"
+PACKED_DIR = "Point_packed"
+PACKED_SUFFIX = ".egq"
+BLOCK_ROWS = 65536       # Points per block; memory while packing or decoding is about one block of the tile
+BLOCK_CODEC = "zlib"     # "zlib" (standard library) or "zstd" (smaller and faster, needs zstandard)
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 9
+# Decimals kept per column kind: values with no more decimals are stored exactly,
+# finer ones are rounded (0.001 mm of displacement, 0.0001 of other attributes)
+DECIMALS = {"date": 3, "coordinate": 3, "geographic": 9, "attribute": 4}
+# Coordinates identify points, so they are never rounded: values that need more
+# decimals than DECIMALS allows are stored as raw float64 instead
+EXACT_KINDS = ("coordinate", "geographic")
+# Latitude/longitude in degrees; other coordinate columns are in metres
+GEOGRAPHIC_COLUMNS = ("latitude", "longitude", "lat", "lon")
+# Decoded dtype per column kind; coordinates keep float64 so point keys still match the CSV
+DECODED_DTYPES = {"date": np.float32, "coordinate": np.float64, "attribute": np.float32}
+
+MAGIC = b"EGMSQ\x01"
+FORMAT_VERSION = 1
+FOOTER_LENGTH = struct.Struct("<Q")
+DISPLACEMENT = "displacement"   # Segment holding every date column of a block as one matrix
+INTEGER_DTYPES = (np.int16, np.int32, np.int64)
+
+def packed_path(path, output_dir=PACKED_DIR):
+    """Where a tile is packed: output_dir/<tile name without .csv and codec suffix>.egq"""
+    name = os.path.splitext(strip_codec_suffix(os.path.basename(path)))[0]
+    return os.path.join(output_dir, name + PACKED_SUFFIX)
+
+def packed_files(directory=PACKED_DIR):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.endswith(PACKED_SUFFIX)) if os.path.isdir(directory) else []
+
+def compress(data, codec):
+    if codec == "zlib":
+        return zlib.compress(data, ZLIB_LEVEL)
+    if codec == "zstd":
+        return _zstandard().ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    raise ValueError(f"Unknown block codec {codec!r}; expected zlib or zstd")
+
+def decompress(data, codec):
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zstd":
+        return _zstandard().ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unknown block codec {codec!r}; expected zlib or zstd")
+
+def shuffle(values):
+    """Bytes of an integer array grouped by significance, so the mostly-zero high bytes compress well"""
+    return values.view(np.uint8).reshape(-1, values.itemsize).T.tobytes()
+
+def unshuffle(data, dtype):
+    dtype = np.dtype(dtype)
+    planes = np.frombuffer(data, np.uint8).reshape(dtype.itemsize, -1)
+    return np.ascontiguousarray(planes.T).view(dtype).ravel()
+
+def smallest_dtype(low, high):
+    """Narrowest of int16/int32/int64 holding every integer in [low, high]"""
+    for dtype in INTEGER_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return dtype
+    raise ValueError(f"Values {low}..{high} do not fit in 64-bit integers")
+
+def decimals_of(values, max_decimals):
+    """Fewest decimals that store every value as max_decimals would
+
+    Compared on the max_decimals grid, so values close to a coarser step
+    (0.0004 at 4 decimals) are never rounded onto it.
+    """
+    finest = np.rint(values * 10.0 ** max_decimals)
+    for decimals in range(max_decimals):
+        if np.all(np.fmod(finest, 10.0 ** (max_decimals - decimals)) == 0):
+            return decimals
+    return max_decimals
+
+def quantize(values, max_decimals):
+    """(int64 fixed-point values, decimals) of a float array without NaN
+
+    A value is q / 10**decimals. Both are exact integers in float64, so the
+    division gives back exactly the float the CSV text parsed to.
+    """
+    decimals = decimals_of(values, max_decimals)
+    return np.rint(values * 10.0 ** decimals).astype(np.int64), decimals
+
+def packing_kind(name, kind):
+    """Kind a column is quantized as: schema kinds, with latitude/longitude split from metric coordinates"""
+    return "geographic" if kind == "coordinate" and name.lower() in GEOGRAPHIC_COLUMNS else kind
+
+def fill_gaps(matrix, mask):
+    """Missing epochs take the previous epoch's value (0 before the first), so they add no deltas"""
+    epochs = np.where(mask, 0, np.arange(matrix.shape[1]))
+    np.maximum.accumulate(epochs, axis=1, out=epochs)
+    filled = matrix[np.arange(matrix.shape[0])[:, None], epochs]
+    filled[np.isnan(filled)] = 0
+    return filled
+
+class BlockWriter:
+    """Appends compressed segments to a packed file and describes them for the footer"""
+
+    def __init__(self, handle, codec):
+        self.handle = handle
+        self.codec = codec
+
+    def segment(self, data):
+        offset = self.handle.tell()
+        self.handle.write(compress(data, self.codec))
+        return [offset, self.handle.tell() - offset]
+
+    def mask(self, mask):
+        return self.segment(np.packbits(mask).tobytes()) if mask.any() else None
+
+    def text(self, values):
+        return {"text": self.segment("\n".join(values.tolist()).encode("utf-8"))}
+
+    def column(self, values, max_decimals, exact=False):
+        """Fixed-point integers offset from their minimum (frame of reference)
+
+        With `exact`, values that fixed-point would round are stored as raw float64.
+        """
+        mask = np.isnan(values)
+        filled = np.where(mask, 0, values)
+        q, decimals = quantize(filled, max_decimals)
+        if exact and not np.array_equal(q / 10.0 ** decimals, filled):
+            return {"dtype": "float64", "raw": True, "data": self.segment(shuffle(filled.astype(np.float64))),
+                    "mask": self.mask(mask)}
+        base = int(q.min()) if len(q) else 0
+        dtype = smallest_dtype(0, int(q.max()) - base if len(q) else 0)
+        return {"dtype": np.dtype(dtype).name, "decimals": decimals, "base": base,
+                "data": self.segment(shuffle((q - base).astype(dtype))), "mask": self.mask(mask)}
+
+    def matrix(self, values, max_decimals):
+        """Fixed-point time series stored as differences between consecutive epochs"""
+        mask = np.isnan(values)
+        q, decimals = quantize(fill_gaps(values, mask), max_decimals)
+        deltas = np.diff(q, axis=1, prepend=0)
+        dtype = smallest_dtype(int(deltas.min()), int(deltas.max())) if deltas.size else np.int16
+        # Running sums while decoding stay within the values' own range
+        fits_int32 = not q.size or smallest_dtype(int(q.min()), int(q.max())) is not np.int64
+        return {"dtype": np.dtype(dtype).name, "accumulate": "int32" if fits_int32 else "int64",
+                "decimals": decimals, "data": self.segment(shuffle(deltas.astype(dtype))), "mask": self.mask(mask)}
+
+def pack_tile(path, output_dir=PACKED_DIR, block_rows=BLOCK_ROWS, codec=BLOCK_CODEC):
+    """Store a downloaded tile as a quantized, delta-encoded, block-compressed .egq file; returns its path
+
+    Each block of points holds one segment per column: pid-like text
+    compressed as lines, other numeric columns as fixed-point integers in the
+    narrowest of int16/int32/int64, and all epochs as a fixed-point matrix
+    of differences along time. Segments are byte-shuffled before compression.
+    """
+    schema = read_schema(path)
+    dates = schema.date_columns
+    output = packed_path(path, output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    tmp_path = partial_path(output)
+    blocks = []
+    try:
+        with open(tmp_path, "wb", buffering=WRITE_BUFFER) as f:
+            f.write(MAGIC)
+            writer = BlockWriter(f, codec)
+            for chunk in iter_chunks(path, chunk_rows=block_rows, schema=schema):
+                segments = {}
+                for name in schema.header:
+                    kind = schema.kinds[name]
+                    if kind == "id":
+                        segments[name] = writer.text(chunk[name])
+                    elif kind != "date":
+                        kind = packing_kind(name, kind)
+                        segments[name] = writer.column(chunk[name], DECIMALS[kind], kind in EXACT_KINDS)
+                if dates:
+                    segments[DISPLACEMENT] = writer.matrix(chunk.matrix(dates), DECIMALS["date"])
+                blocks.append({"rows": len(chunk), "segments": segments})
+
+            footer = json.dumps({
+                "format": FORMAT_VERSION, "source": os.path.basename(path), "codec": codec,
+                "header": schema.header, "kinds": schema.kinds, "dates": dates,
+                "rows": sum(block["rows"] for block in blocks), "blocks": blocks,
+            }).encode("utf-8")
+            f.write(footer)
+            f.write(FOOTER_LENGTH.pack(len(footer)))
+            f.write(MAGIC)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, output)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return output
+
+class PackedTile:
+    """Read access to a .egq file: columns and displacement decoded straight into NumPy arrays
+
+    read() returns {column: array}; date columns come back together as
+    "displacement", a float32 (points x epochs) matrix, optionally limited
+    to the epochs between two YYYYMMDD dates.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.handle = open(path, "rb")
+        tail = len(MAGIC) + FOOTER_LENGTH.size
+        self.handle.seek(-tail, os.SEEK_END)
+        length_bytes = self.handle.read(FOOTER_LENGTH.size)
+        if self.handle.read() != MAGIC:
+            self.handle.close()
+            raise ValueError(f"{path} is not a packed EGMS tile (or was not written completely)")
+        (length,) = FOOTER_LENGTH.unpack(length_bytes)
+        self.handle.seek(-tail - length, os.SEEK_END)
+        footer = json.loads(self.handle.read(length))
+        if footer["format"] != FORMAT_VERSION:
+            self.handle.close()
+            raise ValueError(f"{path} uses packed format {footer['format']}, expected {FORMAT_VERSION}")
+        self.source = footer["source"]
+        self.codec = footer["codec"]
+        self.header = footer["header"]
+        self.kinds = footer["kinds"]
+        self.dates = footer["dates"]
+        self.rows = footer["rows"]
+        self.blocks = footer["blocks"]
+
+    @property
+    def columns(self):
+        """Readable columns: every non-date column of the tile, then "displacement" if it has epochs"""
+        return [name for name in self.header if self.kinds[name] != "date"] + ([DISPLACEMENT] if self.dates else [])
+
+    def date_range(self, start=None, end=None):
+        """(first, stop) epoch positions of the dates between start and end (YYYYMMDD, inclusive)"""
+        dates = np.array(self.dates)
+        first = int(np.searchsorted(dates, str(start), "left")) if start else 0
+        stop = int(np.searchsorted(dates, str(end), "right")) if end else len(dates)
+        return first, max(first, stop)
+
+    def _segment(self, location):
+        offset, length = location
+        self.handle.seek(offset)
+        return decompress(self.handle.read(length), self.codec)
+
+    def _mask(self, segment, shape):
+        if segment["mask"] is None:
+            return None
+        bits = np.frombuffer(self._segment(segment["mask"]), np.uint8)
+        return np.unpackbits(bits, count=int(np.prod(shape))).reshape(shape).view(bool)
+
+    def _decode(self, name, segment, rows, epochs):
+        if "text" in segment:
+            return np.array(self._segment(segment["text"]).decode("utf-8").split("\n")[:rows])
+        values = unshuffle(self._segment(segment["data"]), segment["dtype"])
+        if name == DISPLACEMENT:
+            first, stop = epochs
+            deltas = values.reshape(rows, len(self.dates))[:, :stop]
+            q = np.cumsum(deltas, axis=1, dtype=segment["accumulate"])[:, first:]
+            decoded = (q / 10.0 ** segment["decimals"]).astype(DECODED_DTYPES["date"])
+            mask = self._mask(segment, (rows, len(self.dates)))
+            if mask is not None:
+                decoded[mask[:, first:stop]] = np.nan
+            return decoded
+        dtype = DECODED_DTYPES[self.kinds[name]]
+        if segment.get("raw"):
+            decoded = values.astype(dtype)
+        else:
+            decoded = ((values.astype(np.int64) + segment["base"]) / 10.0 ** segment["decimals"]).astype(dtype)
+        mask = self._mask(segment, (rows,))
+        if mask is not None:
+            decoded[mask] = np.nan
+        return decoded
+
+    def iter_blocks(self, columns=None, start=None, end=None):
+        """Yield {column: array} per block, decoding only the requested columns"""
+        columns = columns or self.columns
+        unknown = [name for name in columns if name not in self.columns]
+        if unknown:
+            raise KeyError(f"{self.path} has no column(s) {', '.join(unknown)}; available: {', '.join(self.columns)}")
+        epochs = self.date_range(start, end)
+        for block in self.blocks:
+            yield {name: self._decode(name, block["segments"][name], block["rows"], epochs) for name in columns}
+
+    def read(self, columns=None, start=None, end=None):
+        """Whole columns as {name: array}, decoded block by block into preallocated arrays"""
+        columns = columns or self.columns
+        first, stop = self.date_range(start, end)
+        out = {}
+        offset = 0
+        for block in self.iter_blocks(columns, start, end):
+            rows = len(next(iter(block.values())))
+            for name, values in block.items():
+                if name not in out:
+                    if values.dtype.kind == "U":
+                        out[name] = []
+                    else:
+                        shape = (self.rows, stop - first) if name == DISPLACEMENT else (self.rows,)
+                        out[name] = np.empty(shape, values.dtype)
+                if isinstance(out[name], list):
+                    out[name].append(values)
+                else:
+                    out[name][offset:offset + rows] = values
+            offset += rows
+        for name, values in out.items():
+            if isinstance(values, list):
+                out[name] = np.concatenate(values) if values else np.array([], dtype="U1")
+        return out
+
+    def close(self):
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def load_packed(path, columns=None, start=None, end=None):
+    """Columns of a packed tile as {name: array}, plus its "dates" (the selected epochs)"""
+    with PackedTile(path) as tile:
+        data = tile.read(columns, start, end)
+        if DISPLACEMENT in data:
+            first, stop = tile.date_range(start, end)
+            data["dates"] = np.array(tile.dates[first:stop], dtype="U8")
+    return data
+
+def pack_all(directory=DOWNLOAD_BASE, output_dir=PACKED_DIR, codec=BLOCK_CODEC):
+    """Pack every tile of directory not packed since it was downloaded; returns the count packed"""
+    packed = 0
+    for path in tile_files(directory):
+        output = packed_path(path, output_dir)
+        if os.path.exists(output) and os.path.getmtime(output) >= os.path.getmtime(path):
+            continue
+        try:
+            pack_tile(path, output_dir, codec=codec)
+        except (OSError, ValueError) as e:
+            print(f"Error packing {os.path.basename(path)}: {e}")
+            continue
+        packed += 1
+        print(f"Packed {os.path.basename(path)}: {os.path.getsize(path) / 1024 ** 2:.1f} MB -> "
+              f"{os.path.getsize(output) / 1024 ** 2:.1f} MB")
+    return packed
+
+if __name__ == "__main__":
+    print("=== EGMS Packed Tiles ===")
+    directory = sys.argv[1] if len(sys.argv) > 1 else DOWNLOAD_BASE
+    count = pack_all(directory)
+    print(f"Packed tiles written to {PACKED_DIR}: {count}")
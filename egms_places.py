@@ -0,0 +1,183 @@
+import os
+import csv
+
+from egms_codecs import open_tile, strip_codec_suffix
+from egms_profile import span, stage, timed_iter
+from egms_checkpoint import Checkpoint, is_enriched
+
+# Configuration
+NAMES_DATASETS_DIR = "Point_locations"
+TABLE_SUFFIX = "_places.csv"        # pid -> place_id, one row per point
+DICTIONARY_SUFFIX = "_place_names.csv"   # place_id -> location, one row per distinct place
+
+def table_paths(input_file, output_dir=NAMES_DATASETS_DIR):
+    """(side table, place dictionary) paths belonging to a tile"""
+    base_filename = os.path.splitext(strip_codec_suffix(os.path.basename(input_file)))[0]
+    return (os.path.join(output_dir, f"{base_filename}{TABLE_SUFFIX}"),
+            os.path.join(output_dir, f"{base_filename}{DICTIONARY_SUFFIX}"))
+
+def has_place_table(input_file, output_dir=NAMES_DATASETS_DIR):
+    return all(os.path.exists(path) for path in table_paths(input_file, output_dir))
+
+class LocationCsvWriter:
+    """Full copy of the tile with the location column (the original output)"""
+
+    def __init__(self, path, handle=None):
+        self.path = path
+        self.handle = handle or open(path, "w", newline="")
+        self.writer = csv.writer(self.handle)
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+
+    def close(self):
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class PlaceTableWriter(LocationCsvWriter):
+    """Accepts the same rows as LocationCsvWriter but keeps only pid -> place ID
+
+    The first row is the enriched header; it tells where the pid and location are.
+    Distinct locations are numbered in order of appearance and written on close.
+    With a `checkpoint`, rows go to its partial file and the place numbering is
+    saved with it, so a resumed run continues both.
+    """
+
+    def __init__(self, input_file, output_dir=NAMES_DATASETS_DIR, checkpoint=None):
+        self.path, self.dictionary_path = table_paths(input_file, output_dir)
+        self.checkpoint = checkpoint
+        super().__init__(self.path, checkpoint.open() if checkpoint else None)
+        places = checkpoint.state.get("places", []) if checkpoint else []
+        self.place_ids = {location: place_id for place_id, location in enumerate(places)}
+        self.pid_idx = self.location_idx = None
+        self.rows = checkpoint.rows if checkpoint else 0
+        self.resumed = bool(checkpoint and checkpoint.offset)
+
+    def writerow(self, row):
+        if self.location_idx is None:
+            header_lower = [col.lower() for col in row]
+            self.pid_idx = header_lower.index("pid") if "pid" in header_lower else None
+            self.location_idx = header_lower.index("location")
+            if not self.resumed:
+                self.writer.writerow(["pid", "place_id"])
+            return
+        # Points without a pid column are identified by their row number
+        pid = row[self.pid_idx] if self.pid_idx is not None else self.rows
+        place_id = self.place_ids.setdefault(row[self.location_idx], len(self.place_ids))
+        self.writer.writerow([pid, place_id])
+        self.rows += 1
+        if self.checkpoint and self.checkpoint.due(self.rows):
+            self.checkpoint.save(self.rows, self.state())
+
+    def state(self):
+        """Place numbering to resume with: locations in place ID order"""
+        return {"places": list(self.place_ids)}
+
+    def close(self):
+        # The dictionary is written first: the table only gets its name once both are complete
+        with open(self.dictionary_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["place_id", "location"])
+            for location, place_id in self.place_ids.items():
+                writer.writerow([place_id, location])
+        if self.checkpoint:
+            self.checkpoint.finish()
+        else:
+            super().close()
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.checkpoint and exc_type is not None:
+            # Keep the rows written so far for the next run instead of completing the table
+            self.checkpoint.abandon(self.rows, self.state(), exc)
+            return
+        self.close()
+
+def enrich_place_table(input_file, transformer, geocoder, output_dir=NAMES_DATASETS_DIR, force=False):
+    """Table mode straight from typed pid/coordinate columns; returns the table path
+
+    Only three columns are parsed, and coordinates are transformed a block at a time.
+    Progress is checkpointed like the CSV mode's; finished tables are skipped unless `force`.
+    """
+    from egms_reader import read_schema, iter_chunks
+
+    table_path, dictionary_path = table_paths(input_file, output_dir)
+    if not force and is_enriched(input_file, table_path) and os.path.exists(dictionary_path):
+        print(f"Already enriched: {table_path}")
+        return table_path
+
+    schema = read_schema(input_file)
+    pid = schema.find("pid")
+    easting = schema.find("easting", "x", "longitude", "lon")
+    northing = schema.find("northing", "y", "latitude", "lat")
+    if easting is None or northing is None:
+        print(f"Required coordinate columns not found. Available columns: {schema.header}")
+        return None
+
+    checkpoint = Checkpoint(input_file, table_path)
+    done = checkpoint.load()
+    if done:
+        print(f"Resuming after {done} rows (checkpoint {checkpoint.path})")
+
+    offset = 0
+    chunks = timed_iter("parse", iter_chunks(input_file, ([pid] if pid else []) + [easting, northing], schema=schema))
+    with span("enrich", file=os.path.basename(input_file), mode="table"), \
+            PlaceTableWriter(input_file, output_dir, checkpoint) as table:
+        table.writerow(["pid", "location"])
+        for chunk in chunks:
+            start = offset
+            offset += len(chunk)
+            if offset <= done:
+                continue   # Finished by an earlier run: no projection, no lookups
+            skip = max(0, done - start)
+            pids = chunk[pid].tolist() if pid else list(range(start, offset))
+            if transformer is None:
+                points = [(p, None, None) for p in pids[skip:]]
+            else:
+                with span("project", rows=len(chunk)):
+                    lon, lat = transformer.transform(chunk[easting], chunk[northing])
+                points = zip(pids[skip:], lat.tolist()[skip:], lon.tolist()[skip:])
+            for p, location in timed_iter("geocode", geocoder.reverse_stream(points)):
+                with stage("write"):
+                    table.writerow([p, location])
+    print(f"Located {offset} points")
+    return table.path
+
+def load_locations(input_file, output_dir=NAMES_DATASETS_DIR):
+    """Return {pid: location} for a tile enriched in table mode"""
+    table_path, dictionary_path = table_paths(input_file, output_dir)
+    with open(dictionary_path, "r", newline="") as f:
+        reader = csv.reader(f)
+        next(reader)
+        names = {place_id: location for place_id, location in reader}
+    with open(table_path, "r", newline="") as f:
+        reader = csv.reader(f)
+        next(reader)
+        return {pid: names[place_id] for pid, place_id in reader}
+
+def join_locations(input_file, output_file=None, output_dir=NAMES_DATASETS_DIR):
+    """Write the tile with a location column after northing, as the full-copy mode does"""
+    if output_file is None:
+        base_filename = os.path.splitext(strip_codec_suffix(os.path.basename(input_file)))[0]
+        output_file = os.path.join(output_dir, f"{base_filename}_locations.csv")
+
+    locations = load_locations(input_file, output_dir)
+    with open_tile(input_file) as infile, open(output_file, "w", newline="") as outfile:
+        reader = csv.reader(infile)
+        writer = csv.writer(outfile)
+        header = next(reader)
+        header_lower = [col.lower() for col in header]
+        pid_idx = header_lower.index("pid") if "pid" in header_lower else None
+        insert_at = header_lower.index("northing") + 1 if "northing" in header_lower else len(header)
+
+        writer.writerow(header[:insert_at] + ["location"] + header[insert_at:])
+        for row_no, row in enumerate(reader):
+            pid = row[pid_idx] if pid_idx is not None else str(row_no)
+            writer.writerow(row[:insert_at] + [locations.get(pid, "")] + row[insert_at:])
+
+    print(f"Location dataset saved as: {output_file}")
+    return output_file
@@ -0,0 +1,168 @@
+import os
+import re
+import threading
+
+from egms_download import TileUnavailable, filename_prefix, open_csv_stream
+from egms_scheduler import shared_scheduler
+
+# Configuration
+CACHE_DIR = "Point_cache"
+CACHE_MAX_BYTES = 2 * 1024 ** 3   # Least recently used tiles are evicted beyond this size
+PREFETCH_BUDGET = 4               # Neighbours warmed after each interactive fetch
+
+L3_KEY_RE = re.compile(r"^L3_E(\d+)N(\d+)_100km_([EU])$")
+L2_KEY_RE = re.compile(r"^(L2[ab])_(\d{3})_(\d{4})_(IW\d)_(\w{2})$")
+
+def neighbour_keys(tile_key):
+    """Tiles a user is likely to request next, most likely first"""
+    match = L3_KEY_RE.match(tile_key)
+    if match:
+        e, n, d = int(match.group(1)), int(match.group(2)), match.group(3)
+        other = "U" if d == "E" else "E"
+        return [
+            f"L3_E{e}N{n}_100km_{other}",
+            f"L3_E{e + 1}N{n}_100km_{d}",
+            f"L3_E{e - 1}N{n}_100km_{d}",
+            f"L3_E{e}N{n + 1}_100km_{d}",
+            f"L3_E{e}N{n - 1}_100km_{d}",
+        ]
+
+    match = L2_KEY_RE.match(tile_key)
+    if match:
+        data_type, orbit, burst, swath, pol = match.groups()
+        burst = int(burst)
+        keys = [
+            f"{data_type}_{orbit}_{burst + 1:04d}_{swath}_{pol}",
+            f"{data_type}_{orbit}_{burst - 1:04d}_{swath}_{pol}",
+        ]
+        keys += [f"{data_type}_{orbit}_{burst:04d}_{other}_{pol}" for other in ("IW1", "IW2", "IW3") if other != swath]
+        return keys
+
+    return []
+
+def evict_lru(directory, max_bytes, suffix, keep=()):
+    """Delete the least recently used files ending in `suffix` until under max_bytes, sparing names in `keep`"""
+    entries = []
+    for name in os.listdir(directory):
+        if name.endswith(suffix):
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except OSError:
+                continue  # Removed since the listing
+            entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        if name in keep:
+            continue
+        try:
+            os.remove(os.path.join(directory, name))
+            total -= size
+        except OSError:
+            pass
+
+class TileCache:
+    """Extracted tile CSVs on local disk, keyed by tile and release (not by token)"""
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def path(self, tile_key, year):
+        return os.path.join(self.directory, f"{filename_prefix(tile_key, year)}.csv")
+
+    def contains(self, tile_key, year):
+        return os.path.exists(self.path(tile_key, year))
+
+    def size(self, tile_key, year):
+        """Bytes of a cached tile, or None on a miss"""
+        try:
+            return os.path.getsize(self.path(tile_key, year))
+        except OSError:
+            return None
+
+    def get(self, tile_key, year):
+        """Return (csv bytes, csv name) or None on a miss"""
+        path = self.path(tile_key, year)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # Mark as recently used
+            return data, os.path.basename(path)
+        except OSError:
+            return None
+
+    def put(self, tile_key, year, data):
+        """Store a tile atomically, then evict old entries beyond the size limit"""
+        return self.put_stream(tile_key, year, [data])
+
+    def put_stream(self, tile_key, year, chunks):
+        """Store a tile arriving as byte chunks without holding it in memory; returns its path"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(tile_key, year)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict()
+        return path
+
+    def evict(self):
+        with self.lock:
+            evict_lru(self.directory, self.max_bytes, ".csv")
+
+class Prefetcher:
+    """Warms the tile cache with neighbours of interactively requested tiles
+
+    Downloads run in the scheduler's "prefetch" class, so they only use slots that
+    interactive and batch work leave free.
+    """
+
+    def __init__(self, cache=None, scheduler=None, open_stream=open_csv_stream):
+        self.cache = cache or TileCache()
+        self.open_stream = open_stream
+        self.scheduler = scheduler or shared_scheduler()
+        self.in_flight = set()
+        self.missing = set()   # Tiles the server does not have; never retried
+        self.lock = threading.Lock()
+
+    def warm(self, tile_key, year, id, budget=PREFETCH_BUDGET):
+        """Queue up to `budget` uncached neighbours; returns the keys scheduled"""
+        neighbours = neighbour_keys(tile_key)
+        # The user has moved on: queued warming of tiles that are not neighbours any more is dropped
+        self.scheduler.cancel_queued("prefetch", keep=lambda tag: tag[0] in neighbours)
+        scheduled = []
+        for key in neighbours:
+            if len(scheduled) >= budget:
+                break
+            with self.lock:
+                if (key, year) in self.in_flight or (key, year) in self.missing or self.cache.contains(key, year):
+                    continue
+                self.in_flight.add((key, year))
+            future = self.scheduler.submit(self._warm_one, key, year, id, priority="prefetch", tag=(key, year))
+            future.add_done_callback(lambda _, done=(key, year): self._finished(done))
+            scheduled.append(key)
+        return scheduled
+
+    def _finished(self, tile):
+        with self.lock:
+            self.in_flight.discard(tile)
+
+    def _warm_one(self, tile_key, year, id):
+        try:
+            # Written to the cache as it is decompressed; never held in memory
+            _, stream = self.open_stream(tile_key, year, id)
+            self.cache.put_stream(tile_key, year, stream)
+        except TileUnavailable:
+            with self.lock:
+                self.missing.add((tile_key, year))
+        except Exception as e:
+            # Background failures are never surfaced to users
+            print(f"Prefetch skipped {filename_prefix(tile_key, year)}: {e}")
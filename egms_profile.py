@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+from contextlib import nullcontext
+
+# Configuration
+# Off unless set: comma-separated "trace" (stage spans), "cprofile" (function profile),
+# "memory" (tracemalloc allocation snapshot), or "all"
+PROFILE = os.environ.get("EGMS_PROFILE", "")
+PROFILE_DIR = "Point_profiles"
+MEMORY_TOP = 30        # Allocation sites listed in the memory report
+CPROFILE_TOP = 25      # Functions printed in the run summary
+
+MODES = ("trace", "cprofile", "memory")
+
+_enabled = set()
+_events = []
+_totals = {}           # stage -> [entries, self seconds]
+_lock = threading.Lock()
+_local = threading.local()
+_state = {"profiler": None, "started": None, "run": None}
+_NULL = nullcontext()
+
+def parse_modes(value):
+    """Set of modes from an EGMS_PROFILE / --profile value ("1" means trace only)"""
+    modes = {mode.strip().lower() for mode in value.split(",") if mode.strip()}
+    if "all" in modes:
+        return set(MODES)
+    if modes & {"1", "true", "yes", "on"}:
+        modes = (modes - {"1", "true", "yes", "on"}) | {"trace"}
+    unknown = modes - set(MODES)
+    if unknown:
+        raise ValueError(f"Unknown profile mode(s) {', '.join(sorted(unknown))}; expected {', '.join(MODES)} or all")
+    return modes
+
+def enabled(mode="trace"):
+    return mode in _enabled
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+class _Stage:
+    """One timed entry into a stage; time spent in nested stages is not counted twice"""
+
+    __slots__ = ("name", "args", "event", "start", "child")
+
+    def __init__(self, name, args, event):
+        self.name = name
+        self.args = args
+        self.event = event
+
+    def __enter__(self):
+        self.child = 0.0
+        self.start = time.perf_counter()
+        _stack().append(self)
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        stack = _stack()
+        stack.pop()
+        elapsed = end - self.start
+        if stack:
+            stack[-1].child += elapsed
+        with _lock:
+            totals = _totals.setdefault(self.name, [0, 0.0])
+            totals[0] += 1
+            totals[1] += elapsed - self.child
+            if self.event:
+                _events.append({"name": self.name, "cat": "egms", "ph": "X", "pid": os.getpid(),
+                                "tid": threading.get_ident(), "ts": self.start * 1e6,
+                                "dur": elapsed * 1e6, "args": self.args})
+        return False
+
+def span(name, **args):
+    """Time a stage and record it as an event in the trace (for coarse steps: a request, a file)"""
+    if "trace" not in _enabled:
+        return _NULL
+    return _Stage(name, args, True)
+
+def stage(name):
+    """Time a stage into the run totals only (for hot loops: one row, one lookup)"""
+    if "trace" not in _enabled:
+        return _NULL
+    return _Stage(name, None, False)
+
+def timed_iter(name, iterable):
+    """Count the time spent producing each item of `iterable` towards stage `name`
+
+    Lazy pipelines (CSV reader -> projection -> geocoder -> writer) interleave their
+    stages row by row; this attributes each pull to the stage that produced it. One
+    trace event spans the first to the last item.
+    """
+    if "trace" not in _enabled:
+        return iterable
+    return _timed_iter(name, iter(iterable))
+
+def _timed_iter(name, iterator):
+    first = time.perf_counter()
+    items = 0
+    busy = 0.0
+    try:
+        while True:
+            entry = _Stage(name, None, False)
+            with entry:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+            busy += time.perf_counter() - entry.start - entry.child
+            items += 1
+            yield item
+    finally:
+        with _lock:
+            _events.append({"name": name, "cat": "egms.stream", "ph": "X", "pid": os.getpid(),
+                            "tid": threading.get_ident(), "ts": first * 1e6,
+                            "dur": (time.perf_counter() - first) * 1e6,
+                            "args": {"items": items, "busy_s": round(busy, 6)}})
+
+def start(modes=None, run=None):
+    """Begin profiling this process; finish() (also run at exit) writes the results"""
+    if modes is None:
+        try:
+            modes = parse_modes(PROFILE)
+        except ValueError as e:
+            print(f"Profiling disabled: {e}")
+            return
+    if not modes or _state["started"] is not None:
+        return
+    _enabled.update(modes)
+    _state["started"] = time.time()
+    _state["run"] = run or os.path.splitext(os.path.basename(sys.argv[0] or "egms"))[0] or "egms"
+    if "memory" in modes:
+        import tracemalloc
+        tracemalloc.start()
+    if "cprofile" in modes:
+        # Profiles the thread that calls start(); worker threads only appear in the trace
+        import cProfile
+        _state["profiler"] = cProfile.Profile()
+        _state["profiler"].enable()
+    atexit.register(finish)
+
+def finish():
+    """Write the trace, profile and memory report of the run; returns the trace path or None"""
+    if _state["started"] is None:
+        return None
+    profiler, _state["profiler"] = _state["profiler"], None
+    if profiler is not None:
+        profiler.disable()
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(_state["started"]))
+    base = os.path.join(PROFILE_DIR, f"{_state['run']}_{stamp}_{os.getpid()}")
+    _state["started"] = None
+    written = []
+
+    if "trace" in _enabled:
+        with _lock:
+            events = list(_events)
+            totals = {name: {"entries": n, "self_s": round(seconds, 6)} for name, (n, seconds) in _totals.items()}
+        # Chrome trace event format: open in chrome://tracing or https://ui.perfetto.dev
+        with open(f"{base}.trace.json", "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"stages": totals}}, f)
+        written.append(f"{base}.trace.json")
+        print("\n=== Profile: time per stage (self) ===")
+        for name, total in sorted(totals.items(), key=lambda item: -item[1]["self_s"]):
+            print(f"{name:<12} {total['self_s']:>10.3f} s  {total['entries']:>10} entries")
+
+    if profiler is not None:
+        import pstats
+        profiler.dump_stats(f"{base}.prof")
+        written.append(f"{base}.prof")
+        print(f"\n=== Profile: top {CPROFILE_TOP} functions by cumulative time ===")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(CPROFILE_TOP)
+
+    if "memory" in _enabled:
+        import tracemalloc
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            with open(f"{base}.memory.txt", "w") as f:
+                f.write(f"Current {current / 1024 ** 2:.1f} MB, peak {peak / 1024 ** 2:.1f} MB\n\n")
+                for statistic in snapshot.statistics("lineno")[:MEMORY_TOP]:
+                    f.write(f"{statistic}\n")
+            written.append(f"{base}.memory.txt")
+            print(f"\nPeak traced memory: {peak / 1024 ** 2:.1f} MB")
+
+    for path in written:
+        print(f"Profile written: {path}")
+    return written[0] if written else None
+
+# Any script importing this module is profiled when EGMS_PROFILE is set
+if PROFILE:
+    start()
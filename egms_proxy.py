@@ -0,0 +1,294 @@
+import os
+import re
+import shutil
+import zipfile
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from egms_download import BASE_URL, TileUnavailable, filename_prefix, stream_csv_member
+from egms_prefetch import evict_lru
+from egms_scheduler import INTERACTIVE, PRIORITY_CLASSES, shared_scheduler
+
+# Configuration
+HOST = "0.0.0.0"
+PORT = 8502
+PROXY_CACHE_DIR = "Point_proxy_cache"
+CACHE_MAX_BYTES = 20 * 1024 ** 3   # Least recently used archives are evicted beyond this size
+CHUNK_SIZE = 1024 * 1024           # Bytes relayed per read
+TIMEOUT = 600
+
+# Same path as the upstream API, so index.html only swaps the host
+ARCHIVE_PATH_RE = re.compile(r"^/insar-api/archive/download/(EGMS_[A-Za-z0-9_]+_\d{4}_\d{4}_1)\.zip$")
+
+def cache_path(prefix):
+    return os.path.join(PROXY_CACHE_DIR, f"{prefix}.zip")
+
+class ArchiveFetch:
+    """One upstream download into the cache, streamed to any number of clients while it grows
+
+    The download runs on its own thread and writes to a partial file, so a
+    slow client never holds up the fetch or the other clients of the tile.
+    """
+
+    def __init__(self, prefix, token, priority):
+        self.prefix = prefix
+        self.token = token
+        self.priority = priority
+        self.path = cache_path(prefix)
+        self.tmp_path = f"{self.path}.{os.getpid()}.{id(self)}.tmp"
+        self.status = None      # Upstream HTTP status, once known
+        self.length = None      # Upstream Content-Length, if sent
+        self.size = 0           # Bytes in the partial file so far
+        self.done = False
+        self.error = None
+        self.condition = threading.Condition()
+
+    def start(self, on_finish):
+        def run():
+            try:
+                self.fetch()
+            finally:
+                on_finish(self)
+        threading.Thread(target=run, name=f"egms-proxy-{self.prefix}", daemon=True).start()
+
+    def fetch(self):
+        import curl_cffi.requests as curl_requests
+
+        response = None
+        try:
+            # Only misses take an upstream slot, held for the whole download
+            with shared_scheduler().slot(self.priority, tag=self.prefix):
+                response = curl_requests.get(BASE_URL.format(prefix=self.prefix, id=self.token),
+                                             stream=True, timeout=TIMEOUT)
+                if response.status_code != 200:
+                    self._finish(status=response.status_code)
+                    return
+                os.makedirs(PROXY_CACHE_DIR, exist_ok=True)
+                with open(self.tmp_path, "wb") as f:
+                    with self.condition:
+                        self.length = response.headers.get("content-length")
+                        self.status = 200
+                        self.condition.notify_all()
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        f.write(chunk)
+                        f.flush()
+                        with self.condition:
+                            self.size += len(chunk)
+                            self.condition.notify_all()
+            # Only a fully received archive enters the cache
+            self._finish(complete=True)
+        except Exception as e:
+            self._finish(status=502, error=e)
+            return
+        finally:
+            if response is not None:
+                response.close()
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)   # Clients still reading keep their open handle
+        if self.status == 200:
+            # Never the archive just received, which its clients may not have opened yet
+            evict_lru(PROXY_CACHE_DIR, CACHE_MAX_BYTES, ".zip", keep=(os.path.basename(self.path),))
+
+    def _finish(self, status=None, complete=False, error=None):
+        with self.condition:
+            if complete:
+                # Renamed under the condition, so a client opens either the partial file or the archive
+                os.replace(self.tmp_path, self.path)
+            if self.status is None:
+                self.status = status
+            self.error = error
+            self.done = True
+            self.condition.notify_all()
+
+    def wait_status(self):
+        """Upstream HTTP status; 200 once the archive has started arriving"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.status is not None)
+            return self.status
+
+    def chunks(self):
+        """The archive's bytes as they arrive; raises IOError if the download fails part way
+
+        The file is opened here rather than on the first read, so a missing
+        archive surfaces before any response is sent.
+        """
+        with self.condition:
+            if self.error is not None:
+                raise IOError(f"Upstream download of {self.prefix} failed: {self.error}")
+            f = open(self.path if self.done else self.tmp_path, "rb")
+        return self._read(f)
+
+    def _read(self, f):
+        with f:
+            position = 0
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.size > position or self.done)
+                    available, done, error = self.size, self.done, self.error
+                while position < available:
+                    chunk = f.read(min(CHUNK_SIZE, available - position))
+                    if not chunk:
+                        break
+                    position += len(chunk)
+                    yield chunk
+                if done:
+                    if error is not None:
+                        raise IOError(f"Upstream download of {self.prefix} failed: {error}")
+                    return
+
+# Downloads in progress by archive, so concurrent misses for the same tile fetch it only once.
+# A fetch leaves the registry when it ends; later requests find the archive in the cache.
+_fetches = {}
+_fetches_guard = threading.Lock()
+
+def _fetch_finished(fetch):
+    with _fetches_guard:
+        if _fetches.get(fetch.prefix) is fetch:
+            del _fetches[fetch.prefix]
+
+def join_fetch(prefix, token, priority):
+    """The download of an archive missing from the cache (started if needed), or None on a cache hit"""
+    with _fetches_guard:
+        fetch = _fetches.get(prefix)
+        # A finished fetch still registered has either cached the archive or failed
+        if fetch is None or fetch.done:
+            if os.path.exists(cache_path(prefix)):
+                return None
+            fetch = _fetches[prefix] = ArchiveFetch(prefix, token, priority)
+            fetch.start(_fetch_finished)
+        return fetch
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    """GET /insar-api/archive/download/<archive>.zip?id=<token>[&extract=1][&priority=batch]"""
+
+    response_started = False
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        match = ARCHIVE_PATH_RE.match(url.path)
+        if not match:
+            self.send_error(404, "Unknown archive path")
+            return
+
+        query = parse_qs(url.query)
+        prefix = match.group(1)
+        token = query.get("id", [""])[0]
+        extract = query.get("extract", ["0"])[0] in ("1", "true", "yes")
+        # Batch jobs routed through the proxy say so, and queue behind browser requests
+        priority = query.get("priority", [INTERACTIVE])[0]
+        if priority not in PRIORITY_CLASSES:
+            self.send_error(400, f"Unknown priority {priority}")
+            return
+
+        try:
+            try:
+                self.serve_archive(prefix, token, priority, extract)
+            except FileNotFoundError:
+                if self.response_started:
+                    raise
+                # Evicted between the cache lookup and opening it: fetch it again
+                self.log_message("cache entry %s evicted, fetching again", prefix)
+                self.serve_archive(prefix, token, priority, extract)
+
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Client went away
+
+        except Exception as e:
+            self.log_error("error serving %s: %s", prefix, e)
+            if not self.response_started:
+                self.send_error(502, f"Error fetching {prefix}")
+
+    def serve_archive(self, prefix, token, priority, extract):
+        """Send the archive (or its CSV) from the cache, or while it is being fetched"""
+        fetch = join_fetch(prefix, token, priority)
+        if fetch is not None:
+            status = fetch.wait_status()
+            if status != 200:
+                self.send_error(status, f"Upstream returned {status}")
+            elif extract:
+                self.relay_csv(fetch.chunks(), prefix)
+            else:
+                self.relay(fetch.chunks(), f"{prefix}.zip", "application/zip", fetch.length)
+            return
+
+        path = cache_path(prefix)
+        os.utime(path)  # Mark as recently used
+        self.log_message("cache hit %s", prefix)
+        if extract:
+            self.send_csv(path, prefix)
+        else:
+            self.send_file(path, f"{prefix}.zip", "application/zip")
+
+    def send_headers(self, filename, content_type, length=None):
+        self.response_started = True
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Disposition", f'attachment; filename="{filename}"')
+        self.send_header("Access-Control-Allow-Origin", "*")
+        if length is not None:
+            self.send_header("Content-Length", str(length))
+        self.end_headers()
+
+    def write_body(self, chunks):
+        """Write chunks to the client; the download into the cache goes on if it disconnects"""
+        for chunk in chunks:
+            self.wfile.write(chunk)
+
+    def relay(self, chunks, filename, content_type, length=None):
+        """Pass upstream bytes through to the client while they are being cached"""
+        self.send_headers(filename, content_type, length)
+        self.write_body(chunks)
+
+    def relay_csv(self, chunks, prefix):
+        """Decompress the tile CSV on the fly as the archive arrives from upstream"""
+        try:
+            name, data = stream_csv_member(chunks, prefix, CHUNK_SIZE)
+        except TileUnavailable as e:
+            self.send_error(404, str(e))
+            return
+        # Size is unknown until the member ends: the body is delimited by closing the connection
+        self.send_headers(os.path.basename(name), "text/csv")
+        self.write_body(data)
+
+    def send_file(self, path, filename, content_type):
+        with open(path, "rb") as f:
+            self.send_headers(filename, content_type, os.fstat(f.fileno()).st_size)
+            shutil.copyfileobj(f, self.wfile, CHUNK_SIZE)
+
+    def send_csv(self, path, prefix):
+        """Decompress the tile's CSV member straight from the cached archive"""
+        with zipfile.ZipFile(path) as z:
+            for info in z.infolist():
+                if info.filename.endswith(".csv") and prefix in info.filename:
+                    self.send_headers(os.path.basename(info.filename), "text/csv", info.file_size)
+                    with z.open(info) as member:
+                        shutil.copyfileobj(member, self.wfile, CHUNK_SIZE)
+                    return
+        self.send_error(404, f"No matching CSV found in {prefix}.zip")
+
+def proxy_url(base, tile_key, year, id, extract=True):
+    """URL of a tile on a proxy whose public address is `base`"""
+    url = f"{base.rstrip('/')}/insar-api/archive/download/{filename_prefix(tile_key, year)}.zip?id={id}"
+    return f"{url}&extract=1" if extract else url
+
+def start_background(host=HOST, port=PORT):
+    """Run the proxy on a daemon thread inside another process (e.g. the web app)"""
+    server = ThreadingHTTPServer((host, port), ProxyHandler)
+    threading.Thread(target=server.serve_forever, name="egms-proxy", daemon=True).start()
+    return server
+
+def serve(host=HOST, port=PORT):
+    """Run the proxy until interrupted"""
+    server = ThreadingHTTPServer((host, port), ProxyHandler)
+    print(f"EGMS proxy listening on http://{host}:{port} (cache: {PROXY_CACHE_DIR})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    print("=== EGMS Download Proxy ===")
+    serve()
@@ -0,0 +1,137 @@
+import re
+import csv
+from itertools import islice
+import numpy as np
+
+from egms_codecs import open_tile
+
+# Configuration
+CHUNK_ROWS = 100000      # Rows parsed per block; memory is about CHUNK_ROWS x projected columns x 8 bytes
+
+# Date columns in EGMS CSVs are named YYYYMMDD
+DATE_COLUMN_RE = re.compile(r"^\d{8}$")
+# An empty cell: at the start of a line or after a comma, followed by a comma or the end of the line
+EMPTY_FIELD_RE = re.compile(r"(?:^|(?<=,))(?=,|\r?\n)|(?<=,)\Z", re.MULTILINE)
+COORDINATE_COLUMNS = ["easting", "northing", "x", "y", "latitude", "longitude", "lat", "lon", "height", "height_wgs84"]
+
+class TileSchema:
+    """Column layout of a tile, inferred from its header and first row
+
+    Each column is one of "id" (text such as pid), "coordinate", "date"
+    (a displacement epoch) or "attribute" (any other numeric column).
+    """
+
+    def __init__(self, header, first_row=None):
+        self.header = header
+        self.positions = {name: i for i, name in enumerate(header)}
+        self.kinds = {}
+        for i, name in enumerate(header):
+            if DATE_COLUMN_RE.match(name):
+                self.kinds[name] = "date"
+            elif name.lower() in COORDINATE_COLUMNS:
+                self.kinds[name] = "coordinate"
+            elif name.lower() == "pid" or (first_row and i < len(first_row) and not is_number(first_row[i])):
+                self.kinds[name] = "id"
+            else:
+                self.kinds[name] = "attribute"
+
+    def __contains__(self, name):
+        return name in self.positions
+
+    def columns(self, kind):
+        return [name for name in self.header if self.kinds[name] == kind]
+
+    @property
+    def date_columns(self):
+        return self.columns("date")
+
+    def find(self, *candidates):
+        """First header column matching one of the names (case-insensitive), or None"""
+        lower = {name.lower(): name for name in self.header}
+        for candidate in candidates:
+            if candidate.lower() in lower:
+                return lower[candidate.lower()]
+        return None
+
+def is_number(cell):
+    if cell == "":
+        return True   # Missing value in a numeric column
+    try:
+        float(cell)
+        return True
+    except ValueError:
+        return False
+
+def read_schema(path):
+    """Infer the schema of a tile from its first two lines"""
+    with open_tile(path) as f:
+        header = next(csv.reader([f.readline()]))
+        first = f.readline()
+    return TileSchema(header, next(csv.reader([first])) if first.strip() else None)
+
+def has_empty_field(text):
+    return (",," in text or ",\n" in text or ",\r" in text or "\n," in text
+            or text.startswith(",") or text.endswith(","))
+
+def parse_numeric(lines, usecols, dtype=np.float64):
+    """Parse numeric columns of a block of CSV lines with NumPy's C parser"""
+    text = "".join(lines)
+    if has_empty_field(text):
+        # Empty cells (missing epochs) are not understood by loadtxt; rewrite them to "nan"
+        text = EMPTY_FIELD_RE.sub("nan", text)
+        lines = text.splitlines()
+    return np.loadtxt(lines, delimiter=",", usecols=usecols, dtype=dtype, ndmin=2)
+
+def parse_text(lines, position):
+    """One text column of a block of CSV lines"""
+    return np.array([line.split(",", position + 1)[position] for line in lines])
+
+class TileChunk:
+    """A block of rows: text columns as arrays, numeric columns as one 2-D array"""
+
+    def __init__(self, text, numeric_names, values):
+        self.text = text
+        self.numeric_names = numeric_names
+        self.numeric_positions = {name: i for i, name in enumerate(numeric_names)}
+        self.values = values
+
+    def __len__(self):
+        return self.values.shape[0] if self.numeric_names else len(next(iter(self.text.values())))
+
+    def __getitem__(self, name):
+        if name in self.text:
+            return self.text[name]
+        return self.values[:, self.numeric_positions[name]]
+
+    def matrix(self, names):
+        """Numeric columns as a 2-D array; a view when they are adjacent in the projection"""
+        positions = [self.numeric_positions[name] for name in names]
+        if positions == list(range(positions[0], positions[0] + len(positions))):
+            return self.values[:, positions[0]:positions[-1] + 1]
+        return self.values[:, positions]
+
+def iter_chunks(path, columns=None, chunk_rows=CHUNK_ROWS, dtype=np.float64, schema=None):
+    """Yield TileChunk blocks of a tile, parsing only the projected `columns` (default: all)"""
+    schema = schema or read_schema(path)
+    columns = columns or schema.header
+    text_names = [name for name in columns if schema.kinds[name] == "id"]
+    numeric_names = [name for name in columns if schema.kinds[name] != "id"]
+    usecols = [schema.positions[name] for name in numeric_names]
+
+    with open_tile(path) as f:
+        f.readline()   # Header
+        while True:
+            lines = [line for line in islice(f, chunk_rows) if line.strip()]
+            if not lines:
+                break
+            text = {name: parse_text(lines, schema.positions[name]) for name in text_names}
+            values = parse_numeric(lines, usecols, dtype) if usecols else np.empty((len(lines), 0), dtype)
+            yield TileChunk(text, numeric_names, values)
+
+def read_columns(path, columns, dtype=np.float64):
+    """Whole projected columns of a tile as {name: array}"""
+    parts = {name: [] for name in columns}
+    for chunk in iter_chunks(path, columns, dtype=dtype):
+        for name in columns:
+            parts[name].append(chunk[name])
+    return {name: np.concatenate(arrays) if arrays else np.array([]) for name, arrays in parts.items()}
@@ -0,0 +1,194 @@
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Configuration
+MAX_ACTIVE = int(os.environ.get("EGMS_DOWNLOAD_SLOTS", "4"))   # Upstream downloads in flight across all classes
+RESERVED_SLOTS = 1   # Slots only interactive work may take, so it never waits behind bulk downloads
+INTERACTIVE = "interactive"
+
+# weight: share of the slots while classes compete (weighted fair queuing)
+# cap: downloads of the class in flight at most
+# max_queued: beyond this the oldest queued work of the class is preempted (None = unbounded)
+PRIORITY_CLASSES = {
+    INTERACTIVE: {"weight": 8, "cap": MAX_ACTIVE, "max_queued": None},
+    "batch":     {"weight": 2, "cap": 2, "max_queued": None},
+    "prefetch":  {"weight": 1, "cap": 1, "max_queued": 16},
+}
+
+class Preempted(Exception):
+    """Raised for queued work that was dropped in favour of more urgent downloads"""
+
+class Ticket:
+    """One queued unit of work: a function to run, or a caller waiting for a slot"""
+
+    def __init__(self, priority, cost=1, tag=None, fn=None, args=(), kwargs=None):
+        self.priority = priority
+        self.cost = cost
+        self.tag = tag
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.future = Future()
+        self.granted = threading.Event()
+        self.preempted = False
+        self.finish = 0.0
+        self.enqueued = time.monotonic()
+
+class DownloadScheduler:
+    """Hands out upstream download slots by priority class
+
+    Queued work is ordered by weighted fair queuing: each ticket gets a virtual
+    finish time of start + cost / weight, and the smallest finish among the
+    classes under their cap goes next. A long batch queue therefore only delays
+    an interactive request by the downloads already running, and RESERVED_SLOTS
+    keeps one of those free for it.
+    """
+
+    def __init__(self, max_active=MAX_ACTIVE, classes=PRIORITY_CLASSES, reserved=RESERVED_SLOTS):
+        self.max_active = max_active
+        self.classes = classes
+        self.bulk_slots = max(1, max_active - reserved)
+        self.lock = threading.Lock()
+        self.queues = {name: deque() for name in classes}
+        self.active = {name: 0 for name in classes}
+        self.last_finish = {name: 0.0 for name in classes}
+        self.virtual_time = 0.0
+        self.counters = {name: {"started": 0, "done": 0, "preempted": 0, "wait": 0.0} for name in classes}
+        self.executor = ThreadPoolExecutor(max_workers=max_active, thread_name_prefix="egms-download")
+
+    def _class(self, priority):
+        if priority not in self.classes:
+            raise ValueError(f"Unknown priority {priority!r}; expected one of {', '.join(self.classes)}")
+        return self.classes[priority]
+
+    def _enqueue(self, ticket):
+        settings = self._class(ticket.priority)
+        with self.lock:
+            start = max(self.virtual_time, self.last_finish[ticket.priority])
+            ticket.finish = start + ticket.cost / settings["weight"]
+            self.last_finish[ticket.priority] = ticket.finish
+            queue = self.queues[ticket.priority]
+            queue.append(ticket)
+            limit = settings.get("max_queued")
+            while limit is not None and len(queue) > limit:
+                self._preempt(queue.popleft())
+            self._dispatch()
+
+    def _eligible(self, name):
+        if self.active[name] >= self.classes[name]["cap"]:
+            return False
+        if name == INTERACTIVE:
+            return True
+        bulk_active = sum(n for other, n in self.active.items() if other != INTERACTIVE)
+        return bulk_active < self.bulk_slots
+
+    def _dispatch(self):
+        """Start queued tickets while slots are free (called with the lock held)"""
+        while sum(self.active.values()) < self.max_active:
+            heads = [(queue[0].finish, name) for name, queue in self.queues.items()
+                     if queue and self._eligible(name)]
+            if not heads:
+                return
+            _, name = min(heads)
+            ticket = self.queues[name].popleft()
+            self.virtual_time = max(self.virtual_time, ticket.finish - ticket.cost / self.classes[name]["weight"])
+            self.active[name] += 1
+            self.counters[name]["started"] += 1
+            self.counters[name]["wait"] += time.monotonic() - ticket.enqueued
+            if ticket.fn is None:
+                ticket.granted.set()
+            else:
+                self.executor.submit(self._run, ticket)
+
+    def _preempt(self, ticket):
+        """Drop a queued ticket (called with the lock held)"""
+        ticket.preempted = True
+        self.counters[ticket.priority]["preempted"] += 1
+        if ticket.fn is None:
+            ticket.granted.set()   # Wakes the waiting caller, which raises Preempted
+        elif not ticket.future.cancelled():
+            ticket.future.set_exception(Preempted(f"{ticket.priority} work {ticket.tag} preempted"))
+
+    def _run(self, ticket):
+        try:
+            if ticket.future.set_running_or_notify_cancel():
+                try:
+                    ticket.future.set_result(ticket.fn(*ticket.args, **ticket.kwargs))
+                except BaseException as e:
+                    ticket.future.set_exception(e)
+        finally:
+            self.release(ticket)
+
+    def submit(self, fn, *args, priority="batch", cost=1, tag=None, **kwargs):
+        """Run fn(*args, **kwargs) in a download slot of the given class; returns a Future"""
+        ticket = Ticket(priority, cost, tag, fn, args, kwargs)
+        self._enqueue(ticket)
+        return ticket.future
+
+    def acquire(self, priority=INTERACTIVE, cost=1, tag=None):
+        """Block until the calling thread holds a slot; raises Preempted if dropped while queued"""
+        ticket = Ticket(priority, cost, tag)
+        self._enqueue(ticket)
+        ticket.granted.wait()
+        if ticket.preempted:
+            raise Preempted(f"{priority} work {tag} preempted")
+        return ticket
+
+    def release(self, ticket):
+        with self.lock:
+            self.active[ticket.priority] -= 1
+            self.counters[ticket.priority]["done"] += 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, priority=INTERACTIVE, cost=1, tag=None):
+        """Hold a download slot for the duration of the block"""
+        ticket = self.acquire(priority, cost, tag)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def cancel_queued(self, priority, keep=None):
+        """Preempt queued (not yet running) work of a class; `keep(tag)` spares tickets. Returns the count"""
+        with self.lock:
+            queue = self.queues[priority]
+            dropped = [ticket for ticket in queue if keep is None or not keep(ticket.tag)]
+            for ticket in dropped:
+                queue.remove(ticket)
+                self._preempt(ticket)
+            return len(dropped)
+
+    def snapshot(self):
+        """{class: {"queued", "active", "done", "preempted", "mean_wait"}} for status displays"""
+        with self.lock:
+            return {name: {
+                "queued": len(self.queues[name]),
+                "active": self.active[name],
+                "done": counters["done"],
+                "preempted": counters["preempted"],
+                "mean_wait": counters["wait"] / counters["started"] if counters["started"] else 0.0,
+            } for name, counters in self.counters.items()}
+
+_shared = None
+_shared_guard = threading.Lock()
+
+def shared_scheduler():
+    """The scheduler every download path of this process goes through"""
+    global _shared
+    with _shared_guard:
+        if _shared is None:
+            _shared = DownloadScheduler()
+        return _shared
+
+if __name__ == "__main__":
+    print("=== EGMS Download Scheduler ===")
+    print(f"Slots: {MAX_ACTIVE} ({RESERVED_SLOTS} reserved for {INTERACTIVE} work)")
+    for name, settings in PRIORITY_CLASSES.items():
+        limit = settings["max_queued"]
+        print(f"  {name:<12} weight {settings['weight']:>2}  cap {settings['cap']:>2}  "
+              f"queue {'unbounded' if limit is None else limit}")
@@ -0,0 +1,258 @@
+import os
+import re
+import csv
+import json
+import glob
+import shutil
+import tempfile
+from time import sleep
+from contextlib import contextmanager
+
+from egms_codecs import COPY_CHUNK, codec_of, open_tile, strip_codec_suffix, tile_files
+from egms_download import DEFAULT_ID, download_tile, filename_prefix, parse_tile_filename
+
+# Configuration
+DOWNLOAD_BASE = "Point_downloads"
+DELTA_DIR = "Point_deltas"
+ID = DEFAULT_ID
+NEW_YEAR = "2020_2024"       # Release to sync the local collection to
+DELAY = 5                    # seconds between requests to avoid overwhelming the server
+TOLERANCE = 0.0              # Numeric changes at or below this are treated as unchanged
+KEEP_NEW_RELEASE = False     # True: keep the downloaded new release next to its delta
+EMPTY_CELL = "<empty>"       # A cell of a changed point that became empty ("" means unchanged)
+
+DELTA_FILENAME_RE = re.compile(r"^EGMS_(.+)_(\d{4}_\d{4})_to_(\d{4}_\d{4})_delta\.csv$")
+
+def scan_collection(directory=DOWNLOAD_BASE):
+    """Map every local tile key to its downloaded releases: {tile_key: {year: path}}, in any codec"""
+    collection = {}
+    for path in tile_files(directory):
+        tile_key, year = parse_tile_filename(strip_codec_suffix(path))
+        if tile_key:
+            collection.setdefault(tile_key, {})[year] = path
+    return collection
+
+def synced_releases(delta_dir=DELTA_DIR):
+    """Map tile keys to the releases stored as deltas: {tile_key: {new_year}}
+
+    A delta counts once its metadata is written, which compute_delta does last.
+    """
+    synced = {}
+    for path in glob.glob(os.path.join(delta_dir, "EGMS_*_delta.csv")):
+        match = DELTA_FILENAME_RE.match(os.path.basename(path))
+        if match and os.path.exists(os.path.splitext(path)[0] + ".json"):
+            synced.setdefault(match.group(1), set()).add(match.group(3))
+    return synced
+
+def plan_sync(collection, new_year, delta_dir=DELTA_DIR):
+    """Return [(tile_key, base_path)] for tiles having neither the new release nor a delta to it"""
+    synced = synced_releases(delta_dir)
+    plan = []
+    for tile_key, releases in sorted(collection.items()):
+        if new_year in releases or new_year in synced.get(tile_key, ()):
+            continue
+        # Diff against the most recent release we already have
+        base_year = max(releases)
+        plan.append((tile_key, releases[base_year]))
+    return plan
+
+@contextmanager
+def seekable_tile(path):
+    """Path of a plain CSV copy of a tile: the tile itself, or a temporary decompressed copy
+
+    The base release is read at the offsets of its rows, which compressed
+    streams cannot seek to cheaply.
+    """
+    if codec_of(path) == "csv":
+        yield path
+        return
+    fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".csv.tmp", dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "wb") as out, open_tile(path, "rb") as source:
+            shutil.copyfileobj(source, out, COPY_CHUNK)
+        yield tmp_path
+    finally:
+        os.remove(tmp_path)
+
+def index_rows(path):
+    """Index a release by pid -> byte offset so it can be probed while streaming the other"""
+    offsets = {}
+    with open(path, "rb") as f:
+        header = next(csv.reader([f.readline().decode("utf-8")]))
+        pid_idx = [col.lower() for col in header].index("pid")
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                row = next(csv.reader([line.decode("utf-8")]))
+                offsets[row[pid_idx]] = offset
+    return header, offsets
+
+def values_differ(old, new, tolerance=TOLERANCE):
+    """Compare two cells numerically when possible, textually otherwise"""
+    if old == new:
+        return False
+    try:
+        return abs(float(old) - float(new)) > tolerance
+    except ValueError:
+        return True
+
+def compute_delta(base_path, new_path, delta_dir=DELTA_DIR, tolerance=TOLERANCE):
+    """Stream the new release against the base and write only changed cells"""
+    os.makedirs(delta_dir, exist_ok=True)
+    tile_key, base_year = parse_tile_filename(strip_codec_suffix(base_path))
+    _, new_year = parse_tile_filename(strip_codec_suffix(new_path))
+    delta_name = f"EGMS_{tile_key}_{base_year}_to_{new_year}_delta"
+    delta_path = os.path.join(delta_dir, f"{delta_name}.csv")
+
+    counts = {"added": 0, "changed": 0, "unchanged": 0, "removed": 0}
+
+    with seekable_tile(base_path) as plain_base, \
+         open_tile(new_path) as new_file, \
+         open(plain_base, "rb") as base_file, \
+         open(delta_path, "w", newline="") as outfile:
+        base_header, base_offsets = index_rows(plain_base)
+        base_index = {col: i for i, col in enumerate(base_header)}
+        base_pid_idx = [col.lower() for col in base_header].index("pid")
+
+        reader = csv.reader(new_file)
+        writer = csv.writer(outfile)
+        new_header = next(reader)
+        pid_idx = [col.lower() for col in new_header].index("pid")
+        columns = [i for i in range(len(new_header)) if i != pid_idx]
+        # Where each new column lives in the base release (None for new epochs)
+        base_cols = [base_index.get(new_header[i]) for i in columns]
+
+        writer.writerow(["pid", "status"] + [new_header[i] for i in columns])
+
+        for row in reader:
+            if not row:
+                continue
+            pid = row[pid_idx]
+            offset = base_offsets.pop(pid, None)
+            if offset is None:
+                counts["added"] += 1
+                writer.writerow([pid, "added"] + [row[i] for i in columns])
+                continue
+
+            base_file.seek(offset)
+            base_row = next(csv.reader([base_file.readline().decode("utf-8")]))
+            cells = []
+            changed = False
+            for i, j in zip(columns, base_cols):
+                if j is None or values_differ(base_row[j], row[i], tolerance):
+                    cells.append(row[i] if row[i] != "" else EMPTY_CELL)
+                    changed = True
+                else:
+                    cells.append("")
+
+            if changed:
+                counts["changed"] += 1
+                writer.writerow([pid, "changed"] + cells)
+            else:
+                counts["unchanged"] += 1
+
+        # Points left in the index disappeared from the new release
+        for offset in base_offsets.values():
+            base_file.seek(offset)
+            base_row = next(csv.reader([base_file.readline().decode("utf-8")]))
+            counts["removed"] += 1
+            writer.writerow([base_row[base_pid_idx], "removed"] + [""] * len(columns))
+
+    metadata = {
+        "tile": tile_key,
+        "base": os.path.basename(base_path),
+        "release": os.path.basename(new_path),
+        "tolerance": tolerance,
+        "empty_cell": EMPTY_CELL,
+        "added_columns": [col for col in new_header if col not in base_index],
+        "dropped_columns": [col for col in base_header if col not in set(new_header)],
+        "counts": counts,
+    }
+    with open(os.path.join(delta_dir, f"{delta_name}.json"), "w") as f:
+        json.dump(metadata, f, indent=2)
+
+    print(f"Delta for {tile_key}: {counts}")
+    return delta_path
+
+def apply_delta(base_path, delta_path, output_file):
+    """Rebuild a release from its base file and a delta produced by compute_delta"""
+    with open(delta_path, "r", newline="") as f:
+        reader = csv.reader(f)
+        delta_header = next(reader)
+        delta = {row[0]: row for row in reader if row}
+
+    columns = delta_header[2:]
+    with open_tile(base_path) as base_file, open(output_file, "w", newline="") as outfile:
+        reader = csv.reader(base_file)
+        writer = csv.writer(outfile)
+        base_header = next(reader)
+        base_index = {col: i for i, col in enumerate(base_header)}
+        pid_idx = [col.lower() for col in base_header].index("pid")
+        writer.writerow([base_header[pid_idx]] + columns)
+
+        for row in reader:
+            if not row:
+                continue
+            change = delta.pop(row[pid_idx], None)
+            if change is not None and change[1] == "removed":
+                continue
+            cells = []
+            for k, col in enumerate(columns):
+                value = change[k + 2] if change is not None else ""
+                if value == "" and col in base_index:
+                    value = row[base_index[col]]
+                elif value == EMPTY_CELL:
+                    value = ""
+                cells.append(value)
+            writer.writerow([row[pid_idx]] + cells)
+
+        for change in delta.values():
+            if change[1] == "added":
+                writer.writerow([change[0]] + change[2:])
+
+    return output_file
+
+def sync_collection(directory=DOWNLOAD_BASE, new_year=NEW_YEAR, id=ID, delay=DELAY):
+    """Download only the tiles missing the new release and store per-point deltas
+
+    Unless KEEP_NEW_RELEASE is set, the downloaded release is deleted once its
+    delta is written; apply_delta() rebuilds it from the base when needed.
+    """
+    plan = plan_sync(scan_collection(directory), new_year)
+    print(f"{len(plan)} tile(s) need the {new_year} release")
+
+    synced = 0
+    for i, (tile_key, base_path) in enumerate(plan, 1):
+        print(f"\n[{i}/{len(plan)}] Syncing {filename_prefix(tile_key, new_year)}...")
+        new_path = download_tile(tile_key, new_year, id, directory)
+        if new_path:
+            try:
+                compute_delta(base_path, new_path)
+                synced += 1
+                if not KEEP_NEW_RELEASE:
+                    os.remove(new_path)
+            except Exception as e:
+                print(f"Error computing delta for {tile_key}: {e}")
+                # Left in place, the release would make plan_sync skip the tile for good
+                if not KEEP_NEW_RELEASE:
+                    os.remove(new_path)
+
+        if i < len(plan):
+            print(f"Waiting {delay} seconds before next request...")
+            sleep(delay)
+
+    return synced
+
+if __name__ == "__main__":
+    print("=== EGMS Release Sync Tool ===")
+    collection = scan_collection()
+    print(f"Local collection: {len(collection)} tile(s) in {DOWNLOAD_BASE}")
+    for tile_key, base_path in plan_sync(collection, NEW_YEAR):
+        print(f"  {filename_prefix(tile_key, NEW_YEAR)} (base: {os.path.basename(base_path)})")
+
+    synced = sync_collection()
+    print(f"\n=== Sync Summary ===")
+    print(f"Tiles synced: {synced}")
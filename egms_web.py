@@ -1,21 +1,26 @@
 import streamlit as st
-import zipfile
 import os
-from io import BytesIO
+import time
 from time import sleep
-import csv
-from curl_cffi import requests as curl_requests
-import pyproj
-import glob
-from geopy.geocoders import Nominatim
+from egms_download import TileUnavailable, open_csv_stream, filename_prefix as tile_filename_prefix, l2_tile_key, l3_tile_key, probe_tiles, summarize_probes
+from egms_archive import build_batch_zip
+from egms_prefetch import PREFETCH_BUDGET, Prefetcher
+from egms_scheduler import INTERACTIVE, shared_scheduler
+from egms_metrics import REGISTRY, SIZE_BUCKETS
+from egms_memory import MemoryBudgetExceeded, buffer_pool, memory_budget
+from egms_manifest import format_manifest, manifest_entry, probe_entry
 
 # Configuration
-BASE_URL_L3 = "https://egms.land.copernicus.eu/insar-api/archive/download/EGMS_{data_type}_E{e}N{n}_100km_{d}_{year}_1.zip?id={id}"
-BASE_URL_L2 = "https://egms.land.copernicus.eu/insar-api/archive/download/EGMS_{data_type}_{relative_orbit}_{burst_cycle}_{swath}_{polarization}_{year}_1.zip?id={id}"
 DISPLACEMENTS = ["E", "U"]
 DELAY = 3.0  # seconds between requests
 DEFAULT_YEAR = "2019_2023"
 DEFAULT_ID = "fcf61f768a6141ca81d6e4851c86cf89"
+# Public address of an egms_proxy.py instance; enables "Stream CSV" links that unzip on the fly.
+# Set EGMS_STREAM_PORT as well to run that proxy inside this app.
+STREAM_URL = os.environ.get("EGMS_STREAM_URL", "")
+STREAM_PORT = os.environ.get("EGMS_STREAM_PORT", "")
+# Serve Prometheus metrics on this port (http://localhost:<port>/metrics)
+METRICS_PORT = os.environ.get("EGMS_METRICS_PORT", "")
 
 # Initialize session state variables
 if 'download_status' not in st.session_state:
@@ -26,15 +31,19 @@ if 'total_tasks' not in st.session_state:
     st.session_state.total_tasks = 0
 if 'download_ready' not in st.session_state:
     st.session_state.download_ready = False
-if 'download_data' not in st.session_state:
-    st.session_state.download_data = None
-if 'download_filename' not in st.session_state:
-    st.session_state.download_filename = ""
+if 'download_buffer' not in st.session_state:
+    st.session_state.download_buffer = None
+if 'prefetch_budget' not in st.session_state:
+    st.session_state.prefetch_budget = 0
+if 'probe_missing' not in st.session_state:
+    st.session_state.probe_missing = set()
 
 # Coordinate transformation setup - ETRS89 / LAEA Europe (EPSG:3035) to WGS84 (EPSG:4326)
 @st.cache_resource
 def init_transformer():
     try:
+        # Imported on first use: pyproj is slow to load and only needed for coordinate conversion
+        import pyproj
         return pyproj.Transformer.from_crs("EPSG:3035", "EPSG:4326", always_xy=True)
     except Exception as e:
         st.warning(f"Could not initialize coordinate transformer: {e}")
@@ -56,64 +65,246 @@ def convert_coordinates(easting, northing, transformer=None):
         st.error(f"Error converting coordinates: {e}")
         return None, None
 
-def fetch_file_data(e, n, d, data_type="L3", year=DEFAULT_YEAR, id=DEFAULT_ID, relative_orbit=None, burst_cycle=None, swath=None, polarization=None):
-    """Fetch file data for browser download"""
+@st.cache_resource
+def get_prefetcher():
+    """Tile cache and background prefetch worker shared by all sessions"""
+    return Prefetcher(scheduler=shared_scheduler())
+
+@st.cache_resource
+def start_metrics_endpoint():
+    """Metrics scrape endpoint, started once per server process"""
+    from egms_metrics import start_server
+    try:
+        return start_server(port=int(METRICS_PORT))
+    except OSError as e:
+        st.warning(f"Could not start metrics endpoint on port {METRICS_PORT}: {e}")
+        return None
+
+# Metrics of the server process; declaring them again on a rerun returns the registered ones
+TILE_REQUESTS = REGISTRY.counter("egms_tile_requests_total", "Tiles requested by sessions", ("priority", "result"))
+CSV_BYTES = REGISTRY.counter("egms_csv_bytes_total", "Tile CSV bytes handed to sessions", ("source",))
+UPSTREAM_FIRST_BYTE = REGISTRY.histogram("egms_upstream_first_byte_seconds",
+                                         "Time until EGMS starts sending a tile", ("priority",))
+UPSTREAM_SECONDS = REGISTRY.histogram("egms_upstream_fetch_seconds",
+                                      "Time to download and decompress a tile from EGMS", ("priority",))
+FETCHES_IN_FLIGHT = REGISTRY.gauge("egms_upstream_fetches_in_flight", "Tile downloads in progress")
+BYTES_IN_FLIGHT = REGISTRY.gauge("egms_upstream_bytes_in_flight", "CSV bytes received by downloads in progress")
+ZIP_SECONDS = REGISTRY.histogram("egms_batch_zip_seconds", "Time to build a batch archive")
+ZIP_BYTES = REGISTRY.histogram("egms_batch_zip_size_bytes", "Size of built batch archives", buckets=SIZE_BUCKETS)
+ZIP_MEMBERS = REGISTRY.counter("egms_batch_zip_members_total", "Files packed into batch archives")
+REGISTRY.gauge("egms_session_buffer_bytes", "Bytes held in session download buffers",
+               callback=lambda: sum(buffer.size for buffer in buffer_pool().held()))
+REGISTRY.gauge("egms_session_buffers", "Sessions holding a download buffer",
+               callback=lambda: len(buffer_pool().held()))
+REGISTRY.gauge("egms_download_queue", "Downloads waiting for a scheduler slot", ("priority",),
+               callback=lambda: {(name,): c["queued"] for name, c in shared_scheduler().snapshot().items()})
+REGISTRY.gauge("egms_download_active", "Downloads holding a scheduler slot", ("priority",),
+               callback=lambda: {(name,): c["active"] for name, c in shared_scheduler().snapshot().items()})
+
+def begin_download():
+    """Memory reservation for a download being prepared; the session's previous file is released first"""
+    if st.session_state.download_buffer is not None:
+        # This run no longer renders its download button, so Streamlit drops those bytes too
+        st.session_state.download_buffer.release()
+        st.session_state.download_buffer = None
+    st.session_state.download_ready = False
+    return memory_budget().reservation()
+
+def memory_busy(error):
+    """Stop preparing a download the server has no memory for right now"""
+    st.error(f"The server is short of memory for this download ({error}). "
+             "Try again in a moment, or select fewer files.")
+    st.stop()
+
+def hold_download(data, filename, reservation):
+    """Keep a prepared file in the session for its download button
+
+    Once idle for a while the buffer can be evicted for other sessions' downloads. Its memory is
+    given back on the session's next run, when the download button is no longer rendered.
+    """
+    st.session_state.download_buffer = buffer_pool().hold(data, filename, reservation)
+    st.session_state.download_ready = True
+
+def hold_batch(files_data, zip_name, reservation):
+    """Zip the fetched files into the session's download buffer; returns the number of files"""
+    try:
+        # The archive is at most about as large as its members, which are dropped once it is built.
+        # Members and archive together must fit the budget; otherwise this fails at once.
+        reservation.grow(sum(len(data) for _, data in files_data))
+    except MemoryBudgetExceeded as e:
+        memory_busy(e)
+    count = len(files_data)
+    zip_data = create_batch_zip(files_data, zip_name)
+    files_data.clear()
+    hold_download(zip_data, zip_name, reservation)
+    return count
+
+def held_download(zip_only=False):
+    """The session's prepared file (touched as in use), or None"""
+    buffer = st.session_state.download_buffer
+    if not st.session_state.download_ready or buffer is None:
+        return None
+    if buffer.evicted:
+        # Not rendered again from this run on, so its memory can be given back
+        buffer.release()
+        st.info(f"{buffer.filename} was released to free server memory; prepare it again to download it.")
+        return None
+    if zip_only and not buffer.filename.endswith(".zip"):
+        return None
+    buffer.touch()
+    return buffer
+
+@st.cache_resource
+def start_stream_proxy():
+    """Embedded streaming proxy, started once per server process"""
+    from egms_proxy import start_background
+    try:
+        return start_background(port=int(STREAM_PORT))
+    except OSError as e:
+        st.warning(f"Could not start streaming proxy on port {STREAM_PORT}: {e}")
+        return None
+
+def stream_link(tile_keys, year, id):
+    """Links that stream each tile's CSV through the proxy as it is decompressed"""
+    if not STREAM_URL:
+        return
+    from egms_proxy import proxy_url
+    if STREAM_PORT:
+        start_stream_proxy()
+    links = " · ".join(f"[⚡ Stream {key}]({proxy_url(STREAM_URL, key, year, id)})" for key in tile_keys)
+    st.markdown(f"{links}  \nStarts immediately; no waiting for the whole archive.")
+
+def probe_panel(tile_keys, year, id, key):
+    """Button listing which tiles of a batch exist and their sizes, without downloading them"""
+    if not st.button("🔍 Check availability", key=key):
+        return
+    with st.spinner(f"Probing {len(tile_keys)} files..."):
+        probes = probe_tiles(tile_keys, year, id)
+    found, archive_bytes, csv_bytes = summarize_probes(probes)
+    # Missing tiles are skipped by the next batch download; found ones carry their sizes into manifests
+    st.session_state.probe_missing = {(p["tile_key"], year) for p in probes if p["exists"] is False}
+    st.session_state.probe_entries = {(p["tile_key"], year): probe_entry(p, id) for p in probes if p["exists"]}
+    st.info(f"{found}/{len(tile_keys)} files available · {archive_bytes / 1024 ** 2:.1f} MB to download · "
+            f"{csv_bytes / 1024 ** 2:.1f} MB extracted")
+    st.dataframe([{
+        "File": p["tile_key"],
+        "Available": {True: "✅", False: "❌"}.get(p["exists"], "?"),
+        "Archive MB": round((p["archive_bytes"] or 0) / 1024 ** 2, 1),
+        "CSV MB": round(sum(m["size"] for m in p["members"]) / 1024 ** 2, 1),
+    } for p in probes], use_container_width=True)
+
+def manifest_button(tile_keys, year, id, key):
+    """Download the batch's tiles as a manifest, for egms.py download --manifest or a work queue"""
+    probed = st.session_state.get("probe_entries", {})
+    missing = st.session_state.get("probe_missing", set())
+    entries = [probed.get((tile_key, year)) or manifest_entry(tile_key, year, id)
+               for tile_key in tile_keys if (tile_key, year) not in missing]
+    st.download_button(
+        label="📋 Export manifest",
+        data=format_manifest(entries),
+        file_name=f"EGMS_manifest_{year}_{len(entries)}_tiles.jsonl",
+        mime="application/jsonl",
+        key=key,
+        help="Tile list with URLs (and sizes/CRCs once checked) for egms.py download --manifest"
+    )
+
+def fetch_upstream(tile_key, year, id, priority, cache):
+    """Download a tile's CSV in a scheduler slot straight into the disk cache; returns its path"""
+    with shared_scheduler().slot(priority, tag=(tile_key, year)):
+        started = time.perf_counter()
+        # Returns once the archive's first member header has arrived
+        _, stream = open_csv_stream(tile_key, year, id, timeout=300)
+        UPSTREAM_FIRST_BYTE.observe(time.perf_counter() - started, priority=priority)
+        FETCHES_IN_FLIGHT.inc()
+        received = 0
+        
+        def counted():
+            nonlocal received
+            for chunk in stream:
+                received += len(chunk)
+                BYTES_IN_FLIGHT.inc(len(chunk))
+                yield chunk
+        
+        try:
+            path = cache.put_stream(tile_key, year, counted())
+        finally:
+            BYTES_IN_FLIGHT.dec(received)
+            FETCHES_IN_FLIGHT.dec()
+        UPSTREAM_SECONDS.observe(time.perf_counter() - started, priority=priority)
+    return path
+
+def fetch_file_data(e, n, d, data_type="L3", year=DEFAULT_YEAR, id=DEFAULT_ID, relative_orbit=None, burst_cycle=None, swath=None, polarization=None, prefetch=False, priority=INTERACTIVE, reservation=None):
+    """Fetch file data for browser download, queued at the given scheduler priority
+
+    The whole CSV is read into memory under `reservation` (see begin_download);
+    only stream_link() streams a tile to the browser without buffering it.
+    """
     
     if data_type == "L3":
-        tile_code = f"E{e}N{n}"
-        filename_prefix = f"EGMS_{data_type}_{tile_code}_100km_{d}_{year}_1"
-        url = BASE_URL_L3.format(data_type=data_type, e=e, n=n, d=d, year=year, id=id)
+        tile_key = l3_tile_key(e, n, d)
     else:
         if not all([relative_orbit, burst_cycle, swath, polarization]):
             st.error(f"Missing parameters for {data_type} download")
             return None, None
         
-        filename_prefix = f"EGMS_{data_type}_{relative_orbit}_{burst_cycle}_{swath}_{polarization}_{year}_1"
-        url = BASE_URL_L2.format(
-            data_type="L2a" if data_type == "L2A" else "L2b", 
-            relative_orbit=relative_orbit, 
-            burst_cycle=burst_cycle, 
-            swath=swath, 
-            polarization=polarization, 
-            year=year, 
-            id=id
-        )
+        try:
+            tile_key = l2_tile_key(data_type, relative_orbit, burst_cycle, swath, polarization)
+        except ValueError:
+            st.error(f"Relative orbit and burst cycle must be numbers for {data_type} download")
+            return None, None
+    
+    filename_prefix = tile_filename_prefix(tile_key, year)
+    prefetcher = get_prefetcher()
+    reservation = reservation or memory_budget().reservation()
     
     try:
-        with st.spinner(f"Fetching {filename_prefix}..."):
-            response = curl_requests.get(url, timeout=300)
-            
-            if response.status_code != 200:
-                st.error(f"Failed to fetch {filename_prefix} (Status: {response.status_code})")
-                return None, None
-            
-            # Extract CSV from zip in memory
-            with zipfile.ZipFile(BytesIO(response.content)) as z:
-                for name in z.namelist():
-                    if name.endswith(".csv") and filename_prefix in name:
-                        csv_data = z.read(name)
-                        csv_filename = name
-                        st.success(f"Successfully fetched {csv_filename}")
-                        return csv_data, csv_filename
-            
-            st.error(f"No matching CSV found in the downloaded zip for {filename_prefix}")
-            return None, None
+        source = "cache"
+        if not prefetcher.cache.contains(tile_key, year):
+            # Upstream downloads of all sessions share the scheduler's slots and go to disk first
+            with st.spinner(f"Fetching {filename_prefix}..."):
+                fetch_upstream(tile_key, year, id, priority, prefetcher.cache)
+            source = "upstream"
+        
+        # Read into memory only once it fits the budget; idle sessions' files may be evicted for it
+        reservation.grow(prefetcher.cache.size(tile_key, year) or 0)
+        cached = prefetcher.cache.get(tile_key, year)
+        if cached is None:
+            raise RuntimeError("evicted from the local cache while loading, please retry")
+        csv_data, csv_filename = cached
+        TILE_REQUESTS.inc(priority=priority, result="cache_hit" if source == "cache" else "upstream")
+        CSV_BYTES.inc(len(csv_data), source=source)
+        if source == "cache":
+            st.success(f"Loaded {csv_filename} from cache")
+        else:
+            st.success(f"Successfully fetched {csv_filename}")
+        
+        # Warm the cache with neighbouring tiles the user is likely to request next
+        if prefetch and st.session_state.prefetch_budget > 0:
+            prefetcher.warm(tile_key, year, id, st.session_state.prefetch_budget)
+        
+        return csv_data, csv_filename
+    
+    except MemoryBudgetExceeded as e:
+        TILE_REQUESTS.inc(priority=priority, result="memory_busy")
+        memory_busy(e)
+    
+    except TileUnavailable as e:
+        TILE_REQUESTS.inc(priority=priority, result="unavailable")
+        st.error(str(e))
+        return None, None
     
     except Exception as e:
+        TILE_REQUESTS.inc(priority=priority, result="error")
         st.error(f"Error fetching {filename_prefix}: {e}")
         return None, None
 
 def create_batch_zip(files_data, batch_name):
-    """Create a zip file containing multiple CSV files"""
-    zip_buffer = BytesIO()
-    
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for filename, data in files_data:
-            if data is not None:
-                zip_file.writestr(filename, data)
-    
-    zip_buffer.seek(0)
-    return zip_buffer.getvalue()
+    """Create a zip file containing multiple CSV files (members compressed in parallel)"""
+    with ZIP_SECONDS.time():
+        zip_data = build_batch_zip(files_data)
+    ZIP_BYTES.observe(len(zip_data))
+    ZIP_MEMBERS.inc(len(files_data))
+    return zip_data
 
 def main():
     st.set_page_config(
@@ -138,6 +329,22 @@ def main():
     
     st.title("🌍 EGMSweb")
     
+    if METRICS_PORT:
+        start_metrics_endpoint()
+    
+    with st.sidebar:
+        st.subheader("Prefetch")
+        st.session_state.prefetch_budget = st.slider(
+            "Neighbouring tiles to warm after each single-file fetch (0 = off)",
+            min_value=0, max_value=8, value=st.session_state.prefetch_budget or 0
+        )
+        st.caption(f"Suggested: {PREFETCH_BUDGET}. Neighbours are downloaded in the background into a shared local cache.")
+        
+        st.subheader("Download queue")
+        for name, counts in shared_scheduler().snapshot().items():
+            st.caption(f"**{name}**: {counts['active']} running · {counts['queued']} queued · "
+                       f"mean wait {counts['mean_wait']:.1f}s")
+    
     col1, col2 = st.columns(2)
     
     with col1:
@@ -193,20 +400,23 @@ def main():
                 with col_token:
                     id_value = st.text_input("Token", value=DEFAULT_ID)
                 
+                if relative_orbit.isdigit() and burst_cycle.isdigit():
+                    stream_link([l2_tile_key(data_type, relative_orbit, burst_cycle, swath, polarization)], year, id_value)
+                
                 # Download button
                 if st.button("🔄 Prepare Download", key="prepare_l2_single"):
-                    csv_data, csv_filename = fetch_file_data(0, 0, "", data_type, year, id_value, relative_orbit, burst_cycle, swath, polarization)
+                    reservation = begin_download()
+                    csv_data, csv_filename = fetch_file_data(0, 0, "", data_type, year, id_value, relative_orbit, burst_cycle, swath, polarization, prefetch=True, reservation=reservation)
                     if csv_data and csv_filename:
-                        st.session_state.download_data = csv_data
-                        st.session_state.download_filename = csv_filename
-                        st.session_state.download_ready = True
+                        hold_download(csv_data, csv_filename, reservation)
                 
                 # Show download button if data is ready
-                if st.session_state.download_ready and st.session_state.download_data:
+                held = held_download()
+                if held:
                     st.download_button(
                         label="💾 Download File",
-                        data=st.session_state.download_data,
-                        file_name=st.session_state.download_filename,
+                        data=held.data,
+                        file_name=held.filename,
                         mime="text/csv",
                         key="download_l2_single"
                     )
@@ -237,8 +447,12 @@ def main():
                 with col_token:
                     id_value = st.text_input("Token", value=DEFAULT_ID)
                 
+                stream_displacements = ["E", "U"] if disp_choice == "Both" else [disp_choice]
+                stream_link([l3_tile_key(e_coord, n_coord, d) for d in stream_displacements], year, id_value)
+                
                 # Download button
                 if st.button("🔄 Prepare Download", key="prepare_l3_single"):
+                    reservation = begin_download()
                     if disp_choice == "Both":
                         displacements = ["E", "U"]
                     else:
@@ -253,7 +467,7 @@ def main():
                         progress_bar.progress(progress)
                         status_placeholder.text(f"Fetching {d} displacement data...")
                         
-                        csv_data, csv_filename = fetch_file_data(e_coord, n_coord, d, "L3", year, id_value)
+                        csv_data, csv_filename = fetch_file_data(e_coord, n_coord, d, "L3", year, id_value, prefetch=True, reservation=reservation)
                         if csv_data and csv_filename:
                             files_data.append((csv_filename, csv_data))
                         
@@ -265,25 +479,22 @@ def main():
                     if files_data:
                         if len(files_data) == 1:
                             # Single file
-                            st.session_state.download_data = files_data[0][1]
-                            st.session_state.download_filename = files_data[0][0]
+                            hold_download(files_data[0][1], files_data[0][0], reservation)
                         else:
                             # Multiple files - create zip
                             zip_name = f"EGMS_L3_E{e_coord}N{n_coord}_{year}_batch.zip"
-                            zip_data = create_batch_zip(files_data, zip_name)
-                            st.session_state.download_data = zip_data
-                            st.session_state.download_filename = zip_name
+                            hold_batch(files_data, zip_name, reservation)
                         
-                        st.session_state.download_ready = True
                         status_placeholder.text("✅ Ready for download!")
                 
                 # Show download button if data is ready
-                if st.session_state.download_ready and st.session_state.download_data:
-                    file_type = "application/zip" if st.session_state.download_filename.endswith('.zip') else "text/csv"
+                held = held_download()
+                if held:
+                    file_type = "application/zip" if held.filename.endswith('.zip') else "text/csv"
                     st.download_button(
                         label="💾 Download File",
-                        data=st.session_state.download_data,
-                        file_name=st.session_state.download_filename,
+                        data=held.data,
+                        file_name=held.filename,
                         mime=file_type,
                         key="download_l3_single"
                     )
@@ -327,7 +538,14 @@ def main():
                 
                 st.info(f"This will attempt to download {total_files} files from {total_tiles} tiles")
                 
+                batch_displacements = ["E", "U"] if disp_choice == "Both" else [disp_choice]
+                batch_keys = [l3_tile_key(e, n, d) for e in range(min_e, max_e + 1)
+                              for n in range(min_n, max_n + 1) for d in batch_displacements]
+                probe_panel(batch_keys, year, id_value, key="probe_l3_batch")
+                manifest_button(batch_keys, year, id_value, key="manifest_l3_batch")
+                
                 if st.button("🔄 Prepare Batch Download", key="prepare_l3_batch"):
+                    reservation = begin_download()
                     if disp_choice == "Both":
                         displacements = ["E", "U"]
                     else:
@@ -348,7 +566,10 @@ def main():
                                 progress_bar.progress(progress)
                                 status_placeholder.text(f"Fetching E{e}N{n} {d} ({task_count}/{total_tasks})")
                                 
-                                csv_data, csv_filename = fetch_file_data(e, n, d, "L3", year, id_value)
+                                if (l3_tile_key(e, n, d), year) in st.session_state.probe_missing:
+                                    continue  # Known missing from the availability check
+                                
+                                csv_data, csv_filename = fetch_file_data(e, n, d, "L3", year, id_value, priority="batch", reservation=reservation)
                                 if csv_data and csv_filename:
                                     files_data.append((csv_filename, csv_data))
                                 
@@ -359,20 +580,18 @@ def main():
                     
                     if files_data:
                         zip_name = f"EGMS_L3_E{min_e}-{max_e}_N{min_n}-{max_n}_{year}_batch.zip"
-                        zip_data = create_batch_zip(files_data, zip_name)
-                        st.session_state.download_data = zip_data
-                        st.session_state.download_filename = zip_name
-                        st.session_state.download_ready = True
-                        status_placeholder.text(f"✅ Ready! {len(files_data)} files prepared for download")
+                        prepared = hold_batch(files_data, zip_name, reservation)
+                        status_placeholder.text(f"✅ Ready! {prepared} files prepared for download")
                     else:
                         status_placeholder.text("❌ No files could be downloaded")
                 
                 # Show download button if data is ready
-                if st.session_state.download_ready and st.session_state.download_data and st.session_state.download_filename.endswith('.zip'):
+                held = held_download(zip_only=True)
+                if held:
                     st.download_button(
                         label="💾 Download Batch ZIP",
-                        data=st.session_state.download_data,
-                        file_name=st.session_state.download_filename,
+                        data=held.data,
+                        file_name=held.filename,
                         mime="application/zip",
                         key="download_l3_batch"
                     )
@@ -429,7 +648,16 @@ def main():
                 
                 if not selected_swaths or not selected_polarizations:
                     st.warning("Please select at least one swath and one polarization.")
-                elif st.button("🔄 Prepare L2 Batch Download", key="prepare_l2_batch"):
+                else:
+                    batch_keys = [l2_tile_key(data_type, orbit, burst, swath, polarization)
+                                  for orbit in range(min_relative_orbit, max_relative_orbit + 1)
+                                  for burst in range(min_burst_cycle, max_burst_cycle + 1)
+                                  for swath in selected_swaths for polarization in selected_polarizations]
+                    probe_panel(batch_keys, year, id_value, key="probe_l2_batch")
+                    manifest_button(batch_keys, year, id_value, key="manifest_l2_batch")
+                
+                if selected_swaths and selected_polarizations and st.button("🔄 Prepare L2 Batch Download", key="prepare_l2_batch"):
+                    reservation = begin_download()
                     files_data = []
                     progress_bar = st.progress(0)
                     status_placeholder = st.empty()
@@ -450,9 +678,13 @@ def main():
                                     progress_bar.progress(progress)
                                     status_placeholder.text(f"Fetching {data_type}_{rel_orbit_str}_{burst_cycle_str}_{swath}_{polarization} ({task_count}/{total_combinations})")
                                     
+                                    if (l2_tile_key(data_type, rel_orbit, burst_cycle, swath, polarization), year) in st.session_state.probe_missing:
+                                        continue  # Known missing from the availability check
+                                    
                                     csv_data, csv_filename = fetch_file_data(
                                         0, 0, "", data_type, year, id_value, 
-                                        rel_orbit_str, burst_cycle_str, swath, polarization
+                                        rel_orbit_str, burst_cycle_str, swath, polarization, priority="batch",
+                                        reservation=reservation
                                     )
                                     if csv_data and csv_filename:
                                         files_data.append((csv_filename, csv_data))
@@ -464,20 +696,18 @@ def main():
                     
                     if files_data:
                         zip_name = f"EGMS_{data_type}_batch_{year}.zip"
-                        zip_data = create_batch_zip(files_data, zip_name)
-                        st.session_state.download_data = zip_data
-                        st.session_state.download_filename = zip_name
-                        st.session_state.download_ready = True
-                        status_placeholder.text(f"✅ Ready! {len(files_data)} files prepared for download")
+                        prepared = hold_batch(files_data, zip_name, reservation)
+                        status_placeholder.text(f"✅ Ready! {prepared} files prepared for download")
                     else:
                         status_placeholder.text("❌ No files could be downloaded")
                 
                 # Show download button if data is ready
-                if st.session_state.download_ready and st.session_state.download_data and st.session_state.download_filename.endswith('.zip'):
+                held = held_download(zip_only=True)
+                if held:
                     st.download_button(
                         label="💾 Download L2 Batch ZIP",
-                        data=st.session_state.download_data,
-                        file_name=st.session_state.download_filename,
+                        data=held.data,
+                        file_name=held.filename,
                         mime="application/zip",
                         key="download_l2_batch"
                     )
@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import multiprocessing
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import egms_cluster
+from egms_cluster import WorkQueue, run_local
+
+# Worker processes only see a stub runner registered in the parent when they are forked
+forked = pytest.mark.skipif(multiprocessing.get_start_method() != "fork", reason="needs forked workers")
+
+def run_stub(payload):
+    """Record the run in a shared log; payloads with "fail" report a failure"""
+    with open(payload["log"], "a") as f:
+        f.write(f"{payload['key']}\n")
+    return not payload.get("fail"), payload["key"]
+
+@pytest.fixture
+def stub_runner(monkeypatch):
+    monkeypatch.setitem(egms_cluster.RUNNERS, "stub", run_stub)
+    monkeypatch.setattr(egms_cluster, "POLL_SECONDS", 0.05)
+
+def stub_tasks(log, keys, fail=False):
+    return [(key, {"command": "stub", "log": log, "key": key, "fail": fail}) for key in keys]
+
+@forked
+def test_run_local_completes_each_task_once(tmp_path, stub_runner):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"))
+    log = str(tmp_path / "runs.log")
+    keys = [f"tile-{i}" for i in range(40)]
+    assert queue.enqueue(stub_tasks(log, keys)) == 40
+    assert queue.enqueue(stub_tasks(log, keys[:5])) == 0
+
+    assert run_local(queue.path, processes=2, concurrency=2) == 0
+
+    with open(log) as f:
+        runs = f.read().split()
+    assert sorted(runs) == sorted(keys)
+    assert queue.counts() == {"queued": 0, "leased": 0, "done": 40, "failed": 0}
+    workers = queue.workers()
+    assert len(workers) == 2
+    assert sum(worker["done"] for worker in workers) == 40
+
+@forked
+def test_run_local_reports_failed_tasks(tmp_path, stub_runner):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"))
+    log = str(tmp_path / "runs.log")
+    queue.enqueue(stub_tasks(log, ["good"]) + stub_tasks(log, ["bad"], fail=True))
+
+    assert run_local(queue.path, processes=2) == 1
+
+    with open(log) as f:
+        runs = f.read().split()
+    assert runs.count("bad") == egms_cluster.MAX_ATTEMPTS
+    assert runs.count("good") == 1
+    assert queue.failures() == [("bad", "bad")]
+
+def test_expired_lease_is_leased_again(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"), lease_seconds=0.05)
+    queue.enqueue([("tile", {"command": "stub"})])
+    for worker in ("slow", "fast"):
+        queue.heartbeat(worker)
+
+    first = queue.lease("slow")
+    assert queue.lease("fast") is None
+    time.sleep(0.1)
+    second = queue.lease("fast")
+    assert (second.id, second.attempts) == (first.id, 2)
+
+    # The first worker's result arrives too late and is discarded
+    assert queue.complete(first, "slow", True) is False
+    assert queue.complete(second, "fast", True) is True
+    assert queue.counts()["done"] == 1
+    assert {worker["name"]: worker["done"] for worker in queue.workers()} == {"slow": 0, "fast": 1}
+
+def test_task_stops_at_max_attempts(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"), lease_seconds=0.05, max_attempts=3)
+    queue.enqueue([("failing", {"command": "stub"}), ("abandoned", {"command": "stub"})])
+
+    for attempt in range(1, 4):
+        task = queue.lease("worker")
+        assert (task.key, task.attempts) == ("failing", attempt)
+        queue.complete(task, "worker", False, "boom")
+    assert queue.failures() == [("failing", "boom")]
+
+    # Leases that keep expiring use up the attempts too
+    for attempt in range(1, 4):
+        task = queue.lease("worker")
+        assert (task.key, task.attempts) == ("abandoned", attempt)
+        time.sleep(0.1)
+    assert queue.lease("worker") is None
+    assert queue.counts() == {"queued": 0, "leased": 0, "done": 0, "failed": 2}
@@ -0,0 +1,62 @@
+import os
+import sys
+import csv
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from egms_packed import load_packed, pack_tile
+from egms_reader import read_columns, read_schema
+
+DATES = ["20190106", "20190118", "20190130", "20190211"]
+
+def write_l2_tile(directory):
+    """A small L2A tile: geographic and projected coordinates with full precision"""
+    path = os.path.join(directory, "EGMS_L2a_052_0716_IW2_VV_2019_2023_1.csv")
+    rows = [
+        ["1a", "45.1234567", "7.6543210", "4321234.56", "2543210.12", "251.3", "-1.25", "0.0", "-0.4", "", "-1.9"],
+        # Less than 100 m from the first point: distinct only beyond 3 decimals
+        ["1b", "45.1234589", "7.6543298", "4321234.81", "2543210.37", "251.1", "-1.31", "0.0", "-0.3", "-1.1", "-2.0"],
+        ["1c", "45.123456789012", "7.65432101234567", "4321235.123456", "2543211.5", "250.9", "0.4", "0.0", "0.2", "0.1", ""],
+    ]
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["pid", "latitude", "longitude", "easting", "northing", "height", "mean_velocity"] + DATES)
+        writer.writerows(rows)
+    return path
+
+def test_l2_coordinates_round_trip_exactly(tmp_path):
+    tile = write_l2_tile(str(tmp_path))
+    packed = pack_tile(tile, str(tmp_path / "packed"))
+    expected = read_columns(tile, read_schema(tile).header)
+    decoded = load_packed(packed)
+
+    for name in ["latitude", "longitude", "easting", "northing"]:
+        assert decoded[name].dtype == np.float64
+        assert np.array_equal(decoded[name], expected[name]), name
+    assert len(set(zip(decoded["latitude"], decoded["longitude"]))) == 3
+    assert list(decoded["pid"]) == ["1a", "1b", "1c"]
+
+def test_displacement_round_trip_with_gaps(tmp_path):
+    tile = write_l2_tile(str(tmp_path))
+    decoded = load_packed(pack_tile(tile, str(tmp_path / "packed")), start="20190118", end="20190211")
+    expected = read_columns(tile, DATES)
+
+    assert list(decoded["dates"]) == DATES[1:]
+    matrix = np.stack([expected[date] for date in DATES[1:]], axis=1).astype(np.float32)
+    assert np.array_equal(decoded["displacement"], matrix, equal_nan=True)
+
+def test_small_attribute_values_keep_their_decimals(tmp_path):
+    path = str(tmp_path / "EGMS_L3_E32N31_100km_U_2019_2023_1.csv")
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["pid", "easting", "northing", "mean_velocity_std", "rmse"] + DATES)
+        writer.writerow(["a", "3200050", "3100050", "0.0004", "12.0004", "0.0", "0.1", "0.2", "0.3"])
+        writer.writerow(["b", "3200150", "3100050", "0.0009", "-3.0009", "0.0", "-0.1", "", "-0.3"])
+        writer.writerow(["c", "3200250", "3100050", "0.0002", "1.5", "0.0", "12.001", "-3.001", "0.002"])
+    decoded = load_packed(pack_tile(path, str(tmp_path / "packed")))
+
+    assert np.array_equal(decoded["mean_velocity_std"], np.array([0.0004, 0.0009, 0.0002], np.float32))
+    assert np.array_equal(decoded["rmse"], np.array([12.0004, -3.0009, 1.5], np.float32))
+    assert np.array_equal(decoded["displacement"][2], np.array([0.0, 12.001, -3.001, 0.002], np.float32))